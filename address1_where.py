@@ -1,49 +1,23 @@
 import argparse
 import csv
-import os
 from pathlib import Path
 
-import requests
-from dotenv import load_dotenv
-
-
-load_dotenv()
-
-GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
-API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
-
-
-def geocode_address(address: str, region: str = "jp", language: str = "ja") -> dict[str, object]:
-    if not API_KEY:
-        raise RuntimeError("GOOGLE_MAPS_API_KEY is not set in .env")
-
-    params = {
-        "address": address,
-        "key": API_KEY,
-        "region": region,
-        "language": language,
-    }
-    resp = requests.get(GEOCODE_URL, params=params, timeout=15)
-    resp.raise_for_status()
-    data = resp.json()
-
-    status = data.get("status")
-    if status != "OK":
-        return {
-            "address1": address,
-            "lat1": "",
-            "lon1": "",
-            "error": status or "UNKNOWN_ERROR",
-        }
-
-    result = data["results"][0]
-    loc = result["geometry"]["location"]
-    return {
-        "address1": address,
-        "lat1": loc["lat"],
-        "lon1": loc["lng"],
-        "error": "",
-    }
+from geocoder import get_geocoder
+
+
+def geocode_address(
+    address: str,
+    region: str = "jp",
+    language: str = "ja",
+    timeout: float = 15,
+    extra_keys: tuple[str, ...] = (),
+) -> dict[str, object]:
+    """
+    address -> {address1, lat1, lon1, error}（GEOCODER_BACKEND の backend を使う）
+    extra_keys に "formatted_address" などを渡すとその値も返す
+    """
+    geo = get_geocoder().geocode(address, region=region, language=language, timeout=timeout)
+    return {key: geo.get(key, "") for key in ("address1", "lat1", "lon1", "error", *extra_keys)}
 
 
 def convert_csv(input_csv: str, output_csv: str, address_col: str = "address") -> None:
@@ -0,0 +1,109 @@
+import argparse
+import re
+import unicodedata
+from functools import lru_cache
+
+from zahyou_ku import KYOTO_WARDS
+
+
+# 表記ゆれを1つにそろえてから キャッシュ / geocoder のキーにする
+# 例: "京都市上京区智恵光院通一条下ル新白水丸町４６２番地の１７" -> "京都府京都市上京区智恵光院一条下る新白水丸町462-17"
+
+_KANJI_DIGITS = {"〇": 0, "一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+# 丁目 / 番地 / 号 の前の漢数字だけ変換する（"三条" "十条" などの地名はそのまま。"一番町" の 番 は町名なので除く）
+_KANJI_NUMBER_RE = re.compile(r"([〇一二三四五六七八九十百]+)(?=丁目|番地|番(?![町丁])|号)")
+# 数字の間のダッシュ類（NFKC 後に残るもの）
+_DASH_RE = re.compile(r"(?<=\d)[‐‑‒–—―−ー](?=\d)")
+_CHOME_BANCHI_RE = re.compile(r"(\d+)(?:番地?の?|の)(\d+)号?")
+_TRAILING_BANCHI_RE = re.compile(r"(\d+)(?:番地|番(?![町丁]))")
+# 号 は丁目 / 番地の続き（"3丁目5号" "5-12号"）のときだけ落とす（"国道1号" などはそのまま）
+_TRAILING_GOU_RE = re.compile(r"((?:丁目|-)\d+)号")
+# 京都の通り名表記の向き（上ル / 下ル / 東入ル など）をそろえる
+_DIRECTION_RULES = [
+    (re.compile(r"(上|下)(?:ル|ガル|がる)"), r"\1る"),
+    (re.compile(r"(東|西)入(?:ル|る)?"), r"\1入る"),
+    (re.compile(r"(?<![東西])入ル"), "入る"),
+]
+_DIRECTION_RE = re.compile(r"(?:上る|下る|入る)")
+_OTHER_PREFECTURE_RE = re.compile(r"^(?:東京都|北海道|大阪府|.{2,3}県)")
+
+
+def _kanji_number(text: str) -> str:
+    if "十" not in text and "百" not in text:
+        # 位取りの書き方（"二〇" -> 20）
+        return "".join(str(_KANJI_DIGITS[c]) for c in text)
+    total = 0
+    for unit, scale in (("百", 100), ("十", 10)):
+        head, sep, text = text.partition(unit) if unit in text else ("", "", text)
+        if sep:
+            total += (_KANJI_DIGITS.get(head, 1) if head else 1) * scale
+    return str(total + sum(_KANJI_DIGITS.get(c, 0) for c in text))
+
+
+def _canonical_street(rest: str) -> str:
+    for pattern, repl in _DIRECTION_RULES:
+        rest = pattern.sub(repl, rest)
+    # 通り名の部分（最後の向きの語まで）の "通" / "通り" を落とす: "四条通烏丸東入る" と "四条烏丸東入る" を同じにする
+    last = None
+    for last in _DIRECTION_RE.finditer(rest):
+        pass
+    if last is None:
+        return rest
+    street = re.sub(r"通り?", "", rest[: last.start()])
+    return street + rest[last.start():]
+
+
+@lru_cache(maxsize=8192)
+def canonicalize_address(address: str) -> str:
+    """
+    NFKC・空白除去・漢数字 -> 算用数字・丁目/番地/号 の統一・通り名の向きの統一・京都府/京都市 の補完 をした住所を返す。
+    geocoder にそのまま渡せる形にしてある。
+    """
+    text = re.sub(r"\s+", "", unicodedata.normalize("NFKC", str(address)))
+    for prefix in ("日本、", "日本"):
+        if text.startswith(prefix):
+            text = text[len(prefix):]
+    if not text:
+        return ""
+
+    text = _KANJI_NUMBER_RE.sub(lambda m: _kanji_number(m.group(1)), text)
+    text = _DASH_RE.sub("-", text)
+    text = _CHOME_BANCHI_RE.sub(r"\1-\2", text)
+    text = _TRAILING_BANCHI_RE.sub(r"\1", text)
+    text = _TRAILING_GOU_RE.sub(r"\1", text)
+
+    if _OTHER_PREFECTURE_RE.match(text):
+        return _canonical_street(text)
+    rest = text[3:] if text.startswith("京都府") else text
+    city = ""
+    if rest.startswith("京都市"):
+        city, rest = "京都市", rest[3:]
+    ward = next((w for w in KYOTO_WARDS if rest.startswith(w)), "")
+    if ward:
+        city, rest = "京都市", rest[len(ward):]
+    return f"京都府{city}{ward}{_canonical_street(rest)}"
+
+
+def collapse_report(addresses: list[str]) -> dict[str, int]:
+    """
+    total: 空でない入力の件数 / unique_raw: 文字列そのままで重複を消した件数 /
+    unique: 正規化後の件数 / collapsed: 正規化で新たにまとまった件数（unique_raw - unique）
+    """
+    cleaned = [a.strip() for a in addresses if a and a.strip()]
+    unique_raw = len(set(cleaned))
+    unique = len({canonicalize_address(a) for a in cleaned})
+    return {"total": len(cleaned), "unique_raw": unique_raw, "unique": unique, "collapsed": unique_raw - unique}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="住所の表記ゆれを正規化して表示する")
+    parser.add_argument("addresses", nargs="+")
+    args = parser.parse_args()
+
+    for address in args.addresses:
+        print(f"{address} -> {canonicalize_address(address)}")
+    print(collapse_report(args.addresses))
+
+
+if __name__ == "__main__":
+    main()
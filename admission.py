@@ -0,0 +1,254 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name, "").strip()
+    return float(value) if value else default
+
+
+# 採点など重いリクエストを同時に何件まで処理するか / 何件まで待たせるか / 何秒まで待たせるか
+MAX_IN_FLIGHT = int(_env_float("ADMISSION_MAX_IN_FLIGHT", 8))
+MAX_QUEUE = int(_env_float("ADMISSION_MAX_QUEUE", 16))
+QUEUE_TIMEOUT = _env_float("ADMISSION_QUEUE_TIMEOUT", 2.0)
+# 静的ファイル・/config・キャッシュにある結果 は別の枠（重いリクエストで埋まっていても通る）
+LIGHT_MAX_IN_FLIGHT = int(_env_float("ADMISSION_LIGHT_MAX_IN_FLIGHT", 32))
+LIGHT_MAX_QUEUE = int(_env_float("ADMISSION_LIGHT_MAX_QUEUE", 64))
+# /debug/*（profile は最大60秒かかる）は別の小さい枠。/healthz はどの枠にも入れない
+DEBUG_MAX_IN_FLIGHT = 2
+# 1プロセスが同時に持つ接続（= スレッド）の上限。超えた接続はスレッドを作らずに 503 で閉じる
+MAX_CONNECTIONS = int(_env_float("ADMISSION_MAX_CONNECTIONS", 256))
+# クライアントごとの geocode の回数制限（1分あたり / まとめて使える数）。0 なら制限しない
+RATE_LIMIT_PER_MINUTE = _env_float("RATE_LIMIT_PER_MINUTE", 60)
+RATE_LIMIT_BURST = _env_float("RATE_LIMIT_BURST", 20)
+RATE_LIMIT_MAX_CLIENTS = 10000
+# リバースプロキシ（Render など）の後ろでは X-Forwarded-For の先頭をクライアントとみなす
+TRUST_PROXY = os.getenv("TRUST_PROXY", "").strip().lower() in ("1", "true", "yes")
+
+
+class AdmissionLane:
+    """
+    同時に処理する数を max_in_flight までにし、あふれた分は max_queue 件まで queue_timeout 秒待たせる。
+    それも超えたら待たせずに断る（呼び出し側が 503 + Retry-After を返す）
+    """
+
+    def __init__(self, name: str, max_in_flight: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.peak_in_flight = 0
+        self.counts = {"admitted": 0, "queued": 0, "rejected": 0, "timed_out": 0}
+        self._avg_seconds = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> bool:
+        with self._cond:
+            if self.in_flight < self.max_in_flight:
+                return self._admit()
+            if self.waiting >= self.max_queue:
+                self.counts["rejected"] += 1
+                return False
+            self.waiting += 1
+            self.counts["queued"] += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self.in_flight >= self.max_in_flight:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.counts["timed_out"] += 1
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            return self._admit()
+
+    def _admit(self) -> bool:
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        self.counts["admitted"] += 1
+        return True
+
+    def release(self, seconds: float) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            # 処理時間の移動平均（Retry-After の見積もりに使う）
+            self._avg_seconds = seconds if not self._avg_seconds else self._avg_seconds * 0.9 + seconds * 0.1
+            self._cond.notify()
+
+    def retry_after(self) -> int:
+        """
+        今の待ち行列がはけるまでの秒数の見積もり（1秒以上）
+        """
+        with self._cond:
+            backlog = self.waiting + 1
+            return max(1, math.ceil(self._avg_seconds * backlog / self.max_in_flight))
+
+    def stats(self) -> dict[str, object]:
+        with self._cond:
+            return {
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "max_in_flight": self.max_in_flight,
+                "max_queue": self.max_queue,
+                "peak_in_flight": self.peak_in_flight,
+                "avg_seconds": round(self._avg_seconds, 3),
+                **self.counts,
+            }
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RateLimiter:
+    """
+    クライアントごとの token bucket。1秒に rate 個たまり、burst 個まで持てる。
+    覚えるクライアントは max_clients まで（古いものから忘れる = 満タンに戻る）
+    """
+
+    def __init__(self, per_minute: float, burst: float, max_clients: int = RATE_LIMIT_MAX_CLIENTS):
+        self.rate = per_minute / 60.0
+        self.burst = max(burst, 1.0)
+        self.max_clients = max_clients
+        self.limited = 0
+        self._buckets: "OrderedDict[str, _Bucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def take(self, client: str, cost: float = 1.0) -> float:
+        """
+        cost 個取れたら 0、足りなければ取らずに「何秒後なら取れるか」を返す。
+        burst より大きい cost は満タンのときだけ通し、足りない分は借り（マイナス）にする
+        """
+        if not self.enabled or cost <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = _Bucket(self.burst, now)
+                while len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+                bucket.updated = now
+            self._buckets.move_to_end(client)
+            # 座標の batch など。全部の分を引くので、マイナスになった分だけ次を待たせる
+            need = min(cost, self.burst)
+            if bucket.tokens >= need:
+                bucket.tokens -= cost
+                return 0.0
+            self.limited += 1
+            return (need - bucket.tokens) / self.rate
+
+    def refund(self, client: str, cost: float = 1.0) -> None:
+        """
+        take したのに処理しなかった分（混んでいて断ったとき）を戻す
+        """
+        if not self.enabled or cost <= 0:
+            return
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is not None:
+                bucket.tokens = min(self.burst, bucket.tokens + cost)
+
+    def stats(self) -> dict[str, object]:
+        with self._lock:
+            clients = len(self._buckets)
+        return {
+            "per_minute": round(self.rate * 60, 3),
+            "burst": self.burst,
+            "clients": clients,
+            "limited": self.limited,
+        }
+
+
+class BoundedThreadingHTTPServer(ThreadingHTTPServer):
+    """
+    接続ごとにスレッドを作るが、max_connections を超えた接続はスレッドを作らずに 503 を返して閉じる
+    """
+
+    max_connections = MAX_CONNECTIONS
+    _OVERLOADED = (
+        b"HTTP/1.0 503 Service Unavailable\r\n"
+        b"Retry-After: 1\r\n"
+        b"Content-Type: application/json; charset=utf-8\r\n"
+        b"Content-Length: 31\r\n"
+        b"Connection: close\r\n\r\n"
+        b'{"error": "server overloaded"}\n'
+    )
+
+    def __init__(self, *args, **kwargs):
+        self.connections = 0
+        self.refused = 0
+        self._connections_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def process_request(self, request, client_address) -> None:
+        with self._connections_lock:
+            if self.connections >= self.max_connections:
+                self.refused += 1
+                full = True
+            else:
+                self.connections += 1
+                full = False
+        if full:
+            try:
+                # 読まずに閉じると RST になってクライアントに 503 が届かないことがあるので、届いている分は読み捨てる
+                request.setblocking(False)
+                try:
+                    request.recv(65536)
+                except OSError:
+                    pass
+                request.setblocking(True)
+                request.sendall(self._OVERLOADED)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        try:
+            super().process_request(request, client_address)
+        except BaseException:
+            self._done()
+            raise
+
+    def process_request_thread(self, request, client_address) -> None:
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._done()
+
+    def _done(self) -> None:
+        with self._connections_lock:
+            self.connections -= 1
+
+    def stats(self) -> dict[str, int]:
+        return {"connections": self.connections, "max_connections": self.max_connections, "refused": self.refused}
+
+
+# 重い（採点・geocode・再計算）リクエスト用、軽いリクエスト用、/debug/* 用の枠。プロセスごと
+SCORE_LANE = AdmissionLane("score", MAX_IN_FLIGHT, MAX_QUEUE, QUEUE_TIMEOUT)
+LIGHT_LANE = AdmissionLane("light", LIGHT_MAX_IN_FLIGHT, LIGHT_MAX_QUEUE, QUEUE_TIMEOUT)
+DEBUG_LANE = AdmissionLane("debug", DEBUG_MAX_IN_FLIGHT, 0, 0)
+LANES = {lane.name: lane for lane in (SCORE_LANE, LIGHT_LANE, DEBUG_LANE)}
+RATE_LIMITER = RateLimiter(RATE_LIMIT_PER_MINUTE, RATE_LIMIT_BURST)
+
+
+def client_id(client_address: tuple, forwarded_for: str | None) -> str:
+    if TRUST_PROXY and forwarded_for:
+        return forwarded_for.split(",")[0].strip()
+    return str(client_address[0]) if client_address else ""
@@ -0,0 +1,242 @@
+import contextvars
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator
+
+from memory_report import MEMORY
+
+
+# 何秒ごとに dataset の変更を見に行くか（0 で見に行かない = 起動時のデータのまま）
+RELOAD_INTERVAL = float(os.getenv("DATASET_RELOAD_INTERVAL", "5") or 0)
+
+
+def _stat(path: Path) -> tuple[float, int]:
+    try:
+        st = path.stat()
+    except OSError:
+        return 0.0, -1
+    return st.st_mtime, st.st_size
+
+
+def _sha256(path: Path) -> str:
+    if not path.exists():
+        return ""
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _version_of(hashes: dict[Path, str]) -> str:
+    digest = hashlib.sha256()
+    for path in sorted(hashes):
+        digest.update(f"{path.name}:{hashes[path]}\n".encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+
+class DatasetSnapshot:
+    """
+    ある時点の dataset 一式（作った索引などと、元ファイルの stat / sha256）。作ったあとは変更しない
+    """
+
+    __slots__ = ("version", "stats", "hashes", "values")
+
+    def __init__(
+        self,
+        stats: dict[Path, tuple[float, int]],
+        hashes: dict[Path, str],
+        values: dict[str, object],
+    ):
+        self.stats = stats
+        self.hashes = hashes
+        self.values = values
+        self.version = _version_of(hashes)
+
+
+class _Part:
+    __slots__ = ("paths", "build")
+
+    def __init__(self, paths: list[Path], build: Callable[[], object]):
+        self.paths = paths
+        self.build = build
+
+
+class DatasetStore:
+    """
+    dataset から作る索引などを「部品」として登録し、今の版（DatasetSnapshot）を1つの参照で持つ。
+    - 変更の検出は mtime / size を見て、変わったファイルだけ sha256 を取り直す
+    - 作り直しは部品の dict をコピーして変わった部品だけ差し替え、参照を付け替える（copy-on-write）
+    - pin() の中では最初に見た版を使い続けるので、処理中のリクエストは古い版のまま終わる
+    """
+
+    def __init__(self):
+        self._parts: dict[str, _Part] = {}
+        self._current = DatasetSnapshot({}, {}, {})
+        self._lock = threading.Lock()  # 部品の登録・遅延ビルド・差し替えを直列にする
+        self._pinned: contextvars.ContextVar[DatasetSnapshot | None] = contextvars.ContextVar(
+            "dataset_snapshot", default=None
+        )
+        self._watcher: threading.Thread | None = None
+        self.reloads = 0
+        self.last_reload: dict[str, object] = {}
+        self.last_error = ""
+
+    def _with_paths(self, snapshot: DatasetSnapshot, paths: list[Path]) -> DatasetSnapshot:
+        new_paths = [p for p in paths if p not in snapshot.hashes]
+        if not new_paths:
+            return snapshot
+        stats = dict(snapshot.stats)
+        hashes = dict(snapshot.hashes)
+        for path in new_paths:
+            stats[path] = _stat(path)
+            hashes[path] = _sha256(path)
+        return DatasetSnapshot(stats, hashes, snapshot.values)
+
+    def track(self, paths: list[Path]) -> None:
+        """
+        部品は作らないが、変わったら版を上げるファイル（リクエストごとに読まれる CSV など）
+        """
+        with self._lock:
+            self._current = self._with_paths(self._current, [Path(p) for p in paths])
+
+    def register(self, name: str, paths: list[Path], build: Callable[[], object]) -> None:
+        """
+        paths のどれかが変わったら build() で作り直す部品。最初に get() されたときに作る
+        """
+        paths = [Path(p) for p in paths]
+        with self._lock:
+            self._parts[name] = _Part(paths, build)
+            self._current = self._with_paths(self._current, paths)
+
+    def current(self) -> DatasetSnapshot:
+        return self._pinned.get() or self._current
+
+    @property
+    def version(self) -> str:
+        return self.current().version
+
+    @contextmanager
+    def pin(self) -> Iterator[DatasetSnapshot]:
+        """
+        with の中（と copy_context で渡したスレッド）では同じ版を使う。入れ子なら外側の版のまま
+        """
+        snapshot = self.current()
+        token = self._pinned.set(snapshot)
+        try:
+            yield snapshot
+        finally:
+            self._pinned.reset(token)
+
+    def get(self, name: str) -> object:
+        snapshot = self.current()
+        if name in snapshot.values:
+            return snapshot.values[name]
+        part = self._parts.get(name)
+        if part is None:
+            raise KeyError(f"unknown dataset part: {name}")
+        with self._lock:
+            latest = self._current
+            if name in latest.values and latest.version == snapshot.version:
+                return latest.values[name]
+            value = part.build()
+            # 作っている間に版が変わっていなければ今の版にも入れる
+            if latest is self._current and latest.version == snapshot.version:
+                self._current = DatasetSnapshot(latest.stats, latest.hashes, {**latest.values, name: value})
+            return value
+
+    def install(self, name: str, value: object) -> None:
+        """
+        スナップショットから読んだ部品を今の版に入れる（中身が今のファイルと同じことは呼び出し側で確認済み）
+        """
+        with self._lock:
+            latest = self._current
+            self._current = DatasetSnapshot(latest.stats, latest.hashes, {**latest.values, name: value})
+
+    def refresh(self) -> list[str]:
+        """
+        変わったファイルを探し、関係する部品だけ作り直して差し替える。作り直した部品名を返す。
+        作り直しに失敗したら（書き込み途中の CSV など）差し替えずに次の refresh でやり直す
+        """
+        old = self._current
+        stats = {path: _stat(path) for path in old.stats}
+        changed = [path for path, stat in stats.items() if stat != old.stats[path]]
+        if not changed:
+            return []
+        hashes = dict(old.hashes)
+        for path in changed:
+            hashes[path] = _sha256(path)
+        modified = {path for path in changed if hashes[path] != old.hashes[path]}
+        names = sorted(
+            name for name, part in self._parts.items() if name in old.values and modified & set(part.paths)
+        )
+
+        started = time.perf_counter()
+        values = dict(old.values)
+        try:
+            for name in names:
+                values[name] = self._parts[name].build()
+        except Exception as e:
+            self.last_error = f"{name}: {e}"
+            print(f"[dataset] reload failed, keeping {old.version}: {self.last_error}")
+            return []
+        # 作り直さなかった未ビルドの部品は次の get() で新しいファイルから作る
+        for name, part in self._parts.items():
+            if name not in names and modified & set(part.paths):
+                values.pop(name, None)
+
+        with self._lock:
+            if self._current is not old:
+                # 同時に install / 遅延ビルドがあった。次の refresh でやり直す
+                return []
+            self._current = DatasetSnapshot(stats, hashes, values)
+        self.last_error = ""
+        if modified:
+            self.reloads += 1
+            self.last_reload = {
+                "at": time.time(),
+                "files": sorted(path.name for path in modified),
+                "parts": names,
+                "seconds": round(time.perf_counter() - started, 3),
+                "from": old.version,
+                "to": self._current.version,
+            }
+            print(f"[dataset] {old.version} -> {self._current.version}: {', '.join(names) or 'no cached parts'}")
+        return names
+
+    def start_watcher(self, interval: float = RELOAD_INTERVAL) -> threading.Thread | None:
+        if interval <= 0 or self._watcher is not None:
+            return self._watcher
+
+        def _loop() -> None:
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                except Exception as e:
+                    self.last_error = str(e)
+
+        self._watcher = threading.Thread(target=_loop, name="dataset-watcher", daemon=True)
+        self._watcher.start()
+        return self._watcher
+
+    def stats(self) -> dict[str, object]:
+        snapshot = self._current
+        return {
+            "version": snapshot.version,
+            "parts": sorted(snapshot.values),
+            "reloads": self.reloads,
+            "last_reload": self.last_reload,
+            "error": self.last_error,
+            "watching": self._watcher is not None,
+        }
+
+
+# プロセスで1つ（spatial_index / server が部品を登録する）
+DATASETS = DatasetStore()
+# 施設索引・区の表など、今の版の部品ごとに "dataset:<部品名>" で測る
+MEMORY.register_group("dataset", lambda: DATASETS.current().values)
@@ -0,0 +1,320 @@
+import csv
+import os
+import re
+import unicodedata
+from pathlib import Path
+
+from kyori import haversine_m
+from spatial_index import CSV_ENCODINGS, FACILITY_CSV_PATHS
+from zahyou_ku import KYOTO_WARDS, _extract_ward_from_text
+
+
+BASE_DIR = Path(__file__).resolve().parent
+# 住所 -> 座標 の既知の組（geocode_batch.py の出力）
+GEOCODE_RESULTS_CSV_PATH = BASE_DIR / "geocode_results.csv"
+# 追加の住所点ファイル（カンマ区切りで複数可）。address/lat/lng 列か、位置参照情報の 市区町村名/大字町丁目名/緯度/経度 列
+EXTRA_ADDRESS_POINT_PATHS = [
+    Path(p.strip()) for p in os.getenv("GAZETTEER_ADDRESS_POINTS", "").split(",") if p.strip()
+]
+
+# 一致した深さ -> confidence
+MATCH_EXACT = "exact"  # 町名 + 番地まで全部一致（または施設名の完全一致）
+MATCH_BLOCK = "block"  # 町名 + 番地の途中まで一致（その下の点の重心）
+MATCH_TOWN = "town"  # 町名だけ一致（町内の点の重心）
+CONFIDENCE = {MATCH_EXACT: 1.0, MATCH_BLOCK: 0.7, MATCH_TOWN: 0.4}
+# 区の書かれていない点は、同じ町名の点が1つの区にしか無く、その重心からこの距離以内ならその区の点とみなす
+WARD_INFER_MAX_M = 1500.0
+
+_TOWN_END = "#"
+# 京都の通り名表記（"智恵光院通一条下る新白水丸町"）の向きの語。この後ろが町名
+_DIRECTION_RE = re.compile(r"(?:上る|下る|上ル|下ル|東入る?|西入る?|東入ル|西入ル|入る|入ル)")
+_PREFIXES = ("日本、", "日本", "京都府", "京都市")
+_KANJI_DIGITS = {"一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+
+
+# "京都市" の直後の区名だけを見る（"大阪市北区" などを拾わない）
+_CITY_WARD_RE = re.compile("京都市(" + "|".join(KYOTO_WARDS) + ")")
+
+
+def resolve_ward_from_text(address: str, formatted_address: str = "") -> tuple[str, str]:
+    """
+    入力住所 / geocoder の formatted_address から区を決める。返り値は (区, "input" | "geocoder")。
+    区が書かれていない・1つの文字列に複数の区がある・2つが食い違う ときは ("", "") で、座標から判定させる。
+    """
+    found = []
+    for source, text in (("input", address), ("geocoder", formatted_address)):
+        wards = set(_CITY_WARD_RE.findall(_normalize_text(text or "")))
+        if len(wards) > 1:
+            return "", ""
+        if wards:
+            found.append((wards.pop(), source))
+    if not found or any(ward != found[0][0] for ward, _source in found):
+        return "", ""
+    return found[0]
+
+
+def _normalize_text(value: object) -> str:
+    return unicodedata.normalize("NFKC", str(value)).strip()
+
+
+def _kanji_to_int(text: str) -> int:
+    # 一〜九十九（丁目に使う範囲）
+    if "十" not in text:
+        return _KANJI_DIGITS.get(text, 0)
+    tens, _, ones = text.partition("十")
+    return (_KANJI_DIGITS.get(tens, 1) if tens else 1) * 10 + _KANJI_DIGITS.get(ones, 0)
+
+
+def address_tokens(address: str) -> tuple[str, str, list[str]]:
+    """
+    住所を (区, 町名, 番地の数字列) に分ける
+    例: "京都市左京区岡崎最勝寺町13番地" -> ("左京区", "岡崎最勝寺町", ["13"])
+        "小山北上総町49番地の2" -> ("", "小山北上総町", ["49", "2"])
+    """
+    text = re.sub(r"\s+", "", _normalize_text(address))
+    for prefix in _PREFIXES:
+        if text.startswith(prefix):
+            text = text[len(prefix):]
+    ku = ""
+    for ward in KYOTO_WARDS:
+        head, sep, tail = text.partition(ward)
+        # "北区" が "上京区" の一部にならないよう、区の前は空か市名の直後だけ
+        if sep and head == "":
+            ku, text = ward, tail
+            break
+    text = re.sub(r"([一二三四五六七八九十]+)丁目", lambda m: f"{_kanji_to_int(m.group(1))}丁目", text)
+    match = re.search(r"\d", text)
+    if match is None:
+        return ku, text, []
+    return ku, text[: match.start()], re.findall(r"\d+", text[match.start():])
+
+
+class _TrieNode:
+    __slots__ = ("children", "entries", "count", "sum_lat", "sum_lon")
+
+    def __init__(self):
+        self.children: dict[str, _TrieNode] = {}
+        self.entries: list[dict[str, object]] = []
+        self.count = 0
+        self.sum_lat = 0.0
+        self.sum_lon = 0.0
+
+    def centroid(self) -> tuple[float, float]:
+        return self.sum_lat / self.count, self.sum_lon / self.count
+
+
+class AddressTrie:
+    """
+    区 -> 町名の1文字ずつ -> 町名の終わり -> 番地の数字 の順にたどる trie（区の分からない点は区 "" の下）。
+    各ノードは配下の点の重心を持つので、番地の途中までしか一致しなくても近い座標を返せる。
+    同じ町名が複数の区にあっても、別の区の点とは混ぜない。
+    """
+
+    def __init__(self):
+        self.root = _TrieNode()
+        self.size = 0
+
+    @staticmethod
+    def _path(ku: str, town: str, numbers: list[str]) -> list[str]:
+        return [ku] + list(town) + [_TOWN_END] + [str(int(n)) for n in numbers]
+
+    def insert(self, entry: dict[str, object]) -> bool:
+        ku, town, numbers = address_tokens(str(entry.get("address", "")))
+        if not town:
+            return False
+        ku = str(entry.get("ku") or ku)
+        lat, lon = float(entry["lat"]), float(entry["lon"])
+        towns = [town]
+        # 通り名付きの住所は、町名だけでも引けるように向きの語の後ろでも登録する
+        parts = _DIRECTION_RE.split(town)
+        if len(parts) > 1 and parts[-1]:
+            towns.append(parts[-1])
+        for name in towns:
+            node = self.root
+            for token in self._path(ku, name, numbers):
+                node = node.children.setdefault(token, _TrieNode())
+                node.count += 1
+                node.sum_lat += lat
+                node.sum_lon += lon
+            node.entries.append(entry)
+        self.size += 1
+        return True
+
+    def _walk(self, ku: str, town: str, numbers: list[str]) -> tuple[_TrieNode | None, _TrieNode | None, int]:
+        """
+        区の下で町名（と町名の終わり）まで一致したノードから番地をできるだけ進める。
+        返り値は (町名のノード, 最後に一致したノード, 一致した番地の数)
+        """
+        node = self.root
+        for token in [ku] + list(town) + [_TOWN_END]:
+            node = node.children.get(token)
+            if node is None:
+                return None, None, 0
+        town_node, matched = node, 0
+        for number in numbers:
+            child = node.children.get(str(int(number)))
+            if child is None:
+                break
+            node = child
+            matched += 1
+        return town_node, node, matched
+
+    @staticmethod
+    def _town_candidates(town: str) -> list[tuple[str, bool]]:
+        """
+        (町名として引く文字列, 町名として確かか)。全体と向きの語の後ろは確か。
+        それ以外の後ろの部分（前に付いた通り名などを外したつもり）は、別の短い町名に当たることもあるので確かではない
+        """
+        candidates = [(town, True)]
+        parts = _DIRECTION_RE.split(town)
+        if len(parts) > 1 and parts[-1]:
+            candidates.append((parts[-1], True))
+        candidates += [(town[start:], False) for start in range(1, len(town))]
+        return candidates
+
+    def lookup(self, address: str) -> dict[str, object] | None:
+        """
+        {lat, lon, match, confidence, entry, ku} を返す。町名が見つからなければ None。
+        町名の前に通り名などが付いていても、後ろから町名として一致する部分を探す。
+        区が合わない・住所に区が無くて町名が複数の区にある・後ろの部分で一致した ときは、番地まで一致しても town（町の重心）にする。
+        区の分からない点（区 ""）も探す
+        """
+        ku, town, numbers = address_tokens(address)
+        if not town:
+            return None
+        wards = [ku] + [ward for ward in self.root.children if ward != ku]
+        best = None
+        for name, sure in self._town_candidates(town):
+            hits = []
+            for ward in wards:
+                town_node, node, matched = self._walk(ward, name, numbers)
+                if node is not None:
+                    hits.append((bool(ku) and ward == ku, matched, town_node.count, ward, sure, town_node, node))
+            if hits:
+                # 区の合うもの、番地の深く一致したもの、点の多い区 の順
+                best = max(hits, key=lambda hit: hit[:3])
+                # 町名が1つの区（か区 "" だけ）にしか無ければ、区が書かれていなくても取り違えようがない
+                unique = len(hits) == 1 and (not ku or best[3] == "")
+                break
+        if best is None:
+            return None
+        ward_ok, matched, _count, ward, sure, town_node, node = best
+        ward_ok = ward_ok or unique
+
+        if numbers and matched == len(numbers) and node.entries:
+            match = MATCH_EXACT
+        elif matched:
+            match = MATCH_BLOCK
+        else:
+            match = MATCH_TOWN
+        if not (ward_ok and sure):
+            match, node = MATCH_TOWN, town_node
+        entry = None
+        if match == MATCH_EXACT:
+            entry = node.entries[0]
+            lat, lon = float(entry["lat"]), float(entry["lon"])
+        else:
+            lat, lon = node.centroid()
+        return {
+            "lat": lat,
+            "lon": lon,
+            "match": match,
+            "confidence": CONFIDENCE[match],
+            "entry": entry,
+            # 座標を取った区（区の分からない点なら ""）
+            "ku": ward,
+        }
+
+
+def _load_csv_rows(path: Path, encodings: list[str]) -> list[dict[str, str]]:
+    last_error = None
+    for enc in encodings:
+        try:
+            with path.open("r", newline="", encoding=enc) as f:
+                return list(csv.DictReader(f))
+        except Exception as e:
+            last_error = e
+    raise RuntimeError(f"failed to read csv: {path}") from last_error
+
+
+def _first(row: dict[str, str], keys: tuple[str, ...]) -> str:
+    for key in keys:
+        value = (row.get(key) or "").strip()
+        if value:
+            return value
+    return ""
+
+
+def address_point_from_row(row: dict[str, str]) -> dict[str, object] | None:
+    """
+    dataset の施設 CSV / geocode_results.csv / 位置参照情報 の1行を {name, address, lat, lon} にそろえる
+    """
+    address = _first(row, ("address", "addres"))
+    if not address:
+        address = _first(row, ("市区町村名",)) + _first(row, ("大字町丁目名", "大字_丁目名", "大字・丁目名"))
+    try:
+        lat = float(_first(row, ("lat", "lat1", "緯度")).replace(",", ""))
+        lon = float(_first(row, ("lng", "lon", "lon1", "経度")).replace(",", ""))
+    except ValueError:
+        return None
+    if _first(row, ("status",)) not in ("", "OK"):
+        return None
+    return {
+        "id": row.get("id", ""),
+        "name": _first(row, ("name1", "name2", "name")),
+        "address": address,
+        "lat": lat,
+        "lon": lon,
+    }
+
+
+def load_gazetteer_entries(extra_paths: list[Path] | None = None) -> list[dict[str, object]]:
+    """
+    {name, address, lat, lon, ku} のリスト。ku は住所に区名が入っているときだけ入る。
+    """
+    paths = [GEOCODE_RESULTS_CSV_PATH] + list(FACILITY_CSV_PATHS.values())
+    paths += EXTRA_ADDRESS_POINT_PATHS if extra_paths is None else extra_paths
+    entries: list[dict[str, object]] = []
+    for path in paths:
+        if not path.exists():
+            continue
+        for row in _load_csv_rows(path, CSV_ENCODINGS):
+            item = address_point_from_row(row)
+            if item is not None:
+                item["ku"] = _extract_ward_from_text(_normalize_text(item["address"])) or ""
+                entries.append(item)
+    infer_missing_wards(entries)
+    return entries
+
+
+def _town_of(address: str) -> str:
+    _ku, town, _numbers = address_tokens(address)
+    # 通り名付きなら向きの語の後ろ（町名）で比べる
+    return _DIRECTION_RE.split(town)[-1] if town else ""
+
+
+def infer_missing_wards(entries: list[dict[str, object]]) -> int:
+    """
+    施設 CSV などは住所に区が無いことが多い。同じ町名が1つの区にしか無く、
+    その区の同じ町名の点の重心から WARD_INFER_MAX_M 以内なら ku を入れる（in place）。入れた件数を返す
+    """
+    towns: dict[str, dict[str, list[float]]] = {}
+    for entry in entries:
+        town = _town_of(str(entry.get("address", "")))
+        if town and entry.get("ku"):
+            total = towns.setdefault(town, {}).setdefault(str(entry["ku"]), [0.0, 0.0, 0])
+            total[0] += float(entry["lat"])
+            total[1] += float(entry["lon"])
+            total[2] += 1
+    inferred = 0
+    for entry in entries:
+        if entry.get("ku"):
+            continue
+        wards = towns.get(_town_of(str(entry.get("address", ""))), {})
+        if len(wards) != 1:
+            continue
+        (ward, (sum_lat, sum_lon, count)), = wards.items()
+        if haversine_m(float(entry["lat"]), float(entry["lon"]), sum_lat / count, sum_lon / count) <= WARD_INFER_MAX_M:
+            entry["ku"] = ward
+            inferred += 1
+    return inferred
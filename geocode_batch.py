@@ -1,50 +1,28 @@
 import csv
-import os
 import sys
 import time
-import requests
-from dotenv import load_dotenv
+from address_canon import canonicalize_address, collapse_report
+from geocoder import get_geocoder
 
-load_dotenv()
 
-API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
-if not API_KEY:
-    raise RuntimeError("GOOGLE_MAPS_API_KEY が .env に設定されていません")
+def geocode_one(address: str, region: str = "jp", session: object | None = None) -> dict:
+    # 表記ゆれをそろえ、京都府 / 京都市 を補完（精度UP）
+    query = canonicalize_address(address)
 
-GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
-
-
-def geocode_one(address: str, region: str = "jp", session: requests.Session | None = None) -> dict:
-    # 京都府を補完（精度UP）
-    query = address if ("京都" in address) else (address + " 京都府")
-
-    params = {
-        "address": query,
-        "key": API_KEY,
-        "region": region,
-        "language": "ja",
-    }
-
-    http = session or requests
-    r = http.get(GEOCODE_URL, params=params, timeout=15)
-    data = r.json()
-
-    status = data.get("status")
-    if status != "OK":
-        return {"address": address, "query": query, "status": status, "error": data.get("error_message")}
-
-    top = data["results"][0]
-    loc = top["geometry"]["location"]
+    # session は互換のため残しているだけ（接続は geocoder backend のプールを使い回す）
+    geo = get_geocoder().geocode(query, region=region, language="ja")
+    if geo.get("error"):
+        return {"address": address, "query": query, "status": geo["error"], "error": geo.get("error_message")}
 
     return {
         "address": address,
         "query": query,
-        "status": status,
-        "formatted_address": top.get("formatted_address"),
-        "lat": loc["lat"],
-        "lng": loc["lng"],
-        "location_type": top["geometry"].get("location_type"),
-        "place_id": top.get("place_id"),
+        "status": "OK",
+        "formatted_address": geo.get("formatted_address"),
+        "lat": geo["lat1"],
+        "lng": geo["lon1"],
+        "location_type": geo.get("location_type"),
+        "place_id": geo.get("place_id"),
     }
 
 
@@ -59,28 +37,30 @@ def geocode_many(addresses: list[str], sleep_sec: float = 0.12) -> list[dict]:
     if not cleaned:
         return []
 
-    # 重複を消して API 呼び出し回数を削減（順序は維持）
-    unique_addresses = list(dict.fromkeys(cleaned))
+    # 正規化した住所で重複を消して API 呼び出し回数を削減（順序は維持）
+    unique_addresses = list(dict.fromkeys(canonicalize_address(a) for a in cleaned))
     cache: dict[str, dict] = {}
 
+    report = collapse_report(cleaned)
     print(
         f"[geocode] total={len(cleaned)} unique={len(unique_addresses)} "
-        f"saved_calls={len(cleaned) - len(unique_addresses)}",
+        f"saved_calls={len(cleaned) - len(unique_addresses)} collapsed_by_canonicalize={report['collapsed']}",
         file=sys.stderr,
     )
 
-    with requests.Session() as session:
-        for i, a in enumerate(unique_addresses, start=1):
-            cache[a] = geocode_one(a, session=session)
-            if i < len(unique_addresses):
-                time.sleep(sleep_sec)  # 連打しすぎ防止
-            if i % 100 == 0 or i == len(unique_addresses):
-                print(f"[geocode] {i}/{len(unique_addresses)}", file=sys.stderr)
+    for i, a in enumerate(unique_addresses, start=1):
+        cache[a] = geocode_one(a)
+        if i < len(unique_addresses):
+            time.sleep(sleep_sec)  # 連打しすぎ防止
+        if i % 100 == 0 or i == len(unique_addresses):
+            print(f"[geocode] {i}/{len(unique_addresses)}", file=sys.stderr)
 
     # 元の件数・順序で返す（重複はキャッシュ結果を再利用）
     results = []
     for a in cleaned:
-        results.append(dict(cache[a]))
+        item = dict(cache[canonicalize_address(a)])
+        item["address"] = a
+        results.append(item)
     return results
 
 
@@ -0,0 +1,213 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Hashable
+
+from memory_report import MEMORY, lru_trimmer
+
+
+# Google Geocoding API の status のうち「相手側の不調」とみなすもの（ZERO_RESULTS などは正常な答え）
+GOOGLE_FAILURE_STATUSES = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR", "REQUEST_DENIED"}
+
+# 結果に付ける outcome
+OUTCOME_OK = "ok"
+OUTCOME_HEDGED = "hedged"  # 遅いので2本目を出し、先に返った方を使った
+OUTCOME_RETRIED = "retried"  # 1本目が失敗したので2本目を出した
+OUTCOME_STALE = "stale"  # 失敗 / 遮断中なので前回成功した結果を返した
+OUTCOME_TIMEOUT = "timeout"
+OUTCOME_ERROR = "error"
+OUTCOME_CIRCUIT_OPEN = "circuit_open"
+# キャッシュしてよい outcome（それ以外は一時的な失敗なので次はまた問い合わせる）
+FRESH_OUTCOMES = {OUTCOME_OK, OUTCOME_HEDGED, OUTCOME_RETRIED}
+
+
+def is_google_failure(result: dict[str, object]) -> bool:
+    return str(result.get("error", "")) in GOOGLE_FAILURE_STATUSES
+
+
+class CircuitBreaker:
+    """
+    直近 window 秒の失敗率が failure_rate 以上（min_calls 件以上あるとき）になったら open。
+    cooldown 秒後に half-open で1件だけ試し、成功なら closed、失敗ならまた open。
+    """
+
+    def __init__(self, failure_rate: float = 0.5, min_calls: int = 10, window: float = 30.0, cooldown: float = 30.0):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.cooldown = cooldown
+        self.state = "closed"
+        self._opened_at = 0.0
+        self._probing = False
+        self._calls: deque[tuple[float, bool]] = deque()
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def release(self) -> None:
+        """
+        結果を数えずに終わった呼び出し（リクエスト側の締め切り切れ）の half-open の試行枠を返す
+        """
+        with self._lock:
+            self._probing = False
+
+    def record(self, success: bool) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if self.state == "half_open":
+                self._probing = False
+                if success:
+                    self.state = "closed"
+                    self._calls.clear()
+                else:
+                    self.state = "open"
+                    self._opened_at = now
+                return
+            self._calls.append((now, success))
+            while self._calls and now - self._calls[0][0] > self.window:
+                self._calls.popleft()
+            failures = sum(1 for _t, ok in self._calls if not ok)
+            if len(self._calls) >= self.min_calls and failures / len(self._calls) >= self.failure_rate:
+                self.state = "open"
+                self._opened_at = now
+
+
+class GuardedCall:
+    """
+    外部 API 呼び出しに 締め切り / ヘッジ / 失敗時の1回再試行 / サーキットブレーカー / 古い結果での代替 を付ける。
+    fetch(*args, timeout=秒) は結果 dict を返す。call() は (結果 dict, outcome) を返し、例外は投げない。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fetch: Callable[..., dict[str, object]],
+        empty_result: Callable[..., dict[str, object]],
+        is_failure: Callable[[dict[str, object]], bool] = is_google_failure,
+        deadline: float = 5.0,
+        hedge: bool = False,
+        hedge_after: float = 1.0,
+        stale_size: int = 10000,
+        breaker: CircuitBreaker | None = None,
+        max_workers: int = 16,
+    ):
+        self.name = name
+        self.fetch = fetch
+        self.empty_result = empty_result
+        self.is_failure = is_failure
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.stale_size = stale_size
+        self.breaker = breaker or CircuitBreaker()
+        self.outcomes: dict[str, int] = {}
+        self._latencies: deque[float] = deque(maxlen=200)
+        self._stale: "OrderedDict[Hashable, dict[str, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"guard-{name}")
+        # 前回成功した結果（stale 用）は MEMORY_BUDGETS の "<name>_stale" で上限を付けられる
+        MEMORY.register(f"{name}_stale", lambda: self._stale, trim=lru_trimmer(self._stale, self._lock))
+
+    def hedge_delay(self) -> float:
+        """
+        直近の成功の p95 を過ぎても返らなければヘッジする（件数が少ないうちは hedge_after）
+        """
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < 20:
+            return self.hedge_after
+        return max(samples[int(len(samples) * 0.95) - 1], 0.05)
+
+    def _attempt(self, args: tuple, deadline_at: float) -> dict[str, object]:
+        started = time.monotonic()
+        result = self.fetch(*args, timeout=max(deadline_at - started, 0.1))
+        if not self.is_failure(result):
+            with self._lock:
+                self._latencies.append(time.monotonic() - started)
+        return result
+
+    def _finish(self, key: Hashable, result: dict[str, object], outcome: str) -> tuple[dict[str, object], str]:
+        with self._lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            if outcome in FRESH_OUTCOMES and not result.get("error"):
+                self._stale[key] = result
+                self._stale.move_to_end(key)
+                while len(self._stale) > self.stale_size:
+                    self._stale.popitem(last=False)
+        return result, outcome
+
+    def _fallback(
+        self, key: Hashable, args: tuple, outcome: str, failed: dict[str, object] | None, message: str
+    ) -> tuple[dict[str, object], str]:
+        with self._lock:
+            stale = self._stale.get(key)
+        if stale is not None:
+            return self._finish(key, dict(stale), OUTCOME_STALE)
+        if failed is not None:
+            return self._finish(key, failed, outcome)
+        return self._finish(key, self.empty_result(*args, message), outcome)
+
+    def call(self, key: Hashable, *args, deadline_at: float | None = None) -> tuple[dict[str, object], str]:
+        """
+        deadline_at（time.monotonic() の時刻）はリクエスト全体の締め切り。self.deadline より早ければそちらで打ち切る
+        """
+        if not self.breaker.allow():
+            return self._fallback(key, args, OUTCOME_CIRCUIT_OPEN, None, f"{self.name.upper()}_CIRCUIT_OPEN")
+
+        own_deadline_at = time.monotonic() + self.deadline
+        cut_by_request = deadline_at is not None and deadline_at < own_deadline_at
+        deadline_at = deadline_at if cut_by_request else own_deadline_at
+        pending: set[Future] = {self._pool.submit(self._attempt, args, deadline_at)}
+        second: str | None = None
+        failed: dict[str, object] | None = None
+        message = ""
+        while pending:
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                break
+            wait_for = remaining if second or not self.hedge else min(remaining, self.hedge_delay())
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    message = str(e) or type(e).__name__
+                    continue
+                if self.is_failure(result):
+                    failed = result
+                    message = str(result.get("error", ""))
+                    continue
+                self.breaker.record(True)
+                return self._finish(key, result, second or OUTCOME_OK)
+            if second is None and deadline_at - time.monotonic() > 0:
+                if not done and self.hedge:
+                    second = OUTCOME_HEDGED
+                    pending.add(self._pool.submit(self._attempt, args, deadline_at))
+                elif not pending:
+                    second = OUTCOME_RETRIED
+                    pending.add(self._pool.submit(self._attempt, args, deadline_at))
+
+        if pending and cut_by_request:
+            # 相手が遅いのではなくリクエストの残り時間が足りなかっただけなので、ブレーカーには数えない
+            self.breaker.release()
+        else:
+            self.breaker.record(False)
+        if pending:
+            return self._fallback(key, args, OUTCOME_TIMEOUT, failed, f"{self.name.upper()}_TIMEOUT")
+        return self._fallback(key, args, OUTCOME_ERROR, failed, message or f"{self.name.upper()}_ERROR")
+
+    def stats(self) -> dict[str, object]:
+        with self._lock:
+            outcomes = dict(self.outcomes)
+            stale = len(self._stale)
+        return {"breaker": self.breaker.state, "outcomes": outcomes, "stale_entries": stale}
@@ -0,0 +1,356 @@
+import argparse
+import asyncio
+import json
+import os
+import threading
+import unicodedata
+from abc import ABC, abstractmethod
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+from gazetteer import MATCH_EXACT, AddressTrie, load_gazetteer_entries
+from memory_report import MEMORY
+from spatial_index import GridIndex
+from zahyou_ku import _extract_ward_from_text
+
+
+load_dotenv()
+
+GOOGLE_GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
+# オフライン逆 geocode で、一番近い既知地点がこれより遠ければ区は分からないとする
+GAZETTEER_REVERSE_MAX_M = 3000.0
+# hybrid: gazetteer の confidence がこれ未満なら online の geocoder に聞く
+GAZETTEER_MIN_CONFIDENCE = float(os.getenv("GAZETTEER_MIN_CONFIDENCE", "0.7") or 0.7)
+
+
+def _normalize_text(value: object) -> str:
+    return unicodedata.normalize("NFKC", str(value)).strip()
+
+
+def _not_found(address: str, error: str) -> dict[str, object]:
+    return {"address1": address, "lat1": "", "lon1": "", "error": error}
+
+
+class GeocoderBackend(ABC):
+    """
+    geocoder の共通インターフェース。
+    - geocode(address) -> {address1, lat1, lon1, error, formatted_address, ...}
+    - reverse(lat1, lon1) -> {lat1, lon1, ku, error}
+    async 版は既定ではスレッドで同期版を呼ぶ。どちらかを実装していない backend は作るときにエラーになる
+    """
+
+    name = ""
+
+    @abstractmethod
+    def geocode(
+        self, address: str, region: str = "jp", language: str = "ja", timeout: float = 15
+    ) -> dict[str, object]:
+        ...
+
+    @abstractmethod
+    def reverse(self, lat1: float, lon1: float, language: str = "ja", timeout: float = 15) -> dict[str, object]:
+        ...
+
+    async def geocode_async(
+        self, address: str, region: str = "jp", language: str = "ja", timeout: float = 15
+    ) -> dict[str, object]:
+        return await asyncio.to_thread(self.geocode, address, region, language, timeout)
+
+    async def reverse_async(
+        self, lat1: float, lon1: float, language: str = "ja", timeout: float = 15
+    ) -> dict[str, object]:
+        return await asyncio.to_thread(self.reverse, lat1, lon1, language, timeout)
+
+
+class GoogleGeocoder(GeocoderBackend):
+    """
+    Google Geocoding API。keep-alive の Session を全スレッドで共有する（接続プールを使い回す）。
+    """
+
+    name = "google"
+
+    def __init__(self, api_key: str | None = None, url: str = GOOGLE_GEOCODE_URL, pool_size: int = 32):
+        self.api_key = api_key if api_key is not None else os.getenv("GOOGLE_MAPS_API_KEY", "")
+        self.url = url
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _get(self, params: dict[str, str], timeout: float) -> dict[str, object]:
+        if not self.api_key:
+            raise RuntimeError("GOOGLE_MAPS_API_KEY is not set in .env")
+        resp = self.session.get(self.url, params={**params, "key": self.api_key}, timeout=timeout)
+        resp.raise_for_status()
+        return resp.json()
+
+    def geocode(
+        self, address: str, region: str = "jp", language: str = "ja", timeout: float = 15
+    ) -> dict[str, object]:
+        data = self._get({"address": address, "region": region, "language": language}, timeout)
+        status = data.get("status")
+        if status != "OK":
+            out = _not_found(address, status or "UNKNOWN_ERROR")
+            out["error_message"] = data.get("error_message") or ""
+            return out
+
+        top = data["results"][0]
+        loc = top["geometry"]["location"]
+        return {
+            "address1": address,
+            "lat1": loc["lat"],
+            "lon1": loc["lng"],
+            "error": "",
+            "formatted_address": top.get("formatted_address", ""),
+            "location_type": top["geometry"].get("location_type", ""),
+            "place_id": top.get("place_id", ""),
+        }
+
+    def reverse(self, lat1: float, lon1: float, language: str = "ja", timeout: float = 15) -> dict[str, object]:
+        data = self._get({"latlng": f"{lat1},{lon1}", "language": language, "region": "jp"}, timeout)
+        status = data.get("status")
+        if status != "OK":
+            return {"lat1": lat1, "lon1": lon1, "ku": "", "error": status or "UNKNOWN_ERROR"}
+
+        for result in data.get("results", []):
+            # Prefer explicit address components first.
+            for comp in result.get("address_components", []):
+                ward = _extract_ward_from_text(comp.get("long_name", ""))
+                if ward:
+                    return {"lat1": lat1, "lon1": lon1, "ku": ward, "error": ""}
+
+            # Fallback to formatted address text.
+            ward = _extract_ward_from_text(result.get("formatted_address", ""))
+            if ward:
+                return {"lat1": lat1, "lon1": lon1, "ku": ward, "error": ""}
+
+        return {"lat1": lat1, "lon1": lon1, "ku": "", "error": "KYOTO_WARD_NOT_FOUND"}
+
+
+class LocalHTTPGeocoder(GoogleGeocoder):
+    """
+    Google と同じ JSON を返す手元の HTTP サーバー（python geocoder.py --serve）を叩く。API キーは不要。
+    """
+
+    name = "local"
+
+    def __init__(self, url: str | None = None, pool_size: int = 32):
+        super().__init__(
+            api_key="local",
+            url=url or os.getenv("GEOCODER_URL", "http://127.0.0.1:8790/maps/api/geocode/json"),
+            pool_size=pool_size,
+        )
+
+
+class GazetteerGeocoder(GeocoderBackend):
+    """
+    オフラインの地名辞書（gazetteer.py）。施設名の完全一致か、町名・番地の trie で座標を返す。
+    結果には confidence（1.0 / 0.7 / 0.4）と match（exact / block / town）を付ける。
+    逆 geocode は区の分かる一番近い既知地点から区を返す。
+    """
+
+    name = "gazetteer"
+
+    def __init__(self, entries: list[dict[str, object]] | None = None):
+        self.entries = entries if entries is not None else load_gazetteer_entries()
+        self.by_name: dict[str, dict[str, object]] = {}
+        self.trie = AddressTrie()
+        for entry in self.entries:
+            name = _normalize_text(entry["name"])
+            if name:
+                self.by_name.setdefault(name, entry)
+            self.trie.insert(entry)
+        self.ward_index = GridIndex([entry for entry in self.entries if entry.get("ku")])
+
+    def lookup(self, address: str) -> dict[str, object] | None:
+        name = _normalize_text(address)
+        # canonicalize_address で "京都府" などが前に付いていても施設名で引けるようにする
+        entry = self.by_name.get(name) or self.by_name.get(name.removeprefix("京都府").removeprefix("京都市"))
+        if entry is not None:
+            return {"lat": entry["lat"], "lon": entry["lon"], "match": MATCH_EXACT, "confidence": 1.0, "entry": entry}
+        return self.trie.lookup(address)
+
+    def geocode(
+        self, address: str, region: str = "jp", language: str = "ja", timeout: float = 15
+    ) -> dict[str, object]:
+        hit = self.lookup(address)
+        if hit is None:
+            out = _not_found(address, "ZERO_RESULTS")
+            out["confidence"] = 0.0
+            return out
+        entry = hit["entry"] or {}
+        return {
+            "address1": address,
+            "lat1": hit["lat"],
+            "lon1": hit["lon"],
+            "error": "",
+            "formatted_address": entry.get("address") or entry.get("name") or address,
+            "location_type": f"GAZETTEER_{str(hit['match']).upper()}",
+            "place_id": "",
+            "confidence": hit["confidence"],
+        }
+
+    def reverse(self, lat1: float, lon1: float, language: str = "ja", timeout: float = 15) -> dict[str, object]:
+        hit = self.ward_index.nearest(lat1, lon1)
+        if hit is None or hit[0] > GAZETTEER_REVERSE_MAX_M:
+            return {"lat1": lat1, "lon1": lon1, "ku": "", "error": "KYOTO_WARD_NOT_FOUND"}
+        return {"lat1": lat1, "lon1": lon1, "ku": hit[1]["ku"], "error": ""}
+
+
+class HybridGeocoder(GeocoderBackend):
+    """
+    まず gazetteer で引き、confidence が GAZETTEER_MIN_CONFIDENCE 未満のときだけ online（google）に聞く。
+    逆 geocode は online に任せる。
+    """
+
+    name = "hybrid"
+
+    def __init__(
+        self,
+        offline: GazetteerGeocoder | None = None,
+        online: GeocoderBackend | None = None,
+        min_confidence: float = GAZETTEER_MIN_CONFIDENCE,
+    ):
+        self.offline = offline or GazetteerGeocoder()
+        self.online = online or GoogleGeocoder()
+        self.min_confidence = min_confidence
+
+    def geocode(
+        self, address: str, region: str = "jp", language: str = "ja", timeout: float = 15
+    ) -> dict[str, object]:
+        local = self.offline.geocode(address, region, language, timeout)
+        if not local.get("error") and float(local.get("confidence", 0)) >= self.min_confidence:
+            return local
+        return self.online.geocode(address, region, language, timeout)
+
+    def reverse(self, lat1: float, lon1: float, language: str = "ja", timeout: float = 15) -> dict[str, object]:
+        return self.online.reverse(lat1, lon1, language, timeout)
+
+
+GEOCODER_BACKENDS = {
+    GoogleGeocoder.name: GoogleGeocoder,
+    LocalHTTPGeocoder.name: LocalHTTPGeocoder,
+    GazetteerGeocoder.name: GazetteerGeocoder,
+    HybridGeocoder.name: HybridGeocoder,
+}
+_GEOCODER: GeocoderBackend | None = None
+_GEOCODER_LOCK = threading.Lock()
+# gazetteer / hybrid のときは住所の trie がここに入る
+MEMORY.register("geocoder", lambda: _GEOCODER)
+
+
+def get_geocoder() -> GeocoderBackend:
+    """
+    GEOCODER_BACKEND（google / local / gazetteer / hybrid、既定は google）の backend を1つだけ作って返す
+    """
+    global _GEOCODER
+    if _GEOCODER is not None:
+        return _GEOCODER
+    with _GEOCODER_LOCK:
+        if _GEOCODER is None:
+            name = os.getenv("GEOCODER_BACKEND", "google").strip().lower() or "google"
+            backend = GEOCODER_BACKENDS.get(name)
+            if backend is None:
+                raise ValueError(f"unknown GEOCODER_BACKEND: {name} / {sorted(GEOCODER_BACKENDS)}")
+            _GEOCODER = backend()
+        return _GEOCODER
+
+
+def set_geocoder(backend: GeocoderBackend) -> None:
+    global _GEOCODER
+    with _GEOCODER_LOCK:
+        _GEOCODER = backend
+
+
+def _google_payload(result: dict[str, object], reverse: bool) -> dict[str, object]:
+    """
+    backend の結果を Google Geocoding API と同じ形の JSON にする（手元サーバー用）
+    """
+    if result.get("error"):
+        return {"status": result["error"], "results": []}
+    if reverse:
+        ward = str(result["ku"])
+        return {
+            "status": "OK",
+            "results": [{"formatted_address": f"日本、京都府京都市{ward}", "address_components": [{"long_name": ward}]}],
+        }
+    return {
+        "status": "OK",
+        "results": [
+            {
+                "formatted_address": result.get("formatted_address", ""),
+                "place_id": result.get("place_id", ""),
+                "geometry": {
+                    "location": {"lat": result["lat1"], "lng": result["lon1"]},
+                    "location_type": result.get("location_type", ""),
+                },
+            }
+        ],
+    }
+
+
+def serve_stand_in(host: str, port: int, backend: GeocoderBackend | None = None) -> None:
+    """
+    Google Geocoding API の代わりになる手元サーバー（中身は既定で GazetteerGeocoder）
+    """
+    backend = backend or GazetteerGeocoder()
+
+    class StandInHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            query = parse_qs(urlparse(self.path).query)
+            address = (query.get("address", [""])[0] or "").strip()
+            latlng = (query.get("latlng", [""])[0] or "").strip()
+            try:
+                if latlng:
+                    lat1, lon1 = (float(v) for v in latlng.split(","))
+                    payload = _google_payload(backend.reverse(lat1, lon1), reverse=True)
+                elif address:
+                    payload = _google_payload(backend.geocode(address), reverse=False)
+                else:
+                    payload = {"status": "INVALID_REQUEST", "results": []}
+            except ValueError:
+                payload = {"status": "INVALID_REQUEST", "results": []}
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format: str, *args) -> None:
+            pass
+
+    httpd = ThreadingHTTPServer((host, port), StandInHandler)
+    print(f"Geocoder stand-in started: http://{host}:{port}/maps/api/geocode/json")
+    httpd.serve_forever()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="geocoder backend（google / local / gazetteer / hybrid）で住所や座標を引く")
+    parser.add_argument("--address", help="住所 -> 座標")
+    parser.add_argument("--lat1", type=float, help="緯度（--lon1 と一緒に使うと 座標 -> 区）")
+    parser.add_argument("--lon1", type=float, help="経度")
+    parser.add_argument("--backend", choices=sorted(GEOCODER_BACKENDS), help="GEOCODER_BACKEND の代わり")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="Google 互換の手元サーバーを起動する")
+    parser.add_argument("--host", default="127.0.0.1", help="--serve の bind address")
+    args = parser.parse_args()
+
+    if args.serve:
+        serve_stand_in(args.host, args.serve)
+        return
+    backend = GEOCODER_BACKENDS[args.backend]() if args.backend else get_geocoder()
+    if args.address:
+        print(backend.geocode(args.address))
+        return
+    if args.lat1 is not None and args.lon1 is not None:
+        print(backend.reverse(args.lat1, args.lon1))
+        return
+    parser.error("--address / --lat1 --lon1 / --serve のどれかを指定してください")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 from typing import Sequence
 
+import numpy as np
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 
@@ -27,6 +28,13 @@ class WeightedScoresRequest(BaseModel):
     weights: list[float]
 
 
+class WeightedBatchRequest(BaseModel):
+    # N件 × 基準数 の score 行列と、M通り × 基準数 の重み行列
+    scores: list[list[float]]
+    weights: list[list[float]]
+    top_k: int | None = None
+
+
 def weighted_score(scores: Sequence[float], weights: Sequence[float]) -> float:
     # 数式は変更しない（加重平均）
     if len(scores) != len(weights):
@@ -41,6 +49,46 @@ def weighted_score(scores: Sequence[float], weights: Sequence[float]) -> float:
     return sum(score * weight for score, weight in zip(scores, weights)) / total_weight
 
 
+def weighted_score_matrix(scores: Sequence[Sequence[float]], weights: Sequence[Sequence[float]]) -> np.ndarray:
+    """
+    weighted_score をまとめて計算する（式は同じ加重平均）
+    scores: N×C, weights: M×C -> N×M
+    """
+    score_mat = np.asarray(scores, dtype=np.float64)
+    weight_mat = np.asarray(weights, dtype=np.float64)
+    if score_mat.ndim != 2 or weight_mat.ndim != 2:
+        raise ValueError("scores and weights must be 2D matrices")
+    if score_mat.shape[0] == 0 or weight_mat.shape[0] == 0:
+        raise ValueError("scores and weights must not be empty")
+    if score_mat.shape[1] != weight_mat.shape[1]:
+        raise ValueError("scores and weights must have the same number of columns")
+
+    total_weights = weight_mat.sum(axis=1)
+    if np.any(total_weights <= 0):
+        raise ValueError("sum(weights) must be greater than 0 for every profile")
+
+    return (score_mat @ weight_mat.T) / total_weights
+
+
+def top_k_per_profile(weighted: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    N×M の加重平均から、重みプロファイルごとに上位 k 行の (index, 値) を返す（M×k、降順）
+    """
+    if k <= 0:
+        raise ValueError("top_k must be >= 1")
+    n = weighted.shape[0]
+    k = min(k, n)
+    by_profile = weighted.T
+    if k < n:
+        part = np.argpartition(-by_profile, k - 1, axis=1)[:, :k]
+    else:
+        part = np.tile(np.arange(n), (by_profile.shape[0], 1))
+    part_values = np.take_along_axis(by_profile, part, axis=1)
+    order = np.argsort(-part_values, axis=1, kind="stable")
+    indices = np.take_along_axis(part, order, axis=1)
+    return indices, np.take_along_axis(by_profile, indices, axis=1)
+
+
 def build_scores_from_normalized(
     values: Sequence[float], axis_values: Sequence[int]
 ) -> tuple[list[float], dict[str, float]]:
@@ -153,6 +201,32 @@ def get_weighted_from_scores(payload: WeightedScoresRequest):
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@app.post("/weighted/batch")
+def get_weighted_batch(payload: WeightedBatchRequest):
+    """
+    N件の score × M通りの重みを一度に加重平均する
+    - weighted_results: N×M（weighted_result と同じく ×100 して丸め）
+    - top_k: 指定時は重みプロファイルごとの上位 k 件
+    """
+    try:
+        weighted = weighted_score_matrix(payload.scores, payload.weights)
+        response: dict[str, object] = {
+            "mode": "weighted_batch",
+            "rows": weighted.shape[0],
+            "profiles": weighted.shape[1],
+            "weighted_results": np.round(weighted * 100, 4).tolist(),
+        }
+        if payload.top_k is not None:
+            indices, values = top_k_per_profile(weighted, payload.top_k)
+            response["top_k"] = [
+                [{"index": int(i), "weighted_result": round(float(v) * 100, 4)} for i, v in zip(idx_row, val_row)]
+                for idx_row, val_row in zip(indices, values)
+            ]
+        return response
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 if __name__ == "__main__":
     # ローカル確認用
     print(get_result_sample())
@@ -0,0 +1,93 @@
+import csv
+import threading
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+
+from memory_report import MEMORY
+
+
+BASE_DIR = Path(__file__).resolve().parent
+KIJUN_CSV_PATH = BASE_DIR / "score" / "kijun.csv"
+
+
+def _normalize_text(value: object) -> str:
+    return unicodedata.normalize("NFKC", str(value)).strip()
+
+
+class KijunTable:
+    """
+    kijun.csv を name ごとの (min, max, mini.score) 配列にまとめたもの。
+    mini.score の判定（最初に入った行、値は int に切り捨て、max=m は上限なし）は
+    score/mini.score/*.py と同じで、配列のまま一括で引ける。
+    """
+
+    def __init__(self, rows: list[dict[str, object]]):
+        grouped: dict[str, list[tuple[float, float, float]]] = {}
+        for row in rows:
+            name = _normalize_text(row.get("name", ""))
+            try:
+                min_v = float(_normalize_text(row.get("min", "")))
+                max_raw = _normalize_text(row.get("max", ""))
+                max_v = np.inf if max_raw.lower() == "m" else float(max_raw)
+                score = float(_normalize_text(row.get("mini.score", "")))
+            except ValueError:
+                continue
+            grouped.setdefault(name, []).append((min_v, max_v, score))
+        self.bands: dict[str, tuple[np.ndarray, np.ndarray, np.ndarray]] = {
+            name: tuple(np.array(col, dtype=np.float64) for col in zip(*bands))
+            for name, bands in grouped.items()
+        }
+
+    @classmethod
+    def from_csv(cls, path: str | Path = KIJUN_CSV_PATH) -> "KijunTable":
+        with Path(path).open("r", newline="", encoding="utf-8-sig") as f:
+            return cls(list(csv.DictReader(f)))
+
+    def names(self) -> list[str]:
+        return list(self.bands)
+
+    def lookup(self, name: str, values: np.ndarray) -> np.ndarray:
+        """
+        values（NaN は未計測）に対する mini.score を返す。範囲外や未計測は NaN。
+        """
+        values = np.asarray(values, dtype=np.float64)
+        out = np.full(values.shape, np.nan)
+        if name not in self.bands:
+            return out
+        mins, maxs, scores = self.bands[name]
+        measured = ~np.isnan(values)
+        v = np.trunc(values[measured])[:, None]
+        inside = (v >= mins[None, :]) & (v <= maxs[None, :])
+        found = inside.any(axis=1)
+        picked = np.where(found, scores[inside.argmax(axis=1)], np.nan)
+        out[measured] = picked
+        return out
+
+
+_TABLE_CACHE: dict[str, tuple[float, KijunTable]] = {}
+_TABLE_LOCK = threading.Lock()
+MEMORY.register("kijun_tables", lambda: _TABLE_CACHE)
+
+
+def get_kijun_table(path: str | Path = KIJUN_CSV_PATH) -> KijunTable:
+    """
+    kijun.csv の KijunTable を返す（mtime が変わったときだけ読み直す）
+    """
+    path = Path(path)
+    key = str(path.resolve())
+    mtime = path.stat().st_mtime
+    cached = _TABLE_CACHE.get(key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with _TABLE_LOCK:
+        table = KijunTable.from_csv(path)
+        _TABLE_CACHE[key] = (mtime, table)
+        return table
+
+
+def install_kijun_table(table: KijunTable, path: str | Path = KIJUN_CSV_PATH) -> None:
+    path = Path(path)
+    with _TABLE_LOCK:
+        _TABLE_CACHE[str(path.resolve())] = (path.stat().st_mtime, table)
@@ -0,0 +1,221 @@
+import argparse
+import hashlib
+import heapq
+import json
+import math
+import mmap
+import os
+import threading
+from array import array
+from pathlib import Path
+
+from memory_report import MEMORY
+from saitan_kyori import RoadGraph, get_road_graph
+from spatial_index import FACILITY_CSV_PATHS, build_index_from_csv
+
+
+BASE_DIR = Path(__file__).resolve().parent
+FIELD_DIR = BASE_DIR / "dataset" / "fields"
+# ネットワーク距離の field を作る施設カテゴリ
+FIELD_CATEGORIES = ["station", "park", "supermarket", "library", "cityoffices"]
+NO_FACILITY = -1
+
+
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _field_paths(category: str, field_dir: Path = FIELD_DIR) -> tuple[Path, Path, Path]:
+    return (
+        field_dir / f"{category}.meta.json",
+        field_dir / f"{category}.dist.bin",
+        field_dir / f"{category}.near.bin",
+    )
+
+
+def multi_source_dijkstra(graph: RoadGraph, seeds: list[tuple[int, float, int]]) -> tuple[array, array]:
+    """
+    seeds=(node, 初期距離, 施設番号) から同時に Dijkstra を回し、
+    全ノードの (最短施設までの距離m, その施設番号) を compact な array で返す
+    """
+    n = len(graph)
+    dist = array("f", [math.inf]) * n
+    near = array("i", [NO_FACILITY]) * n
+    heap: list[tuple[float, int, int]] = []
+    for node, d, label in seeds:
+        if d < dist[node]:
+            dist[node] = d
+            near[node] = label
+            heapq.heappush(heap, (d, node, label))
+    settled = bytearray(n)
+    while heap:
+        d, node, label = heapq.heappop(heap)
+        if settled[node]:
+            continue
+        settled[node] = 1
+        for nxt, w in graph.adj[node]:
+            nd = d + w
+            if nd < dist[nxt]:
+                dist[nxt] = nd
+                near[nxt] = label
+                heapq.heappush(heap, (nd, nxt, label))
+    return dist, near
+
+
+def build_field(graph: RoadGraph, category: str, field_dir: Path = FIELD_DIR) -> dict[str, object]:
+    """
+    category の全施設から multi-source Dijkstra を回して field を保存する
+    """
+    csv_path = FACILITY_CSV_PATHS[category]
+    facilities = build_index_from_csv(csv_path).facilities
+    seeds: list[tuple[int, float, int]] = []
+    for label, item in enumerate(facilities):
+        snap = graph.snap(float(item["lat"]), float(item["lon"]))
+        if snap is None:
+            continue
+        for node, along_m in snap["seeds"].items():
+            seeds.append((node, float(snap["access_m"]) + along_m, label))
+
+    dist, near = multi_source_dijkstra(graph, seeds)
+
+    field_dir.mkdir(parents=True, exist_ok=True)
+    meta_path, dist_path, near_path = _field_paths(category, field_dir)
+    # mmap 中の古いファイルを壊さないよう、別名で書いてから置き換える
+    for path, values in ((dist_path, dist), (near_path, near)):
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        with tmp.open("wb") as f:
+            values.tofile(f)
+        os.replace(tmp, path)
+    meta = {
+        "category": category,
+        "csv_sha256": _file_sha256(csv_path),
+        "graph": graph.signature(),
+        "nodes": len(graph),
+        "facilities": facilities,
+    }
+    meta_path.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    return meta
+
+
+def field_is_fresh(graph: RoadGraph, category: str, field_dir: Path = FIELD_DIR) -> bool:
+    meta_path, dist_path, near_path = _field_paths(category, field_dir)
+    if not (meta_path.exists() and dist_path.exists() and near_path.exists()):
+        return False
+    try:
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    except Exception:
+        return False
+    return meta.get("graph") == graph.signature() and meta.get("csv_sha256") == _file_sha256(
+        FACILITY_CSV_PATHS[category]
+    )
+
+
+def build_fields(
+    categories: list[str] | None = None, force: bool = False, field_dir: Path = FIELD_DIR
+) -> dict[str, str]:
+    """
+    CSV かグラフが変わったカテゴリだけ作り直す（force=True なら全部）
+    返り値: category -> "built" / "fresh"
+    """
+    graph = get_road_graph()
+    if graph is None:
+        raise RuntimeError("road network not found (ROAD_NETWORK_PATH)")
+    status: dict[str, str] = {}
+    for category in categories or FIELD_CATEGORIES:
+        if not force and field_is_fresh(graph, category, field_dir):
+            status[category] = "fresh"
+            continue
+        build_field(graph, category, field_dir)
+        status[category] = "built"
+    return status
+
+
+def _map_array(path: Path, typecode: str, length: int) -> memoryview:
+    if length == 0:
+        return memoryview(array(typecode))
+    with path.open("rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped).cast(typecode)
+    if len(view) < length:
+        raise ValueError(f"field file is truncated: {path}")
+    return view[:length]
+
+
+class DistanceField:
+    def __init__(self, category: str, field_dir: Path = FIELD_DIR):
+        meta_path, dist_path, near_path = _field_paths(category, field_dir)
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        self.category = category
+        self.graph_signature = str(meta.get("graph", ""))
+        self.facilities: list[dict[str, object]] = meta.get("facilities", [])
+        nodes = int(meta.get("nodes", 0))
+        # 読み取り専用で mmap する（複数プロセスでもページキャッシュを共有し、プロセスごとに複製しない）
+        self.dist = _map_array(dist_path, "f", nodes)
+        self.near = _map_array(near_path, "i", nodes)
+
+    def nearest(self, graph: RoadGraph, lat: float, lon: float) -> tuple[float, dict[str, object]] | None:
+        """
+        1回のスナップと辺の両端ノードの array 読み出しだけで最短施設を返す
+        """
+        snap = graph.snap(lat, lon)
+        if snap is None:
+            return None
+        best: tuple[float, int] | None = None
+        for node, along_m in snap["seeds"].items():
+            label = self.near[node]
+            if label == NO_FACILITY:
+                continue
+            d = float(snap["access_m"]) + along_m + self.dist[node]
+            if best is None or d < best[0]:
+                best = (d, label)
+        if best is None:
+            return None
+        return best[0], self.facilities[best[1]]
+
+
+_FIELD_CACHE: dict[str, tuple[float, DistanceField]] = {}
+_FIELD_LOCK = threading.Lock()
+# dist / near は mmap なので mapped_bytes に出る（heap には入らない）
+MEMORY.register("distance_fields", lambda: _FIELD_CACHE)
+
+
+def get_distance_field(category: str, field_dir: Path = FIELD_DIR) -> DistanceField | None:
+    """
+    保存済み field を返す。無い / CSV の方が新しい（作り直し待ち）ときは None。
+    """
+    meta_path, _dist_path, _near_path = _field_paths(category, field_dir)
+    csv_path = FACILITY_CSV_PATHS.get(category)
+    if csv_path is None or not meta_path.exists():
+        return None
+    mtime = meta_path.stat().st_mtime
+    if csv_path.stat().st_mtime > mtime:
+        return None
+    cached = _FIELD_CACHE.get(category)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with _FIELD_LOCK:
+        cached = _FIELD_CACHE.get(category)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        field = DistanceField(category, field_dir)
+        _FIELD_CACHE[category] = (mtime, field)
+        return field
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="施設カテゴリごとに道路グラフ全ノードの最短施設距離(field)を前計算する"
+    )
+    parser.add_argument("--category", action="append", choices=FIELD_CATEGORIES, help="対象カテゴリ（複数可）")
+    parser.add_argument("--force", action="store_true", help="変更が無くても作り直す")
+    args = parser.parse_args()
+    for category, state in build_fields(args.category, force=args.force).items():
+        print(f"{category}: {state}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+import argparse
+import builtins
+import json
+import math
+import mmap
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.request
+from collections import OrderedDict, deque
+from types import BuiltinFunctionType, CodeType, FunctionType, MethodType, ModuleType
+from typing import Callable
+
+import numpy as np
+
+
+# 構造ごとの上限（"result_cache=32MB,geocode_stale=8MB"）。超えたら古いものから捨てる（捨てられる構造だけ）
+MEMORY_BUDGETS_ENV = os.getenv("MEMORY_BUDGETS", "").strip()
+# 上限を見に行く間隔（秒）。上限が1つも無ければ見に行かない
+MEMORY_CHECK_INTERVAL = float(os.getenv("MEMORY_CHECK_INTERVAL", "30") or 0)
+# 起動時から tracemalloc を取る（保存するフレーム数。0 なら /debug/memory?trace=start で始める）
+TRACEMALLOC_FRAMES = int(os.getenv("MEMORY_TRACEMALLOC_FRAMES", "0") or 0)
+TRACEMALLOC_MAX_TOP = 100
+
+_UNITS = {"": 1, "B": 1, "KB": 1 << 10, "K": 1 << 10, "MB": 1 << 20, "M": 1 << 20, "GB": 1 << 30, "G": 1 << 30}
+_SIZE_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([KMG]?B?)\s*$", re.IGNORECASE)
+# 中までたどらないもの（コード・モジュール・クラスは構造の持ち物として数えない）
+_LEAF_TYPES = (ModuleType, FunctionType, BuiltinFunctionType, MethodType, CodeType, type, threading.Thread)
+
+
+def parse_size(text: str) -> int:
+    """
+    "512MB" / "64k" / "1048576" -> バイト数
+    """
+    match = _SIZE_RE.match(str(text))
+    if match is None:
+        raise ValueError(f"invalid size: {text}")
+    return int(float(match.group(1)) * _UNITS[match.group(2).upper()])
+
+
+def parse_budgets(text: str) -> dict[str, int]:
+    budgets: dict[str, int] = {}
+    for part in text.split(","):
+        if not part.strip():
+            continue
+        name, sep, size = part.partition("=")
+        if not sep or not name.strip():
+            raise ValueError(f"budget must be name=size: {part}")
+        budgets[name.strip()] = parse_size(size)
+    return budgets
+
+
+def _slot_names(cls: type) -> list[str]:
+    names = []
+    for klass in cls.__mro__:
+        slots = klass.__dict__.get("__slots__", ())
+        names.extend([slots] if isinstance(slots, str) else slots)
+    return names
+
+
+def deep_sizeof(root: object) -> tuple[int, int]:
+    """
+    root からたどれるオブジェクトの大きさの概算（sys.getsizeof の合計）。返り値は (heap のバイト数, mmap しているバイト数)。
+    同じオブジェクトは1回だけ数える。numpy 配列はデータ部分まで、mmap の memoryview はマップした大きさを別に数える
+    """
+    seen = {id(builtins.__dict__)}
+    total = mapped = 0
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _LEAF_TYPES):
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, memoryview):
+            if isinstance(obj.obj, mmap.mmap):
+                mapped += obj.nbytes
+            else:
+                total += sys.getsizeof(obj)
+                stack.append(obj.obj)
+            continue
+        if isinstance(obj, np.ndarray):
+            if isinstance(obj, np.memmap) or isinstance(obj.base, mmap.mmap):
+                mapped += obj.nbytes
+                total += sys.getsizeof(obj) - (obj.nbytes if obj.flags.owndata else 0)
+            else:
+                # view なら元の配列をたどる（データは元の配列で数える）
+                total += sys.getsizeof(obj)
+                if obj.base is not None:
+                    stack.append(obj.base)
+            continue
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            for key, value in list(obj.items()):
+                stack.append(key)
+                stack.append(value)
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(list(obj))
+        elif isinstance(obj, (str, bytes, bytearray, int, float, complex, bool)) or obj is None:
+            continue
+        else:
+            if hasattr(obj, "__dict__"):
+                stack.append(vars(obj))
+            for name in _slot_names(type(obj)):
+                if name not in ("__dict__", "__weakref__") and hasattr(obj, name):
+                    stack.append(getattr(obj, name))
+    return total, mapped
+
+
+def lru_trimmer(cache: OrderedDict, lock: threading.Lock) -> Callable[[float], int]:
+    """
+    OrderedDict の LRU（古い方が先頭）を fraction の割合だけ古い方から捨てる関数を返す
+    """
+
+    def trim(fraction: float) -> int:
+        with lock:
+            count = min(len(cache), math.ceil(len(cache) * fraction))
+            for _ in range(count):
+                cache.popitem(last=False)
+        return count
+
+    return trim
+
+
+class _Entry:
+    __slots__ = ("root", "trim", "evicted")
+
+    def __init__(self, root: Callable[[], object], trim: Callable[[float], int] | None):
+        self.root = root
+        self.trim = trim
+        self.evicted = 0
+
+
+class MemoryRegistry:
+    """
+    メモリを食う構造（キャッシュ・索引・表）を名前で登録し、大きさを測る。
+    - register(name, root, trim): root() が今の構造を返す。trim(fraction) があれば上限を超えたときに古い方から捨てる
+    - register_group(name, roots): roots() が {部品名: 構造} を返す（dataset の部品など、"name:部品名" で出す）
+    共有しているオブジェクトはそれぞれの構造で数えるので、合計は実際より大きめになることがある
+    """
+
+    def __init__(self, budgets: dict[str, int] | None = None):
+        self._entries: dict[str, _Entry] = {}
+        self._groups: dict[str, Callable[[], dict[str, object]]] = {}
+        self._lock = threading.Lock()
+        self.budgets: dict[str, int] = dict(budgets or {})
+        self._enforcer: threading.Thread | None = None
+        self.last_check: dict[str, object] = {}
+
+    def register(self, name: str, root: Callable[[], object], trim: Callable[[float], int] | None = None) -> None:
+        with self._lock:
+            self._entries[name] = _Entry(root, trim)
+
+    def register_group(self, name: str, roots: Callable[[], dict[str, object]]) -> None:
+        with self._lock:
+            self._groups[name] = roots
+
+    def set_budgets(self, budgets: dict[str, int]) -> None:
+        """
+        上限を足す / 変える（0 以下はその上限を外す）
+        """
+        with self._lock:
+            for name, size in budgets.items():
+                if size > 0:
+                    self.budgets[name] = size
+                else:
+                    self.budgets.pop(name, None)
+
+    def _roots(self) -> list[tuple[str, object, _Entry | None]]:
+        with self._lock:
+            entries = list(self._entries.items())
+            groups = list(self._groups.items())
+        roots: list[tuple[str, object, _Entry | None]] = [(name, entry.root(), entry) for name, entry in entries]
+        for group, provider in groups:
+            roots.extend((f"{group}:{part}", value, None) for part, value in sorted(provider().items()))
+        return roots
+
+    def _measure(self, name: str, root: object, entry: _Entry | None) -> dict[str, object]:
+        started = time.perf_counter()
+        for _attempt in range(3):
+            try:
+                size, mapped = deep_sizeof(root)
+                break
+            except RuntimeError:
+                # 測っている間に別スレッドが dict を変えた。測り直す
+                continue
+        else:
+            size = mapped = -1
+        budget = self.budgets.get(name)
+        return {
+            "bytes": size,
+            "mapped_bytes": mapped,
+            "entries": len(root) if hasattr(root, "__len__") else None,
+            "budget": budget,
+            "over_budget": budget is not None and size > budget,
+            "evictable": entry is not None and entry.trim is not None,
+            "evicted": entry.evicted if entry is not None else 0,
+            "seconds": round(time.perf_counter() - started, 4),
+        }
+
+    def report(self) -> dict[str, object]:
+        structures = {name: self._measure(name, root, entry) for name, root, entry in self._roots()}
+        return {
+            "process": process_memory(),
+            "structures": structures,
+            "total_bytes": sum(max(int(s["bytes"]), 0) for s in structures.values()),
+            "budgets": dict(self.budgets),
+            "last_check": self.last_check,
+            "tracemalloc": tracemalloc.is_tracing(),
+        }
+
+    def enforce(self) -> dict[str, int]:
+        """
+        上限のある構造を測り、超えていれば超えた割合だけ古い方から捨てる。捨てた件数を返す
+        """
+        with self._lock:
+            targets = [(name, self._entries[name]) for name in self.budgets if name in self._entries]
+        evicted: dict[str, int] = {}
+        for name, entry in targets:
+            if entry.trim is None:
+                continue
+            budget = self.budgets.get(name)
+            if not budget:
+                continue
+            count = 0
+            # 1件の大きさはまちまちなので、割合で捨てて測り直す（数回まで）
+            for _attempt in range(4):
+                size, _mapped = deep_sizeof(entry.root())
+                if size <= budget:
+                    break
+                trimmed = entry.trim((size - budget) / size)
+                if not trimmed:
+                    break
+                count += trimmed
+            if count:
+                entry.evicted += count
+                evicted[name] = count
+                print(f"[memory] {name}: over {budget} bytes, evicted {count}")
+        self.last_check = {"at": time.time(), "evicted": evicted}
+        return evicted
+
+    def start_enforcer(self, interval: float = MEMORY_CHECK_INTERVAL) -> threading.Thread | None:
+        if interval <= 0 or not self.budgets or self._enforcer is not None:
+            return self._enforcer
+
+        def _loop() -> None:
+            while True:
+                time.sleep(interval)
+                try:
+                    self.enforce()
+                except Exception as e:
+                    self.last_check = {"at": time.time(), "error": str(e)}
+
+        self._enforcer = threading.Thread(target=_loop, name="memory-enforcer", daemon=True)
+        self._enforcer.start()
+        return self._enforcer
+
+
+def process_memory() -> dict[str, object]:
+    """
+    プロセス全体の常駐メモリ（Linux は /proc/self/status、それ以外は ru_maxrss の最大値だけ）
+    """
+    usage: dict[str, object] = {"pid": os.getpid()}
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    usage["rss_bytes" if key == "VmRSS" else "peak_rss_bytes"] = int(value.split()[0]) * 1024
+    except OSError:
+        try:
+            import resource
+
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            usage["peak_rss_bytes"] = peak if sys.platform == "darwin" else peak * 1024
+        except ImportError:
+            pass
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        usage["traced_bytes"] = current
+        usage["traced_peak_bytes"] = peak
+    return usage
+
+
+def tracemalloc_top(limit: int = 20, group_by: str = "lineno") -> list[dict[str, object]]:
+    """
+    今の tracemalloc スナップショットで多く確保している場所の上位 limit 件（trace 中でなければ空）
+    """
+    if not tracemalloc.is_tracing():
+        return []
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        )
+    )
+    return [
+        {"where": str(stat.traceback), "size_bytes": stat.size, "count": stat.count}
+        for stat in snapshot.statistics(group_by)[: max(1, min(limit, TRACEMALLOC_MAX_TOP))]
+    ]
+
+
+# プロセスで1つ（各モジュールが自分のキャッシュ / 索引を登録する）
+MEMORY = MemoryRegistry(parse_budgets(MEMORY_BUDGETS_ENV))
+if TRACEMALLOC_FRAMES > 0:
+    tracemalloc.start(TRACEMALLOC_FRAMES)
+
+
+def _format_bytes(size: object) -> str:
+    if not isinstance(size, int) or size < 0:
+        return "-"
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024  # type: ignore[assignment]
+    return str(size)
+
+
+def main() -> None:
+    from profiling import PROFILE_TOKEN
+
+    parser = argparse.ArgumentParser(description="住所解析サーバーの /debug/memory を表にする")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="サーバーの URL")
+    parser.add_argument("--token", default=PROFILE_TOKEN, help="PROFILE_TOKEN（既定は環境変数）")
+    parser.add_argument("--top", type=int, default=0, help="tracemalloc の上位 N 件も出す（trace 中でなければ始める）")
+    parser.add_argument("--trace", choices=["start", "stop"], help="tracemalloc を始める / 止める")
+    parser.add_argument("--budget", action="append", default=[], help="上限を変える（name=size、0 で外す）。複数可")
+    parser.add_argument("--json", action="store_true", help="JSON のまま出す")
+    args = parser.parse_args()
+
+    headers = {"X-Profile-Token": args.token}
+    if args.budget:
+        body = json.dumps({"budgets": {k: v for k, v in (b.split("=", 1) for b in args.budget)}}).encode("utf-8")
+        request = urllib.request.Request(
+            f"{args.url.rstrip('/')}/debug/memory",
+            data=body,
+            headers={**headers, "Content-Type": "application/json"},
+        )
+    else:
+        query = [f"top={args.top}"] + ([f"trace={args.trace}"] if args.trace else [])
+        request = urllib.request.Request(f"{args.url.rstrip('/')}/debug/memory?{'&'.join(query)}", headers=headers)
+    with urllib.request.urlopen(request, timeout=120) as response:
+        payload = json.loads(response.read().decode("utf-8"))
+    if args.json:
+        print(json.dumps(payload, ensure_ascii=False, indent=2))
+        return
+
+    process = payload.get("process", {})
+    print(f"pid {process.get('pid')}  rss {_format_bytes(process.get('rss_bytes'))}  peak {_format_bytes(process.get('peak_rss_bytes'))}")
+    print(f"{'structure':<32} {'bytes':>10} {'mapped':>10} {'entries':>8} {'budget':>10}  evicted")
+    structures = payload.get("structures", {})
+    for name, info in sorted(structures.items(), key=lambda item: -int(item[1].get("bytes") or 0)):
+        mark = " !" if info.get("over_budget") else ""
+        print(
+            f"{name:<32} {_format_bytes(info.get('bytes')):>10} {_format_bytes(info.get('mapped_bytes')):>10} "
+            f"{str(info.get('entries') if info.get('entries') is not None else '-'):>8} "
+            f"{_format_bytes(info.get('budget')) if info.get('budget') else '-':>10}  {info.get('evicted', 0)}{mark}"
+        )
+    print(f"{'total':<32} {_format_bytes(payload.get('total_bytes')):>10}")
+    for row in payload.get("top", []):
+        print(f"{_format_bytes(row['size_bytes']):>10} {row['count']:>8}  {row['where']}")
+
+
+if __name__ == "__main__":
+    main()
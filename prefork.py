@@ -0,0 +1,129 @@
+import gc
+import os
+import signal
+import threading
+import time
+from http.server import ThreadingHTTPServer
+from typing import Callable
+
+from memory_report import MEMORY
+
+
+def _serve_worker(httpd: ThreadingHTTPServer) -> None:
+    """
+    子プロセス: 親が listen したソケットで accept する。SIGTERM で受付を止め、処理中のリクエストを待って終わる
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=httpd.shutdown, daemon=True).start())
+    httpd.daemon_threads = False
+    httpd.block_on_close = True
+    # キャッシュは子プロセスごとに持つので、メモリの上限も子プロセスごとに見る
+    MEMORY.start_enforcer()
+    code = 0
+    try:
+        httpd.serve_forever()
+        httpd.server_close()
+    except BaseException:
+        code = 1
+    finally:
+        os._exit(code)
+
+
+class PreforkSupervisor:
+    """
+    1つの listen ソケットを N 個の子プロセスで共有して捌く（pre-fork）。
+    - 親が warm_up してから fork するので、索引などは子から copy-on-write で共有される（gc.freeze で GC がページを汚さないようにする）
+    - 子が落ちたら作り直す
+    - signature()（データ / kijun のハッシュ）が変わったら、親で温め直して子を1つずつ入れ替える
+    """
+
+    def __init__(
+        self,
+        httpd: ThreadingHTTPServer,
+        workers: int,
+        warm_up: Callable[[], object],
+        signature: Callable[[], object],
+        reload_interval: float = 5.0,
+    ):
+        if workers < 1:
+            raise ValueError("workers must be >= 1")
+        self.httpd = httpd
+        self.workers = workers
+        self.warm_up = warm_up
+        self.signature = signature
+        self.reload_interval = reload_interval
+        self.pids: set[int] = set()
+        self._stopping = False
+
+    def _prepare(self) -> None:
+        self.warm_up()
+        gc.collect()
+        gc.freeze()
+
+    def _spawn(self) -> int:
+        pid = os.fork()
+        if pid == 0:
+            _serve_worker(self.httpd)
+        self.pids.add(pid)
+        return pid
+
+    def _stop_worker(self, pid: int) -> None:
+        try:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+        self.pids.discard(pid)
+
+    def _reap(self) -> None:
+        while self.pids:
+            try:
+                pid, _status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid in self.pids:
+                self.pids.discard(pid)
+                if not self._stopping:
+                    print(f"[prefork] worker {pid} exited, respawning")
+                    self._spawn()
+
+    def reload(self) -> None:
+        """
+        親で温め直してから、子を1つずつ 新しい子を起動 -> 古い子を止める で入れ替える（受付は途切れない）
+        """
+        gc.unfreeze()
+        self._prepare()
+        for old_pid in list(self.pids):
+            self._spawn()
+            self._stop_worker(old_pid)
+
+    def stop(self, *_args) -> None:
+        self._stopping = True
+
+    def run(self) -> None:
+        self._prepare()
+        for _ in range(self.workers):
+            self._spawn()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        print(f"[prefork] {self.workers} workers: {sorted(self.pids)}")
+
+        current = self.signature()
+        next_check = time.monotonic() + self.reload_interval
+        try:
+            while not self._stopping:
+                self._reap()
+                if time.monotonic() >= next_check:
+                    latest = self.signature()
+                    if latest != current:
+                        print("[prefork] data changed, reloading workers")
+                        self.reload()
+                        current = latest
+                    next_check = time.monotonic() + self.reload_interval
+                time.sleep(0.2)
+        finally:
+            for pid in list(self.pids):
+                self._stop_worker(pid)
+            self.httpd.server_close()
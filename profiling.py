@@ -0,0 +1,174 @@
+import argparse
+import contextvars
+import hashlib
+import hmac
+import os
+import sys
+import threading
+import time
+import urllib.request
+from collections import Counter
+from pathlib import Path
+
+
+BASE_DIR = Path(__file__).resolve().parent
+# 管理者用トークン。空なら profiling は使えない（/debug/profile も 403）
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "").strip()
+# 1リクエストの profile を保存する場所（空なら保存しない）
+PROFILE_DIR = os.getenv("PROFILE_DIR", str(BASE_DIR / "profiles")).strip()
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5") or 5) / 1000.0
+PROFILE_MAX_SECONDS = 60.0
+
+# リクエストの profile 中だけ入る（採点のスレッドプールがワーカーを登録するのに使う）
+_ACTIVE: contextvars.ContextVar["StackSampler | None"] = contextvars.ContextVar("active_sampler", default=None)
+
+
+def token_ok(token: str | None) -> bool:
+    return bool(PROFILE_TOKEN) and hmac.compare_digest((token or "").strip(), PROFILE_TOKEN)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """
+    interval 秒ごとに対象スレッドのスタックを取って数える（wall-clock のサンプリング）。
+    threads=None なら自分と呼び出し元以外の全スレッド。結果は flamegraph.pl / speedscope で読める collapsed 形式
+    """
+
+    def __init__(self, threads: set[int] | None = None, interval: float = PROFILE_INTERVAL):
+        self.threads = threads
+        self.interval = interval
+        self.samples = 0
+        self.stacks: Counter[str] = Counter()
+        self.started = 0.0
+        self.seconds = 0.0
+        self._exclude: set[int] = set()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def add_current_thread(self) -> None:
+        if self.threads is not None:
+            with self._lock:
+                self.threads.add(threading.get_ident())
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                if self.threads is not None:
+                    targets = list(self.threads)
+                else:
+                    targets = [ident for ident in frames if ident not in self._exclude]
+            for ident in targets:
+                frame = frames.get(ident)
+                if frame is None or ident == own:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(labels))] += 1
+            self.samples += 1
+
+    def start(self) -> "StackSampler":
+        self._exclude = {threading.get_ident()}
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._sample, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> "StackSampler":
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.seconds = time.perf_counter() - self.started
+        return self
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class RequestProfile:
+    """
+    with RequestProfile(label) as profile: ... で、このスレッドと（worker_initializer を使った）プールのスレッドだけを採る
+    """
+
+    def __init__(self, label: str):
+        self.label = label
+        self.sampler = StackSampler(threads={threading.get_ident()})
+        self.path: Path | None = None
+        self._token: contextvars.Token | None = None
+
+    def __enter__(self) -> "RequestProfile":
+        self._token = _ACTIVE.set(self.sampler)
+        self.sampler.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.sampler.stop()
+        if self._token is not None:
+            _ACTIVE.reset(self._token)
+        if PROFILE_DIR:
+            self.path = save_collapsed(self.sampler.collapsed(), self.label)
+
+    def summary(self) -> dict[str, object]:
+        return {
+            "format": "collapsed",
+            "samples": self.sampler.samples,
+            "interval_ms": round(self.sampler.interval * 1000, 3),
+            "seconds": round(self.sampler.seconds, 3),
+            "path": str(self.path) if self.path else "",
+            "stacks": self.sampler.collapsed(),
+        }
+
+
+def worker_initializer():
+    """
+    ThreadPoolExecutor(initializer=...) に渡す関数。profile 中でなければ None（何もしない）
+    """
+    sampler = _ACTIVE.get()
+    return sampler.add_current_thread if sampler is not None else None
+
+
+def save_collapsed(text: str, label: str) -> Path:
+    directory = Path(PROFILE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    # label は利用者の住所なので、ファイル名には hash だけ使う
+    digest = hashlib.sha256(label.encode("utf-8")).hexdigest()[:12]
+    path = directory / f"{time.strftime('%Y%m%d-%H%M%S')}-{digest}.collapsed"
+    path.write_text(text, encoding="utf-8")
+    return path
+
+
+def profile_process(seconds: float, interval: float = PROFILE_INTERVAL) -> StackSampler:
+    """
+    プロセス全体（呼び出し元以外の全スレッド）を seconds 秒サンプリングする
+    """
+    sampler = StackSampler(interval=interval).start()
+    time.sleep(min(max(seconds, 0.1), PROFILE_MAX_SECONDS))
+    return sampler.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="住所解析サーバーの /debug/profile から collapsed stacks を取る")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="サーバーの URL")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--token", default=PROFILE_TOKEN, help="PROFILE_TOKEN（既定は環境変数）")
+    parser.add_argument("--output", default="profile.collapsed")
+    args = parser.parse_args()
+
+    request = urllib.request.Request(
+        f"{args.url.rstrip('/')}/debug/profile?seconds={args.seconds}", headers={"X-Profile-Token": args.token}
+    )
+    with urllib.request.urlopen(request, timeout=args.seconds + 30) as response:
+        Path(args.output).write_bytes(response.read())
+    print(f"saved: {args.output}（flamegraph.pl {args.output} > profile.svg か speedscope で開く）")
+
+
+if __name__ == "__main__":
+    main()
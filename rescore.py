@@ -0,0 +1,376 @@
+import argparse
+import csv
+import importlib.util
+import io
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from kijun_table import KijunTable
+from memory_report import MEMORY
+from score_result import ScoreResult
+from seikika import normalize_array
+
+try:
+    import fcntl
+except ImportError:  # Windows は pre-fork しないので、プロセス内の lock だけで足りる
+    fcntl = None
+
+
+BASE_DIR = Path(__file__).resolve().parent
+HISTORY_CSV_PATH = BASE_DIR / "address1_history.csv"
+NEARBY_PATH = BASE_DIR / "score" / "mini.score" / "nearby.py"
+
+# 計測値(raw) -> kijun name -> mini.score の key -> 正規化 score の key（anzen の2つは score を持たない）
+BASE_SPECS: list[tuple[str, str, str, str | None]] = [
+    ("hanzai_number", "hanzai", "mini.score_hanzai", None),
+    ("jiko_number", "jiko", "mini.score_jiko", None),
+    ("population_number", "population", "mini.score_population", "population_score"),
+    ("kindergarden_number", "kindergarden", "mini.score_kindergarden", "kindergarden_score"),
+    ("station_distance_m", "eki", "mini.score_station", "station_score"),
+    ("park_distance_m", "park", "mini.score_park", "park_score"),
+    ("supermarket_distance_m", "supermarket", "mini.score_supermarket", "supermarket_score"),
+    ("library_distance_m", "library", "mini.score_library", "library_score"),
+    ("cityoffices_distance_m", "cityoffices", "mini.score_cityoffices", "cityoffices_score"),
+]
+# anzen = hanzai + jiko
+ANZEN_KEYS = ["mini.number", "mini.score", "score", "anzen_score_sum"]
+
+
+def _load_module(name: str, path: Path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    if spec is None or spec.loader is None:
+        raise RuntimeError(f"failed to load module: {path}")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _count_specs() -> list[tuple[str, str, str, str | None]]:
+    nearby_mod = _load_module("rescore_nearby", NEARBY_PATH)
+    return [(f"{name}_number", name, f"mini.score_{name}", f"{name}_score") for name in nearby_mod.COUNT_CRITERIA]
+
+
+MEASUREMENT_SPECS = BASE_SPECS + _count_specs()
+RAW_KEYS = [raw_key for raw_key, _name, _mini, _score in MEASUREMENT_SPECS]
+DERIVED_KEYS = (
+    [mini_key for _raw, _name, mini_key, _score in MEASUREMENT_SPECS]
+    + [score_key for _raw, _name, _mini, score_key in MEASUREMENT_SPECS if score_key]
+    + ANZEN_KEYS
+)
+HISTORY_FIELDS = ["address1", "lat1", "lon1", "ku"] + RAW_KEYS
+
+
+def _to_float(value: object) -> float:
+    if value is None or str(value).strip() == "":
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def columns_from_results(results: list[dict[str, object]]) -> dict[str, object]:
+    """
+    結果 dict のリストから raw 計測値の列（np.ndarray）を作る
+    """
+    columns: dict[str, object] = {
+        key: np.array([_to_float(r.get(key)) for r in results], dtype=np.float64) for key in RAW_KEYS
+    }
+    columns["ku"] = [str(r.get("ku", "") or "") for r in results]
+    return columns
+
+
+def _normalize(mini: np.ndarray, axis: int) -> np.ndarray:
+    # 範囲外は NaN（= 空欄）
+    return normalize_array(mini, axis, strict=False)
+
+
+def derive_columns(columns: dict[str, object], table: KijunTable) -> dict[str, np.ndarray]:
+    """
+    raw 計測値の列から mini.score / 正規化 score の列を一括で作る（外部呼び出しなし）
+    """
+    derived: dict[str, np.ndarray] = {}
+    for raw_key, kijun_name, mini_key, score_key in MEASUREMENT_SPECS:
+        mini = table.lookup(kijun_name, np.asarray(columns[raw_key]))
+        derived[mini_key] = mini
+        if score_key:
+            derived[score_key] = _normalize(mini, 1)
+
+    # server.py と同じく、区が分かっていれば欠けた方を 0 として足す
+    has_ku = np.array([bool(ku) for ku in columns["ku"]], dtype=bool)
+    anzen = np.nan_to_num(derived["mini.score_hanzai"]) + np.nan_to_num(derived["mini.score_jiko"])
+    anzen[~has_ku] = np.nan
+    derived["mini.number"] = np.where(has_ku, 2.0, np.nan)
+    derived["mini.score"] = anzen
+    derived["anzen_score_sum"] = anzen
+    derived["score"] = _normalize(anzen, 2)
+    return derived
+
+
+def _is_float_key(key: str) -> bool:
+    return key in ("score", "anzen_score_sum") or key.endswith("_score")
+
+
+def _cell(key: str, value: float) -> object:
+    if np.isnan(value):
+        return ""
+    return float(value) if _is_float_key(key) else int(value)
+
+
+def _cells(key: str, values: np.ndarray) -> list[object]:
+    convert = float if _is_float_key(key) else int
+    return ["" if v != v else convert(v) for v in values.tolist()]
+
+
+def rederive_results(results: list[dict[str, object]], table: KijunTable) -> int:
+    """
+    結果 dict の mini.score / score を今の kijun で作り直す（in place）。作り直した件数を返す。
+    座標が取れていない結果はそのまま。
+    """
+    targets = [r for r in results if str(r.get("lat1", "")) != "" and str(r.get("lon1", "")) != ""]
+    if not targets:
+        return 0
+    derived = derive_columns(columns_from_results(targets), table)
+    for key, values in derived.items():
+        for result, value in zip(targets, _cells(key, values)):
+            result[key] = value
+    return len(targets)
+
+
+def _ward_means(values: np.ndarray, ward_codes: np.ndarray, wards: list[str]) -> dict[str, object]:
+    measured = ~np.isnan(values)
+    sums = np.bincount(ward_codes[measured], weights=values[measured], minlength=len(wards))
+    counts = np.bincount(ward_codes[measured], minlength=len(wards))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+    return {ward: (round(float(m), 4) if counts[i] else "") for i, (ward, m) in enumerate(zip(wards, means))}
+
+
+def _distribution(values: np.ndarray) -> dict[str, object]:
+    measured = values[~np.isnan(values)]
+    # mini.score は 0〜10 の整数なので 0..10 の件数を数える
+    hist = np.bincount(np.clip(measured, 0, 10).astype(np.int64), minlength=11)
+    return {
+        "count": int(measured.size),
+        "missing": int(values.size - measured.size),
+        "mean": round(float(measured.mean()), 4) if measured.size else "",
+        "hist": hist.tolist(),
+    }
+
+
+def simulate_kijun(
+    columns: dict[str, object], current: KijunTable, candidate: KijunTable
+) -> dict[str, object]:
+    """
+    保存済み計測値に対して、今の kijun と候補の kijun を両方当てて比べる（ライブの表は変えない）
+    - distributions: kijun name ごとの mini.score 分布（0..10 の件数）
+    - ward_averages: 正規化 score の区ごとの平均
+    - changed: mini.score が変わる件数（name ごと / 1つでも変わる住所数）
+    """
+    before = derive_columns(columns, current)
+    after = derive_columns(columns, candidate)
+    size = len(columns["ku"])
+    wards, ward_codes = np.unique(np.array(columns["ku"], dtype=object).astype(str), return_inverse=True)
+    wards_list = [str(w) for w in wards]
+
+    distributions: dict[str, object] = {}
+    changed: dict[str, int] = {}
+    any_changed = np.zeros(size, dtype=bool)
+    for _raw, kijun_name, mini_key, _score in MEASUREMENT_SPECS:
+        a, b = before[mini_key], after[mini_key]
+        diff = ~((a == b) | (np.isnan(a) & np.isnan(b)))
+        changed[kijun_name] = int(diff.sum())
+        any_changed |= diff
+        distributions[kijun_name] = {"current": _distribution(a), "candidate": _distribution(b)}
+
+    score_keys = [score_key for _raw, _name, _mini, score_key in MEASUREMENT_SPECS if score_key] + ["score"]
+    ward_averages = {
+        key: {
+            "current": _ward_means(before[key], ward_codes, wards_list),
+            "candidate": _ward_means(after[key], ward_codes, wards_list),
+        }
+        for key in score_keys
+    }
+    return {
+        "results": size,
+        "changed_results": int(any_changed.sum()),
+        "changed": changed,
+        "distributions": distributions,
+        "ward_averages": ward_averages,
+    }
+
+
+# 数値で持つ列（raw 計測値 + 座標）と、文字列で持つ列
+_FLOAT_COLUMNS = RAW_KEYS + ["lat1", "lon1"]
+_TEXT_COLUMNS = ["address1", "ku"]
+
+
+def _file_key(path: Path) -> tuple[float, int] | None:
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+
+class MeasurementStore:
+    """
+    採点した住所の raw 計測値だけを CSV に追記して持つ。
+    派生スコアは保存せず、読むときに今の kijun から作る。
+    このプロセスが追記した行はメモリ上の列（と score 行列）にも1行足すだけにし、
+    CSV を読み直すのはほかのプロセス / 手で変えられたときだけにする
+    """
+
+    def __init__(self, path: str | Path = HISTORY_CSV_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        # 列は容量を倍々に取った配列に入れ、先頭 _size 行の view を返す（同じ住所は最後の行で上書き）
+        self._buffers: dict[str, np.ndarray] = {}
+        self._index: dict[str, int] = {}
+        self._size = 0
+        self._columns: dict[str, object] | None = None
+        self._columns_key: tuple[float, int] | None = None
+        self._matrix: tuple[KijunTable, tuple[str, ...], np.ndarray] | None = None
+        MEMORY.register_group("measurements", lambda: {"columns": self._buffers, "matrix": self._matrix})
+
+    def append(self, result: dict[str, object] | ScoreResult) -> None:
+        # 締め切りで欠けた結果（partial）は履歴に入れない
+        if str(result.get("lat1", "")) == "" or str(result.get("lon1", "")) == "" or result.get("partial"):
+            return
+        row = {k: result.get(k, "") for k in HISTORY_FIELDS}
+        with self._lock, self.path.open("ab") as f:
+            # SERVER_WORKERS のときはほかのワーカープロセスも同じファイルに追記するので、
+            # ヘッダーを書くかどうかの判断から書き終わりまでをファイルの lock の中でする
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            before = _file_key(self.path)
+            is_new = os.fstat(f.fileno()).st_size == 0
+            text = io.StringIO()
+            writer = csv.DictWriter(text, fieldnames=HISTORY_FIELDS, extrasaction="ignore")
+            if is_new:
+                writer.writeheader()
+            writer.writerow(row)
+            f.write(text.getvalue().encode("utf-8-sig" if is_new else "utf-8"))
+            f.flush()
+            # 読んだあとにほかから変えられていなければ、読み直さずにこの1行だけ足す
+            if self._columns is not None and before == self._columns_key:
+                self._put_row(row)
+                self._columns_key = _file_key(self.path)
+
+    def _allocate(self, capacity: int) -> None:
+        buffers: dict[str, np.ndarray] = {}
+        for key in _FLOAT_COLUMNS:
+            buffers[key] = np.full(capacity, np.nan, dtype=np.float64)
+        for key in _TEXT_COLUMNS:
+            buffers[key] = np.full(capacity, "", dtype=object)
+        for key, old in self._buffers.items():
+            buffers[key][: self._size] = old[: self._size]
+        # 前に返した view は古い配列を指したままなので、読んでいる途中の呼び出し側は壊れない
+        self._buffers = buffers
+        if self._matrix is not None:
+            table, keys, old_matrix = self._matrix
+            matrix = np.full((capacity, len(keys)), np.nan)
+            matrix[: self._size] = old_matrix[: self._size]
+            self._matrix = (table, keys, matrix)
+
+    def _put_row(self, row: dict[str, object]) -> None:
+        address = str(row.get("address1", "") or "")
+        i = self._index.get(address)
+        if i is None:
+            if self._size >= len(self._buffers["address1"]):
+                self._allocate(max(16, self._size * 2))
+            i = self._index[address] = self._size
+            self._size += 1
+        for key in _FLOAT_COLUMNS:
+            self._buffers[key][i] = _to_float(row.get(key))
+        self._buffers["address1"][i] = address
+        self._buffers["ku"][i] = str(row.get("ku", "") or "")
+        if self._matrix is not None:
+            table, keys, matrix = self._matrix
+            one = {key: self._buffers[key][i : i + 1] for key in RAW_KEYS}
+            one["ku"] = [self._buffers["ku"][i]]
+            derived = derive_columns(one, table)
+            matrix[i] = [derived[k][0] for k in keys]
+        self._columns = {key: buffer[: self._size] for key, buffer in self._buffers.items()}
+
+    def _reload(self, key: tuple[float, int]) -> None:
+        latest: dict[str, dict[str, str]] = {}
+        with self.path.open("r", newline="", encoding="utf-8-sig") as f:
+            for row in csv.DictReader(f):
+                latest[row.get("address1", "")] = row
+        self._buffers = {}
+        self._index = {}
+        self._size = 0
+        self._matrix = None
+        self._allocate(max(16, len(latest)))
+        rows = list(latest.values())
+        for name in _FLOAT_COLUMNS:
+            self._buffers[name][: len(rows)] = [_to_float(row.get(name)) for row in rows]
+        for name in _TEXT_COLUMNS:
+            self._buffers[name][: len(rows)] = [str(row.get(name, "") or "") for row in rows]
+        self._index = {address: i for i, address in enumerate(latest)}
+        self._size = len(rows)
+        self._columns = {name: buffer[: self._size] for name, buffer in self._buffers.items()}
+        self._columns_key = key
+
+    def load_columns(self) -> dict[str, object]:
+        """
+        保存済み計測値を列で返す（同じ住所は最後の行を使う）。ファイルがほかから変えられるまでは再読込しない。
+        """
+        key = _file_key(self.path)
+        with self._lock:
+            if key is None:
+                self._columns = None
+                return columns_from_results([]) | {"address1": []}
+            if self._columns is None or self._columns_key != key:
+                self._reload(key)
+            return self._columns
+
+    def derived_scores(self, table: KijunTable) -> dict[str, np.ndarray]:
+        return derive_columns(self.load_columns(), table)
+
+    def columns_and_matrix(self, table: KijunTable, score_keys: list[str]) -> tuple[dict[str, object], np.ndarray]:
+        """
+        列と、正規化 score の N×len(score_keys) 行列を同じ時点の組で返す。
+        行列は kijun か score_keys が変わったときだけ作り直し、追記した行はその行だけ計算して足す
+        """
+        columns = self.load_columns()
+        keys = tuple(score_keys)
+        with self._lock:
+            if self._columns is None:
+                return columns, np.empty((0, len(keys)))
+            if self._columns is not columns:
+                # load_columns のあとに追記 / 再読込があった。今の列でそろえる
+                columns = self._columns
+            cached = self._matrix
+            if cached is None or cached[0] is not table or cached[1] != keys:
+                matrix = np.full((len(self._buffers.get("address1", ())), len(keys)), np.nan)
+                if self._size:
+                    derived = derive_columns(columns, table)
+                    matrix[: self._size] = np.column_stack([derived[k] for k in keys])
+                cached = self._matrix = (table, keys, matrix)
+            return columns, cached[2][: len(columns["address1"])]
+
+    def score_matrix(self, table: KijunTable, score_keys: list[str]) -> np.ndarray:
+        """
+        正規化 score を N×len(score_keys) の行列で返す（計測値と kijun が変わるまで使い回す）
+        """
+        return self.columns_and_matrix(table, score_keys)[1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="保存済みの計測値から今の kijun で mini.score / score を作り直して表示する")
+    parser.add_argument("--history", default=str(HISTORY_CSV_PATH), help="計測値CSV")
+    args = parser.parse_args()
+    store = MeasurementStore(args.history)
+    columns = store.load_columns()
+    derived = store.derived_scores(KijunTable.from_csv())
+    for i, address in enumerate(columns["address1"]):
+        print(address, {key: _cell(key, values[i]) for key, values in derived.items() if key.endswith("score")})
+
+
+if __name__ == "__main__":
+    main()
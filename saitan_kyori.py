@@ -0,0 +1,520 @@
+import argparse
+import hashlib
+import heapq
+import math
+import os
+import pickle
+import threading
+import xml.etree.ElementTree as ET
+from array import array
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from kyori import haversine_m
+from memory_report import MEMORY
+from spatial_index import get_facility_index, project
+
+
+load_dotenv()
+
+BASE_DIR = Path(__file__).resolve().parent
+ROAD_NETWORK_PATH = Path(os.getenv("ROAD_NETWORK_PATH", str(BASE_DIR / "dataset" / "road_network.osm")))
+# 前処理済みグラフ（CH 込み）の保存先
+ROAD_GRAPH_CACHE_PATH = ROAD_NETWORK_PATH.with_suffix(".pkl")
+
+# 歩行者が通れる道路種別（OSM の highway タグ）
+WALKABLE_HIGHWAYS = {
+    "primary",
+    "primary_link",
+    "secondary",
+    "secondary_link",
+    "tertiary",
+    "tertiary_link",
+    "unclassified",
+    "residential",
+    "living_street",
+    "service",
+    "pedestrian",
+    "footway",
+    "path",
+    "steps",
+    "track",
+    "cycleway",
+    "road",
+}
+
+# 道路から離れすぎた点はスナップしない
+MAX_SNAP_M = 1000.0
+SNAP_CELL_M = 200.0
+# 直線距離で近い順に何件をネットワーク距離で比べるか
+NETWORK_CANDIDATES = 8
+
+# kijun name -> 施設カテゴリ（距離系の基準）
+KIJUN_CATEGORIES = {
+    "eki": "station",
+    "park": "park",
+    "supermarket": "supermarket",
+    "library": "library",
+    "cityoffices": "cityoffices",
+    "hospital": "hospital",
+}
+
+
+def _network_kijun_names() -> set[str]:
+    raw = os.getenv("NETWORK_DISTANCE_KIJUN", "")
+    return {name.strip() for name in raw.split(",") if name.strip()}
+
+
+def uses_network_distance(kijun_name: str) -> bool:
+    """
+    NETWORK_DISTANCE_KIJUN（例: eki,park）に含まれる kijun だけ道のり距離を使う
+    """
+    return kijun_name in _network_kijun_names()
+
+
+def _point_segment(px: float, py: float, ax: float, ay: float, bx: float, by: float) -> tuple[float, float]:
+    """
+    投影座標で点 P から線分 AB への (距離, A からの割合 t) を返す
+    """
+    dx = bx - ax
+    dy = by - ay
+    length2 = dx * dx + dy * dy
+    if length2 == 0:
+        return math.hypot(px - ax, py - ay), 0.0
+    t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length2))
+    return math.hypot(px - (ax + t * dx), py - (ay + t * dy)), t
+
+
+class RoadGraph:
+    """
+    無向の道路グラフ。ノードは 0..n-1、辺の重みは haversine の m。
+    """
+
+    def __init__(self, lats: list[float], lons: list[float], edges: list[tuple[int, int, float]]):
+        self.lats = lats
+        self.lons = lons
+        self.edges = edges
+        self.adj: list[list[tuple[int, float]]] = [[] for _ in lats]
+        for u, v, w in edges:
+            self.adj[u].append((v, w))
+            self.adj[v].append((u, w))
+        self.xy = [project(lat, lon) for lat, lon in zip(lats, lons)]
+        self.edge_cells: dict[tuple[int, int], list[int]] = {}
+        for e, (u, v, _w) in enumerate(edges):
+            (ax, ay), (bx, by) = self.xy[u], self.xy[v]
+            for gx in range(int(math.floor(min(ax, bx) / SNAP_CELL_M)), int(math.floor(max(ax, bx) / SNAP_CELL_M)) + 1):
+                for gy in range(int(math.floor(min(ay, by) / SNAP_CELL_M)), int(math.floor(max(ay, by) / SNAP_CELL_M)) + 1):
+                    self.edge_cells.setdefault((gx, gy), []).append(e)
+        self.ch_rank: list[int] | None = None
+        self.ch_up: list[list[tuple[int, float]]] | None = None
+        self._signature: str | None = None
+
+    def __len__(self) -> int:
+        return len(self.lats)
+
+    def signature(self) -> str:
+        """
+        ノードの座標と辺の sha256。前計算（kyori_field の field など）がこのグラフから作られたかの確認に使う。
+        ノード数・辺数が同じでも中身が違えば別物になる。最初の1回だけ計算する
+        """
+        if self._signature is None:
+            h = hashlib.sha256()
+            h.update(array("d", self.lats).tobytes())
+            h.update(array("d", self.lons).tobytes())
+            h.update(array("q", [node for u, v, _w in self.edges for node in (u, v)]).tobytes())
+            h.update(array("d", [w for _u, _v, w in self.edges]).tobytes())
+            self._signature = h.hexdigest()
+        return self._signature
+
+    def snap(self, lat: float, lon: float) -> dict[str, object] | None:
+        """
+        一番近い辺にスナップする。
+        返り値: edge, t（u からの割合）, access_m（点から道路まで）, seeds（端点ノード -> 辺上の距離）
+        """
+        px, py = project(lat, lon)
+        cx, cy = int(math.floor(px / SNAP_CELL_M)), int(math.floor(py / SNAP_CELL_M))
+        best: tuple[float, int, float] | None = None
+        max_r = int(math.ceil(MAX_SNAP_M / SNAP_CELL_M))
+        for r in range(max_r + 1):
+            for gx in range(cx - r, cx + r + 1):
+                for gy in range(cy - r, cy + r + 1):
+                    if max(abs(gx - cx), abs(gy - cy)) != r:
+                        continue
+                    for e in self.edge_cells.get((gx, gy), ()):
+                        u, v, _w = self.edges[e]
+                        (ax, ay), (bx, by) = self.xy[u], self.xy[v]
+                        dist, t = _point_segment(px, py, ax, ay, bx, by)
+                        if best is None or dist < best[0]:
+                            best = (dist, e, t)
+            if best is not None and best[0] <= r * SNAP_CELL_M:
+                break
+        if best is None or best[0] > MAX_SNAP_M:
+            return None
+        access_m, e, t = best
+        u, v, w = self.edges[e]
+        return {"edge": e, "t": t, "access_m": access_m, "seeds": {u: t * w, v: (1.0 - t) * w}}
+
+    def _lower_bound(self, node: int, lat: float, lon: float, access_m: float) -> float:
+        # 目的地の点までの直線距離から道路までのアクセス分を引いたもの（投影誤差ぶん少し小さめに）
+        return max(0.0, haversine_m(self.lats[node], self.lons[node], lat, lon) - access_m) * 0.999
+
+    def _astar(
+        self, sources: dict[int, float], targets: dict[int, float], lat2: float, lon2: float, access_m: float
+    ) -> float:
+        # 辺の重みは直線距離以上なので、目的地の点までの直線距離 - アクセス分 は許容的なヒューリスティック
+        best = math.inf
+        dist: dict[int, float] = {}
+        heap: list[tuple[float, float, int]] = []
+        for node, d in sources.items():
+            if d < dist.get(node, math.inf):
+                dist[node] = d
+                heapq.heappush(heap, (d + self._lower_bound(node, lat2, lon2, access_m), d, node))
+        settled: set[int] = set()
+        while heap:
+            f, d, node = heapq.heappop(heap)
+            if f >= best:
+                break
+            if node in settled:
+                continue
+            settled.add(node)
+            if node in targets:
+                best = min(best, d + targets[node])
+            for nxt, w in self.adj[node]:
+                nd = d + w
+                if nd < dist.get(nxt, math.inf):
+                    dist[nxt] = nd
+                    heapq.heappush(heap, (nd + self._lower_bound(nxt, lat2, lon2, access_m), nd, nxt))
+        return best
+
+    def _bidirectional(
+        self,
+        sources: dict[int, float],
+        targets: dict[int, float],
+        adj: list[list[tuple[int, float]]],
+        upward_only: bool = False,
+    ) -> float:
+        # upward_only=True のときは CH の上向きグラフ上の探索（両側とも最後まで縮めて mu を取る）
+        dist = ({}, {})
+        heaps: tuple[list[tuple[float, int]], list[tuple[float, int]]] = ([], [])
+        for side, seeds in enumerate((sources, targets)):
+            for node, d in seeds.items():
+                if d < dist[side].get(node, math.inf):
+                    dist[side][node] = d
+                    heapq.heappush(heaps[side], (d, node))
+        mu = math.inf
+        for node in set(sources) & set(targets):
+            mu = min(mu, sources[node] + targets[node])
+        settled: tuple[set[int], set[int]] = (set(), set())
+        while heaps[0] or heaps[1]:
+            top0 = heaps[0][0][0] if heaps[0] else math.inf
+            top1 = heaps[1][0][0] if heaps[1] else math.inf
+            if upward_only:
+                if min(top0, top1) >= mu:
+                    break
+            elif top0 + top1 >= mu:
+                break
+            side = 0 if top0 <= top1 else 1
+            d, node = heapq.heappop(heaps[side])
+            if node in settled[side] or d > dist[side].get(node, math.inf):
+                continue
+            settled[side].add(node)
+            other = dist[1 - side].get(node)
+            if other is not None:
+                mu = min(mu, d + other)
+            for nxt, w in adj[node]:
+                nd = d + w
+                if nd < dist[side].get(nxt, math.inf):
+                    dist[side][nxt] = nd
+                    heapq.heappush(heaps[side], (nd, nxt))
+                    other = dist[1 - side].get(nxt)
+                    if other is not None:
+                        mu = min(mu, nd + other)
+        return mu
+
+    def network_distance_m(self, lat1: float, lon1: float, lat2: float, lon2: float, method: str = "auto") -> float | None:
+        """
+        2点間の道のり距離(m)。道路から点までのアクセス距離も含める。
+        method: auto（CH があれば ch、無ければ astar）/ astar / bidirectional / ch
+        """
+        snap1 = self.snap(lat1, lon1)
+        snap2 = self.snap(lat2, lon2)
+        if snap1 is None or snap2 is None:
+            return None
+        if method == "auto":
+            method = "ch" if self.ch_up is not None else "astar"
+
+        sources = snap1["seeds"]
+        targets = snap2["seeds"]
+        if method == "astar":
+            core = self._astar(sources, targets, lat2, lon2, float(snap2["access_m"]))
+        elif method == "bidirectional":
+            core = self._bidirectional(sources, targets, self.adj)
+        elif method == "ch":
+            if self.ch_up is None:
+                raise RuntimeError("contraction hierarchy is not built (run with --build-ch)")
+            core = self._bidirectional(sources, targets, self.ch_up, upward_only=True)
+        else:
+            raise ValueError("method must be 'auto', 'astar', 'bidirectional' or 'ch'")
+
+        if snap1["edge"] == snap2["edge"]:
+            w = self.edges[int(snap1["edge"])][2]
+            core = min(core, abs(float(snap1["t"]) - float(snap2["t"])) * w)
+        if math.isinf(core):
+            return None
+        return float(snap1["access_m"]) + core + float(snap2["access_m"])
+
+    def build_contraction_hierarchy(self, witness_settle_limit: int = 60) -> None:
+        """
+        Contraction Hierarchies の前処理。
+        ノードを edge difference 順に縮約し、上向き辺（ランクの高いノードへの辺）だけ残す。
+        """
+        n = len(self)
+        nbrs: list[dict[int, float]] = [{} for _ in range(n)]
+        for u, v, w in self.edges:
+            if u == v:
+                continue
+            if w < nbrs[u].get(v, math.inf):
+                nbrs[u][v] = w
+                nbrs[v][u] = w
+        contracted = [False] * n
+        deleted_neighbors = [0] * n
+        rank = [0] * n
+        up: list[list[tuple[int, float]]] = [[] for _ in range(n)]
+
+        def _witness(source: int, skip: int, limit: float, targets: set[int]) -> dict[int, float]:
+            dist = {source: 0.0}
+            heap = [(0.0, source)]
+            settled = 0
+            while heap and settled < witness_settle_limit:
+                d, node = heapq.heappop(heap)
+                if d > dist.get(node, math.inf):
+                    continue
+                if d > limit:
+                    break
+                settled += 1
+                for nxt, w in nbrs[node].items():
+                    if nxt == skip or contracted[nxt]:
+                        continue
+                    nd = d + w
+                    if nd < dist.get(nxt, math.inf):
+                        dist[nxt] = nd
+                        heapq.heappush(heap, (nd, nxt))
+            return {t: dist[t] for t in targets if t in dist}
+
+        def _shortcuts(v: int) -> list[tuple[int, int, float]]:
+            around = [(u, w) for u, w in nbrs[v].items() if not contracted[u]]
+            out: list[tuple[int, int, float]] = []
+            for i, (u, wu) in enumerate(around):
+                rest = {x for x, _ in around[i + 1 :]}
+                if not rest:
+                    continue
+                limit = wu + max(w for x, w in around[i + 1 :])
+                found = _witness(u, v, limit, rest)
+                for x, wx in around[i + 1 :]:
+                    via = wu + wx
+                    if found.get(x, math.inf) > via:
+                        out.append((u, x, via))
+            return out
+
+        def _priority(v: int) -> int:
+            degree = sum(1 for u in nbrs[v] if not contracted[u])
+            return len(_shortcuts(v)) - degree + deleted_neighbors[v]
+
+        heap = [(_priority(v), v) for v in range(n)]
+        heapq.heapify(heap)
+        order = 0
+        while heap:
+            _p, v = heapq.heappop(heap)
+            if contracted[v]:
+                continue
+            current = _priority(v)
+            if heap and current > heap[0][0]:
+                heapq.heappush(heap, (current, v))
+                continue
+            for u, x, via in _shortcuts(v):
+                if via < nbrs[u].get(x, math.inf):
+                    nbrs[u][x] = via
+                    nbrs[x][u] = via
+            up[v] = [(u, w) for u, w in nbrs[v].items() if not contracted[u]]
+            for u, _w in up[v]:
+                deleted_neighbors[u] += 1
+            contracted[v] = True
+            rank[v] = order
+            order += 1
+
+        self.ch_rank = rank
+        self.ch_up = up
+
+
+def load_osm_graph(osm_path: str | Path) -> RoadGraph:
+    """
+    OSM XML（.osm）から歩行用の道路グラフを作る
+    """
+    coords: dict[str, tuple[float, float]] = {}
+    ways: list[list[str]] = []
+    for _event, elem in ET.iterparse(str(osm_path), events=("end",)):
+        if elem.tag == "node":
+            coords[elem.get("id", "")] = (float(elem.get("lat", "0")), float(elem.get("lon", "0")))
+            elem.clear()
+        elif elem.tag == "way":
+            tags = {tag.get("k"): tag.get("v") for tag in elem.findall("tag")}
+            if tags.get("highway") in WALKABLE_HIGHWAYS and tags.get("foot") != "no":
+                ways.append([nd.get("ref", "") for nd in elem.findall("nd")])
+            elem.clear()
+
+    index: dict[str, int] = {}
+    lats: list[float] = []
+    lons: list[float] = []
+    edges: list[tuple[int, int, float]] = []
+
+    def _node(ref: str) -> int | None:
+        if ref not in coords:
+            return None
+        if ref not in index:
+            index[ref] = len(lats)
+            lat, lon = coords[ref]
+            lats.append(lat)
+            lons.append(lon)
+        return index[ref]
+
+    for refs in ways:
+        prev: int | None = None
+        for ref in refs:
+            cur = _node(ref)
+            if cur is not None and prev is not None and cur != prev:
+                edges.append((prev, cur, haversine_m(lats[prev], lons[prev], lats[cur], lons[cur])))
+            prev = cur
+    return RoadGraph(lats, lons, edges)
+
+
+def save_graph(graph: RoadGraph, path: str | Path = ROAD_GRAPH_CACHE_PATH) -> None:
+    """
+    クラスではなく配列だけを保存する（`python saitan_kyori.py --build-ch` で作ると
+    RoadGraph が __main__.RoadGraph になり、サーバーからは読めなくなるため）
+    """
+    data = {
+        "lats": graph.lats,
+        "lons": graph.lons,
+        "edges": graph.edges,
+        "ch_rank": graph.ch_rank,
+        "ch_up": graph.ch_up,
+    }
+    with Path(path).open("wb") as f:
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_graph(path: str | Path = ROAD_GRAPH_CACHE_PATH) -> RoadGraph:
+    with Path(path).open("rb") as f:
+        data = pickle.load(f)
+    if not isinstance(data, dict) or not {"lats", "lons", "edges"} <= set(data):
+        raise TypeError(f"not a saved road graph: {path}")
+    graph = RoadGraph(data["lats"], data["lons"], data["edges"])
+    graph.ch_rank = data.get("ch_rank")
+    graph.ch_up = data.get("ch_up")
+    return graph
+
+
+_GRAPH: RoadGraph | None = None
+_GRAPH_LOADED = False
+_GRAPH_LOCK = threading.Lock()
+MEMORY.register("road_graph", lambda: _GRAPH)
+
+
+def get_road_graph() -> RoadGraph | None:
+    """
+    道路グラフを返す（前処理済み .pkl を優先）。OSM が無ければ None。
+    """
+    global _GRAPH, _GRAPH_LOADED
+    if _GRAPH_LOADED:
+        return _GRAPH
+    with _GRAPH_LOCK:
+        if _GRAPH_LOADED:
+            return _GRAPH
+        osm_mtime = ROAD_NETWORK_PATH.stat().st_mtime if ROAD_NETWORK_PATH.exists() else None
+        if ROAD_GRAPH_CACHE_PATH.exists() and (osm_mtime is None or ROAD_GRAPH_CACHE_PATH.stat().st_mtime >= osm_mtime):
+            try:
+                _GRAPH = load_graph(ROAD_GRAPH_CACHE_PATH)
+            except Exception as e:
+                # 壊れた / 古い形式の .pkl なら OSM から作り直す（OSM も無ければ直線距離）
+                print(f"[road graph] cannot load {ROAD_GRAPH_CACHE_PATH}: {e}")
+        if _GRAPH is None and osm_mtime is not None:
+            try:
+                _GRAPH = load_osm_graph(ROAD_NETWORK_PATH)
+            except Exception as e:
+                print(f"[road graph] cannot load {ROAD_NETWORK_PATH}: {e}; using straight-line distance")
+        _GRAPH_LOADED = True
+        return _GRAPH
+
+
+def distance_m_for_kijun(kijun_name: str, lat1: float, lon1: float, lat2: float, lon2: float) -> tuple[float, str]:
+    """
+    kijun ごとの設定で直線距離 / 道のり距離を切り替える。返り値は (距離m, "network" or "straight")
+    """
+    if uses_network_distance(kijun_name):
+        graph = get_road_graph()
+        if graph is not None:
+            dist_m = graph.network_distance_m(lat1, lon1, lat2, lon2)
+            if dist_m is not None:
+                return dist_m, "network"
+    return haversine_m(lat1, lon1, lat2, lon2), "straight"
+
+
+def nearest_facility_by_network(
+    category: str, lat1: float, lon1: float, candidates: int = NETWORK_CANDIDATES
+) -> tuple[float, dict[str, object]] | None:
+    """
+    一番近い施設を道のり距離で返す。field が無ければ、直線距離で近い candidates 件を比べる。
+    グラフが無い / スナップできないときは None（呼び出し側で直線距離にフォールバック）
+    """
+    graph = get_road_graph()
+    if graph is None:
+        return None
+    # kyori_field.py で前計算済みなら、スナップ1回 + array 読み出しだけで済ませる
+    from kyori_field import get_distance_field
+
+    field = get_distance_field(category)
+    if field is not None and field.graph_signature == graph.signature():
+        return field.nearest(graph, lat1, lon1)
+
+    best: tuple[float, dict[str, object]] | None = None
+    for straight_m, item in get_facility_index(category).k_nearest(lat1, lon1, candidates):
+        # 道のりは直線より短くならないので、ここから先は比べるまでもない
+        if best is not None and straight_m >= best[0]:
+            break
+        dist_m = graph.network_distance_m(lat1, lon1, float(item["lat"]), float(item["lon"]))
+        if dist_m is not None and (best is None or dist_m < best[0]):
+            best = (dist_m, item)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="道路ネットワーク上の最短距離(m)を計算する")
+    parser.add_argument("--osm", default=str(ROAD_NETWORK_PATH), help="OSM XML ファイル")
+    parser.add_argument("--build-ch", action="store_true", help="CH を前処理して .pkl に保存する")
+    parser.add_argument("--lat1", type=float)
+    parser.add_argument("--lon1", type=float)
+    parser.add_argument("--lat2", type=float)
+    parser.add_argument("--lon2", type=float)
+    parser.add_argument("--method", default="auto", choices=["auto", "astar", "bidirectional", "ch"])
+    args = parser.parse_args()
+
+    if args.build_ch:
+        graph = load_osm_graph(args.osm)
+        print(f"nodes: {len(graph)} edges: {len(graph.edges)}")
+        graph.build_contraction_hierarchy()
+        out_path = Path(args.osm).with_suffix(".pkl")
+        save_graph(graph, out_path)
+        print(f"saved: {out_path}")
+        return
+
+    if None in (args.lat1, args.lon1, args.lat2, args.lon2):
+        parser.error("--build-ch または --lat1 --lon1 --lat2 --lon2 を指定してください")
+    graph = get_road_graph() if args.osm == str(ROAD_NETWORK_PATH) else load_osm_graph(args.osm)
+    if graph is None:
+        parser.error(f"road network not found: {args.osm}")
+    print(graph.network_distance_m(args.lat1, args.lon1, args.lat2, args.lon2, method=args.method))
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,7 @@ if str(ROOT_DIR) not in sys.path:
     sys.path.insert(0, str(ROOT_DIR))
 
 from kyori import distance_between_points  # noqa: E402
+from saitan_kyori import nearest_facility_by_network, uses_network_distance  # noqa: E402
 
 
 CITYOFFICES_CSV_PATH = ROOT_DIR / "dataset" / "cityoffices.csv"
@@ -79,6 +80,25 @@ def find_nearest_cityoffices(
     return nearest
 
 
+def find_nearest_cityoffices_by_network(lat1: float, lon1: float) -> dict[str, object] | None:
+    """
+    道路ネットワーク上の道のり距離で最短の市役所を返す（道路グラフが無いときは None）
+    """
+    hit = nearest_facility_by_network("cityoffices", lat1, lon1)
+    if hit is None:
+        return None
+    dist_m, item = hit
+    return {
+        "cityoffices_id": item.get("id", ""),
+        "cityoffices_name": item.get("name", ""),
+        "cityoffices_address": item.get("address", ""),
+        "lat2": item.get("lat", ""),
+        "lon2": item.get("lon", ""),
+        "cityoffices_distance_m": round(dist_m, 1),
+        "error": "",
+    }
+
+
 def get_mini_score_cityoffices_from_kijun(
     distance_m: float | int, kijun_csv_path: str | Path = KIJUN_CSV_PATH
 ) -> dict[str, object]:
@@ -116,10 +136,17 @@ def get_cityoffices_mini_score_by_latlon(lat1: float, lon1: float) -> dict[str,
         "cityoffices_address": "",
         "cityoffices_distance_m": "",
         "mini.score_cityoffices": "",
+        "distance_mode": "straight",
         "error": "",
     }
 
-    nearest = find_nearest_cityoffices(float(lat1), float(lon1))
+    nearest = None
+    if uses_network_distance("cityoffices"):
+        nearest = find_nearest_cityoffices_by_network(float(lat1), float(lon1))
+        if nearest is not None:
+            result["distance_mode"] = "network"
+    if nearest is None:
+        nearest = find_nearest_cityoffices(float(lat1), float(lon1))
     if nearest.get("error"):
         result["error"] = nearest["error"]
         return result
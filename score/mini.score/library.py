@@ -10,6 +10,7 @@ if str(ROOT_DIR) not in sys.path:
     sys.path.insert(0, str(ROOT_DIR))
 
 from kyori import distance_between_points  # noqa: E402
+from saitan_kyori import nearest_facility_by_network, uses_network_distance  # noqa: E402
 
 
 LIBRARY_CSV_PATH = ROOT_DIR / "dataset" / "library.csv"
@@ -77,6 +78,25 @@ def find_nearest_library(lat1: float, lon1: float, library_csv_path: str | Path
     return nearest
 
 
+def find_nearest_library_by_network(lat1: float, lon1: float) -> dict[str, object] | None:
+    """
+    道路ネットワーク上の道のり距離で最短の図書館を返す（道路グラフが無いときは None）
+    """
+    hit = nearest_facility_by_network("library", lat1, lon1)
+    if hit is None:
+        return None
+    dist_m, item = hit
+    return {
+        "library_id": item.get("id", ""),
+        "library_name": item.get("name", ""),
+        "library_address": item.get("address", ""),
+        "lat2": item.get("lat", ""),
+        "lon2": item.get("lon", ""),
+        "library_distance_m": round(dist_m, 1),
+        "error": "",
+    }
+
+
 def get_mini_score_library_from_kijun(distance_m: float | int, kijun_csv_path: str | Path = KIJUN_CSV_PATH) -> dict[str, object]:
     rows = _load_csv_rows(Path(kijun_csv_path), ["utf-8-sig", "utf-8", "cp932", "shift_jis"])
     distance_int = int(float(distance_m))
@@ -112,10 +132,17 @@ def get_library_mini_score_by_latlon(lat1: float, lon1: float) -> dict[str, obje
         "library_address": "",
         "library_distance_m": "",
         "mini.score_library": "",
+        "distance_mode": "straight",
         "error": "",
     }
 
-    nearest = find_nearest_library(float(lat1), float(lon1))
+    nearest = None
+    if uses_network_distance("library"):
+        nearest = find_nearest_library_by_network(float(lat1), float(lon1))
+        if nearest is not None:
+            result["distance_mode"] = "network"
+    if nearest is None:
+        nearest = find_nearest_library(float(lat1), float(lon1))
     if nearest.get("error"):
         result["error"] = nearest["error"]
         return result
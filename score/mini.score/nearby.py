@@ -0,0 +1,118 @@
+import argparse
+import csv
+import sys
+import unicodedata
+from pathlib import Path
+
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from spatial_index import get_facility_index  # noqa: E402
+
+
+KIJUN_CSV_PATH = ROOT_DIR / "score" / "kijun.csv"
+
+# kijun name -> (施設カテゴリ, 半径m)
+COUNT_CRITERIA: dict[str, tuple[str, float]] = {
+    "supermarket_count": ("supermarket", 1000.0),
+    "park_count": ("park", 500.0),
+    "station_count": ("station", 1000.0),
+}
+
+
+def _parse_int(value: object) -> int:
+    return int(str(value).strip().replace(",", ""))
+
+
+def _normalize_text(value: object) -> str:
+    return unicodedata.normalize("NFKC", str(value)).strip()
+
+
+def _load_csv_rows(path: Path, encodings: list[str]) -> list[dict[str, str]]:
+    last_error = None
+    for enc in encodings:
+        try:
+            with path.open("r", newline="", encoding=enc) as f:
+                return list(csv.DictReader(f))
+        except Exception as e:
+            last_error = e
+    raise RuntimeError(f"failed to read csv: {path}") from last_error
+
+
+def count_facilities_within(category: str, lat1: float, lon1: float, radius_m: float) -> int:
+    return get_facility_index(category).count_within(float(lat1), float(lon1), float(radius_m))
+
+
+def get_mini_score_count_from_kijun(
+    number: int,
+    name: str,
+    kijun_csv_path: str | Path = KIJUN_CSV_PATH,
+) -> dict[str, object]:
+    """
+    score/kijun.csv の name 行（件数の min/max）から mini.score を返す
+    """
+    rows = _load_csv_rows(Path(kijun_csv_path), ["utf-8-sig", "utf-8", "cp932", "shift_jis"])
+    target_name = _normalize_text(name)
+
+    for row in rows:
+        if _normalize_text(row.get("name", "")) != target_name:
+            continue
+
+        min_v = _parse_int(row.get("min", 0))
+        max_raw = _normalize_text(row.get("max", ""))
+        max_is_open = max_raw.lower() == "m"
+        max_v = None if max_is_open else _parse_int(max_raw)
+
+        if number < min_v:
+            continue
+        if max_v is None or number <= max_v:
+            return {
+                "kijun_id": row.get("id", ""),
+                "name": target_name,
+                f"mini.score_{target_name}": _parse_int(row.get("mini.score", 0)),
+                "error": "",
+            }
+
+    return {"kijun_id": "", "name": target_name, f"mini.score_{target_name}": "", "error": "KIJUN_RANGE_NOT_FOUND"}
+
+
+def get_count_mini_score_by_latlon(name: str, lat1: float, lon1: float) -> dict[str, object]:
+    """
+    name（例: supermarket_count）の半径内件数と mini.score_<name> を返す
+    """
+    if name not in COUNT_CRITERIA:
+        raise ValueError(f"unknown count criterion: {name} / {sorted(COUNT_CRITERIA)}")
+    category, radius_m = COUNT_CRITERIA[name]
+    result = {
+        "lat1": float(lat1),
+        "lon1": float(lon1),
+        "category": category,
+        "radius_m": radius_m,
+        "number": "",
+        f"mini.score_{name}": "",
+        "error": "",
+    }
+
+    number = count_facilities_within(category, lat1, lon1, radius_m)
+    result["number"] = number
+
+    score_info = get_mini_score_count_from_kijun(number, name)
+    result[f"mini.score_{name}"] = score_info.get(f"mini.score_{name}", "")
+    if score_info.get("error"):
+        result["error"] = score_info["error"]
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="lat1/lon1 から半径内の施設数と mini.score_<name> を返す")
+    parser.add_argument("--name", required=True, choices=sorted(COUNT_CRITERIA))
+    parser.add_argument("--lat1", type=float, required=True)
+    parser.add_argument("--lon1", type=float, required=True)
+    args = parser.parse_args()
+    print(get_count_mini_score_by_latlon(args.name, args.lat1, args.lon1))
+
+
+if __name__ == "__main__":
+    main()
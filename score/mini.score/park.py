@@ -10,6 +10,7 @@ if str(ROOT_DIR) not in sys.path:
     sys.path.insert(0, str(ROOT_DIR))
 
 from kyori import distance_between_points  # noqa: E402
+from saitan_kyori import nearest_facility_by_network, uses_network_distance  # noqa: E402
 
 
 PARK_CSV_PATH = ROOT_DIR / "dataset" / "park.csv"
@@ -78,6 +79,25 @@ def find_nearest_park(lat1: float, lon1: float, park_csv_path: str | Path = PARK
     return nearest
 
 
+def find_nearest_park_by_network(lat1: float, lon1: float) -> dict[str, object] | None:
+    """
+    道路ネットワーク上の道のり距離で最短の公園を返す（道路グラフが無いときは None）
+    """
+    hit = nearest_facility_by_network("park", lat1, lon1)
+    if hit is None:
+        return None
+    dist_m, item = hit
+    return {
+        "park_id": item.get("id", ""),
+        "park_name": item.get("name", ""),
+        "park_address": item.get("address", ""),
+        "lat2": item.get("lat", ""),
+        "lon2": item.get("lon", ""),
+        "park_distance_m": round(dist_m, 1),
+        "error": "",
+    }
+
+
 def get_mini_score_park_from_kijun(distance_m: float | int, kijun_csv_path: str | Path = KIJUN_CSV_PATH) -> dict[str, object]:
     rows = _load_csv_rows(Path(kijun_csv_path), ["utf-8-sig", "utf-8", "cp932", "shift_jis"])
     distance_int = int(float(distance_m))
@@ -113,10 +133,17 @@ def get_park_mini_score_by_latlon(lat1: float, lon1: float) -> dict[str, object]
         "park_address": "",
         "park_distance_m": "",
         "mini.score_park": "",
+        "distance_mode": "straight",
         "error": "",
     }
 
-    nearest = find_nearest_park(float(lat1), float(lon1))
+    nearest = None
+    if uses_network_distance("park"):
+        nearest = find_nearest_park_by_network(float(lat1), float(lon1))
+        if nearest is not None:
+            result["distance_mode"] = "network"
+    if nearest is None:
+        nearest = find_nearest_park(float(lat1), float(lon1))
     if nearest.get("error"):
         result["error"] = nearest["error"]
         return result
@@ -10,6 +10,7 @@ if str(ROOT_DIR) not in sys.path:
     sys.path.insert(0, str(ROOT_DIR))
 
 from kyori import distance_between_points  # noqa: E402
+from saitan_kyori import nearest_facility_by_network, uses_network_distance  # noqa: E402
 
 
 STATION_CSV_PATH = ROOT_DIR / "dataset" / "station.csv"
@@ -82,6 +83,25 @@ def find_nearest_station(lat1: float, lon1: float, station_csv_path: str | Path
     return nearest
 
 
+def find_nearest_station_by_network(lat1: float, lon1: float) -> dict[str, object] | None:
+    """
+    道路ネットワーク上の道のり距離で最短の駅を返す（道路グラフが無いときは None）
+    """
+    hit = nearest_facility_by_network("station", lat1, lon1)
+    if hit is None:
+        return None
+    dist_m, item = hit
+    return {
+        "station_id": item.get("id", ""),
+        "station_name": item.get("name", ""),
+        "station_address": item.get("address", ""),
+        "lat2": item.get("lat", ""),
+        "lon2": item.get("lon", ""),
+        "station_distance_m": round(dist_m, 1),
+        "error": "",
+    }
+
+
 def get_mini_score_station_from_kijun(
     distance_m: float | int,
     kijun_csv_path: str | Path = KIJUN_CSV_PATH,
@@ -128,10 +148,17 @@ def get_station_mini_score_by_latlon(lat1: float, lon1: float) -> dict[str, obje
         "station_address": "",
         "station_distance_m": "",
         "mini.score_station": "",
+        "distance_mode": "straight",
         "error": "",
     }
 
-    nearest = find_nearest_station(float(lat1), float(lon1))
+    nearest = None
+    if uses_network_distance("eki"):
+        nearest = find_nearest_station_by_network(float(lat1), float(lon1))
+        if nearest is not None:
+            result["distance_mode"] = "network"
+    if nearest is None:
+        nearest = find_nearest_station(float(lat1), float(lon1))
     if nearest.get("error"):
         result["error"] = nearest["error"]
         return result
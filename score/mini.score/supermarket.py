@@ -10,6 +10,7 @@ if str(ROOT_DIR) not in sys.path:
     sys.path.insert(0, str(ROOT_DIR))
 
 from kyori import distance_between_points  # noqa: E402
+from saitan_kyori import nearest_facility_by_network, uses_network_distance  # noqa: E402
 
 
 # dataset file name is currently "supermaeket.csv" (as-is)
@@ -81,6 +82,25 @@ def find_nearest_supermarket(
     return nearest
 
 
+def find_nearest_supermarket_by_network(lat1: float, lon1: float) -> dict[str, object] | None:
+    """
+    道路ネットワーク上の道のり距離で最短のスーパーを返す（道路グラフが無いときは None）
+    """
+    hit = nearest_facility_by_network("supermarket", lat1, lon1)
+    if hit is None:
+        return None
+    dist_m, item = hit
+    return {
+        "supermarket_id": item.get("id", ""),
+        "supermarket_name": item.get("name", ""),
+        "supermarket_address": item.get("address", ""),
+        "lat2": item.get("lat", ""),
+        "lon2": item.get("lon", ""),
+        "supermarket_distance_m": round(dist_m, 1),
+        "error": "",
+    }
+
+
 def get_mini_score_supermarket_from_kijun(
     distance_m: float | int, kijun_csv_path: str | Path = KIJUN_CSV_PATH
 ) -> dict[str, object]:
@@ -118,10 +138,17 @@ def get_supermarket_mini_score_by_latlon(lat1: float, lon1: float) -> dict[str,
         "supermarket_address": "",
         "supermarket_distance_m": "",
         "mini.score_supermarket": "",
+        "distance_mode": "straight",
         "error": "",
     }
 
-    nearest = find_nearest_supermarket(float(lat1), float(lon1))
+    nearest = None
+    if uses_network_distance("supermarket"):
+        nearest = find_nearest_supermarket_by_network(float(lat1), float(lon1))
+        if nearest is not None:
+            result["distance_mode"] = "network"
+    if nearest is None:
+        nearest = find_nearest_supermarket(float(lat1), float(lon1))
     if nearest.get("error"):
         result["error"] = nearest["error"]
         return result
@@ -0,0 +1,207 @@
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+
+from address_canon import canonicalize_address
+from gazetteer import resolve_ward_from_text
+from kajuave import weighted_score
+from score_result import ScoreResult
+from server import RESULT_CSV_FIELDS, SCORE_KEYS, fill_criteria_scores, geocode_address, new_result, parse_coordinates
+from zahyou_ku import detect_kyoto_ku_from_values
+
+
+WEIGHTED_FIELD = "weighted_result"
+
+
+def parse_weights(text: str) -> list[float]:
+    """
+    "anzen=5,station=3,..."（省略した基準は0）または8個の数値 "5,3,1,..." を受け取る
+    """
+    parts = [p.strip() for p in text.split(",") if p.strip()]
+    if parts and all("=" not in p for p in parts):
+        if len(parts) != len(SCORE_KEYS):
+            raise ValueError(f"weights must have {len(SCORE_KEYS)} values: {list(SCORE_KEYS)}")
+        return [float(p) for p in parts]
+    named: dict[str, float] = {}
+    for part in parts:
+        name, _, value = part.partition("=")
+        if name.strip() not in SCORE_KEYS:
+            raise ValueError(f"unknown criterion: {name} / {list(SCORE_KEYS)}")
+        named[name.strip()] = float(value)
+    return [named.get(name, 0.0) for name in SCORE_KEYS]
+
+
+def _geocode_row(item: tuple[int, dict[str, str]], args: argparse.Namespace) -> ScoreResult:
+    """
+    I/O ステージ: 住所 -> 座標 -> 区（入力に座標/区があればそれを使う）
+    """
+    row_no, row = item
+    address = (row.get(args.address_col) or "").strip() if args.address_col else ""
+    result = new_result(address)
+    try:
+        lat_text = (row.get(args.lat_col) or "").strip() if args.lat_col else ""
+        lon_text = (row.get(args.lon_col) or "").strip() if args.lon_col else ""
+        if lat_text and lon_text:
+            # 座標入力は geocode しない。京都市の範囲外はここで止める
+            result.lat1, result.lon1 = parse_coordinates({"lat": lat_text, "lon": lon_text})
+        elif address:
+            result.update(geocode_address(address))
+        else:
+            result.error = f"row {row_no}: empty address"
+            return result
+        if result.error or result.lat1 is None or result.lon1 is None:
+            return result
+
+        ku = (row.get(args.ku_col) or "").strip() if args.ku_col else ""
+        if not ku and address:
+            # 住所に区が書いてあれば逆 geocode しない
+            ku, result.ku_source = resolve_ward_from_text(canonicalize_address(address))
+        if not ku:
+            ku_result = detect_kyoto_ku_from_values(result.lat1, result.lon1)
+            ku = str(ku_result.get("ku", ""))
+            result.ku_source = "coordinates"
+            if ku_result.get("error") and not result.error:
+                result.error = str(ku_result["error"])
+        result.ku = ku or None
+    except Exception as e:
+        result.error = f"row {row_no}: {e}"
+    return result
+
+
+def _score_worker(result: ScoreResult) -> ScoreResult:
+    """
+    CPU ステージ（別プロセス）: 全基準の mini.score と正規化（ScoreResult は値だけの tuple で受け渡しされる）
+    """
+    if result.lat1 is None or result.lon1 is None:
+        return result
+    try:
+        fill_criteria_scores(result, float(result.lat1), float(result.lon1), max_workers=1)
+    except Exception as e:
+        result.error = str(e)
+    return result
+
+
+def _weighted(result: ScoreResult, weights: list[float]) -> object:
+    try:
+        scores = [float(result.get(key)) for key in SCORE_KEYS.values()]
+        return round(weighted_score(scores, weights) * 100, 4)
+    except (TypeError, ValueError):
+        return ""
+
+
+def _load_checkpoint(path: Path, input_csv: Path) -> dict[str, object] | None:
+    if not path.exists():
+        return None
+    state = json.loads(path.read_text(encoding="utf-8"))
+    if state.get("input") != str(input_csv.resolve()):
+        raise ValueError(f"checkpoint {path} belongs to another input: {state.get('input')}")
+    return state
+
+
+def _save_checkpoint(path: Path, input_csv: Path, rows_done: int, output_bytes: int) -> None:
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(
+        json.dumps({"input": str(input_csv.resolve()), "rows_done": rows_done, "output_bytes": output_bytes}),
+        encoding="utf-8",
+    )
+    os.replace(tmp, path)
+
+
+def score_csv(args: argparse.Namespace) -> int:
+    in_path = Path(args.input_csv)
+    out_path = Path(args.output_csv)
+    ckpt_path = Path(args.checkpoint) if args.checkpoint else out_path.with_suffix(out_path.suffix + ".ckpt")
+    weights = parse_weights(args.weights) if args.weights else None
+
+    state = _load_checkpoint(ckpt_path, in_path) if out_path.exists() else None
+    rows_done = int(state["rows_done"]) if state else 0
+
+    with in_path.open("r", newline="", encoding="utf-8-sig") as f_in:
+        reader = csv.DictReader(f_in)
+        in_fields = reader.fieldnames or []
+        if args.address_col not in in_fields and not (args.lat_col in in_fields and args.lon_col in in_fields):
+            raise ValueError(f"need '{args.address_col}' or '{args.lat_col}'/'{args.lon_col}' columns: {in_fields}")
+        if args.lat_col not in in_fields or args.lon_col not in in_fields:
+            args.lat_col = args.lon_col = ""
+        if args.ku_col not in in_fields:
+            args.ku_col = ""
+
+        out_fields = list(in_fields) + [k for k in RESULT_CSV_FIELDS if k not in in_fields]
+        if weights is not None:
+            out_fields.append(WEIGHTED_FIELD)
+
+        if state:
+            # 最後のチェックポイント以降に書きかけた行は捨ててから追記する
+            with out_path.open("r+b") as f_trunc:
+                f_trunc.truncate(int(state["output_bytes"]))
+            mode = "a"
+            print(f"[score-csv] resume from row {rows_done + 2}", file=sys.stderr)
+        else:
+            mode = "w"
+
+        rows = enumerate(reader, start=2)
+        if rows_done:
+            rows = islice(rows, rows_done, None)
+
+        with out_path.open(mode, newline="", encoding="utf-8-sig") as f_out, ThreadPoolExecutor(
+            max_workers=args.io_workers
+        ) as io_pool, ProcessPoolExecutor(max_workers=args.workers) as cpu_pool:
+            writer = csv.DictWriter(f_out, fieldnames=out_fields, extrasaction="ignore")
+            if mode == "w":
+                writer.writeheader()
+                f_out.flush()
+                _save_checkpoint(ckpt_path, in_path, 0, f_out.tell())
+
+            while True:
+                chunk = list(islice(rows, args.chunk_size))
+                if not chunk:
+                    break
+                located = list(io_pool.map(lambda item: _geocode_row(item, args), chunk))
+                scored = cpu_pool.map(_score_worker, located, chunksize=max(1, len(located) // (args.workers * 4)))
+                for (_row_no, row), result in zip(chunk, scored):
+                    out_row = dict(row)
+                    out_row.update(zip(RESULT_CSV_FIELDS, result.csv_row(RESULT_CSV_FIELDS)))
+                    if weights is not None:
+                        out_row[WEIGHTED_FIELD] = _weighted(result, weights)
+                    writer.writerow(out_row)
+                f_out.flush()
+                rows_done += len(chunk)
+                _save_checkpoint(ckpt_path, in_path, rows_done, f_out.tell())
+                print(f"[score-csv] rows={rows_done}", file=sys.stderr)
+
+    ckpt_path.unlink(missing_ok=True)
+    return rows_done
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="score-csv",
+        description="住所または座標の CSV を 住所->座標->区->全基準->正規化(->加重平均) まで一括で採点する",
+    )
+    parser.add_argument("input_csv", help="入力CSV（address 列 または lat1/lon1 列）")
+    parser.add_argument("output_csv", nargs="?", default="score_csv_output.csv", help="出力CSV")
+    parser.add_argument("--address-col", default="address", help="住所列名")
+    parser.add_argument("--lat-col", default="lat1", help="緯度列名（あれば geocode しない）")
+    parser.add_argument("--lon-col", default="lon1", help="経度列名")
+    parser.add_argument("--ku-col", default="ku", help="区の列名（あれば区判定しない）")
+    parser.add_argument("--weights", help=f"加重平均の重み（{','.join(SCORE_KEYS)} の順、または name=weight）")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="採点プロセス数")
+    parser.add_argument("--io-workers", type=int, default=8, help="geocode/区判定のスレッド数")
+    parser.add_argument("--chunk-size", type=int, default=256, help="チェックポイント間の行数")
+    parser.add_argument("--checkpoint", help="チェックポイントファイル（既定: 出力CSV + .ckpt）")
+    args = parser.parse_args()
+    if args.workers < 1 or args.io_workers < 1 or args.chunk_size < 1:
+        parser.error("--workers / --io-workers / --chunk-size must be >= 1")
+
+    rows = score_csv(args)
+    print(f"saved: {args.output_csv}")
+    print(f"rows: {rows}")
+
+
+if __name__ == "__main__":
+    main()
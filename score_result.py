@@ -0,0 +1,342 @@
+import html
+import json
+import re
+
+
+# 採点結果を「区・施設ごとの小さな記録」+ 状態 で持つ。値が無いところは None。
+# 外（JSON / CSV / HTML / 履歴）に出すときだけ、これまでと同じ列名・同じ並びの平たい形（None は ""）にする
+
+
+def missing_to_none(value: object) -> object:
+    """
+    採点モジュールが返す "" （値なし）を None にする
+    """
+    return None if isinstance(value, str) and not value else value
+
+
+class CriterionRecord:
+    """
+    1つの基準の結果。number: 件数・人数など / mini_score: mini.score / score: 正規化した score /
+    name・address・distance_m・lat・lon: 最寄り施設 / status: "timeout" など / error: その基準のエラー
+    """
+
+    __slots__ = ("number", "mini_score", "score", "name", "address", "distance_m", "lat", "lon", "status", "error")
+
+    def __init__(
+        self,
+        number: object = None,
+        mini_score: object = None,
+        score: object = None,
+        name: object = None,
+        address: object = None,
+        distance_m: object = None,
+        lat: object = None,
+        lon: object = None,
+        status: str | None = None,
+        error: str | None = None,
+    ):
+        self.number = missing_to_none(number)
+        self.mini_score = missing_to_none(mini_score)
+        self.score = missing_to_none(score)
+        self.name = missing_to_none(name)
+        self.address = missing_to_none(address)
+        self.distance_m = missing_to_none(distance_m)
+        self.lat = missing_to_none(lat)
+        self.lon = missing_to_none(lon)
+        self.status = status or None
+        self.error = error or None
+
+    def __repr__(self) -> str:
+        values = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__ if getattr(self, name) is not None)
+        return f"CriterionRecord({values})"
+
+    def __getstate__(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state: tuple) -> None:
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+
+# 平たい形の列 -> (基準名, CriterionRecord の属性)。基準名が None の列は ScoreResult 自身の属性。
+# 並びはこれまでの結果 dict と同じ（JSON の見た目を変えない）。anzen の mini.number / mini.score / score も基準の1つとして持つ
+RESULT_FIELDS: list[tuple[str, str | None, str]] = [
+    ("address1", None, "address1"),
+    ("lat1", None, "lat1"),
+    ("lon1", None, "lon1"),
+    ("ku", None, "ku"),
+    ("hanzai_number", "hanzai", "number"),
+    ("mini.score_hanzai", "hanzai", "mini_score"),
+    ("jiko_number", "jiko", "number"),
+    ("mini.score_jiko", "jiko", "mini_score"),
+    ("population_number", "population", "number"),
+    ("mini.score_population", "population", "mini_score"),
+    ("population_score", "population", "score"),
+    ("kindergarden_number", "kindergarden", "number"),
+    ("mini.score_kindergarden", "kindergarden", "mini_score"),
+    ("kindergarden_score", "kindergarden", "score"),
+    ("park_name", "park", "name"),
+    ("park_address", "park", "address"),
+    ("park_distance_m", "park", "distance_m"),
+    ("mini.score_park", "park", "mini_score"),
+    ("park_score", "park", "score"),
+    ("supermarket_name", "supermarket", "name"),
+    ("supermarket_address", "supermarket", "address"),
+    ("supermarket_distance_m", "supermarket", "distance_m"),
+    ("mini.score_supermarket", "supermarket", "mini_score"),
+    ("supermarket_score", "supermarket", "score"),
+    ("library_name", "library", "name"),
+    ("library_address", "library", "address"),
+    ("library_distance_m", "library", "distance_m"),
+    ("mini.score_library", "library", "mini_score"),
+    ("library_score", "library", "score"),
+    ("cityoffices_name", "cityoffices", "name"),
+    ("cityoffices_address", "cityoffices", "address"),
+    ("cityoffices_distance_m", "cityoffices", "distance_m"),
+    ("mini.score_cityoffices", "cityoffices", "mini_score"),
+    ("cityoffices_score", "cityoffices", "score"),
+    ("supermarket_count_number", "supermarket_count", "number"),
+    ("mini.score_supermarket_count", "supermarket_count", "mini_score"),
+    ("supermarket_count_score", "supermarket_count", "score"),
+    ("park_count_number", "park_count", "number"),
+    ("mini.score_park_count", "park_count", "mini_score"),
+    ("park_count_score", "park_count", "score"),
+    ("station_count_number", "station_count", "number"),
+    ("mini.score_station_count", "station_count", "mini_score"),
+    ("station_count_score", "station_count", "score"),
+    ("mini.number", "anzen", "number"),
+    ("mini.score", "anzen", "mini_score"),
+    ("score", "anzen", "score"),
+    ("station_score", "station", "score"),
+    ("anzen_score_sum", None, "anzen_score_sum"),
+    ("station_name", "station", "name"),
+    ("station_address", "station", "address"),
+    ("station_distance_m", "station", "distance_m"),
+    ("mini.score_station", "station", "mini_score"),
+    ("lat2", "kokyou", "lat"),
+    ("lon2", "kokyou", "lon"),
+    ("kokyou_name", "kokyou", "name"),
+    ("kokyou_address", "kokyou", "address"),
+    ("kokyou_kyori_m", "kokyou", "distance_m"),
+    ("geocode_status", None, "geocode_status"),
+    ("ku_status", None, "ku_status"),
+    ("ku_source", None, "ku_source"),
+    ("dataset_version", None, "dataset_version"),
+    ("partial", None, "partial"),
+    ("error", None, "error"),
+]
+_ACCESSORS: dict[str, tuple[str | None, str]] = {key: (criterion, attr) for key, criterion, attr in RESULT_FIELDS}
+# 表に無い件数の基準（nearby.COUNT_CRITERIA に後から足したもの）の列
+_COUNT_KEY_RE = re.compile(r"^(?:mini\.score_(?P<mini>\w+)|(?P<number>\w+)_number|(?P<score>\w+)_score)$")
+_COUNT_FIELDS = (("{}_number", "number"), ("mini.score_{}", "mini_score"), ("{}_score", "score"))
+
+
+_CRITERION_FIELDS: dict[str, list[tuple[str, str]]] = {}
+for _key, _criterion, _attr in RESULT_FIELDS:
+    if _criterion:
+        _CRITERION_FIELDS.setdefault(_criterion, []).append((_key, _attr))
+
+
+def criterion_items(criterion: str, record: CriterionRecord) -> list[tuple[str, object]]:
+    """
+    1つの基準の記録を平たい形の (列, 値) にする（None は ""）
+    """
+    fields = _CRITERION_FIELDS.get(criterion) or [(template.format(criterion), attr) for template, attr in _COUNT_FIELDS]
+    return [(key, "" if getattr(record, attr) is None else getattr(record, attr)) for key, attr in fields]
+
+
+def _accessor(key: str) -> tuple[str | None, str] | None:
+    found = _ACCESSORS.get(key)
+    if found is not None:
+        return found
+    match = _COUNT_KEY_RE.match(key)
+    if match is None:
+        return None
+    kind = match.lastgroup or ""
+    return match.group(kind), {"mini": "mini_score", "number": "number", "score": "score"}[kind]
+
+
+class ScoreResult:
+    """
+    1つの住所（座標）の採点結果。criteria は 基準名 -> CriterionRecord（"anzen" "kokyou" も入る）。
+    キャッシュに入れたあとは変更しない（to_json() の結果を覚えておいて使い回す）
+    """
+
+    __slots__ = (
+        "address1",
+        "lat1",
+        "lon1",
+        "ku",
+        "criteria",
+        "anzen_score_sum",
+        "geocode_status",
+        "ku_status",
+        "ku_source",
+        "dataset_version",
+        "partial",
+        "error",
+        "extras",
+        "_json",
+    )
+    _STATE = __slots__[:-1]
+
+    def __init__(self, address1: str = ""):
+        self.address1 = address1
+        self.lat1: float | None = None
+        self.lon1: float | None = None
+        self.ku: str | None = None
+        self.criteria: dict[str, CriterionRecord] = {}
+        self.anzen_score_sum: float | None = None
+        self.geocode_status: str | None = None
+        self.ku_status: str | None = None
+        self.ku_source: str | None = None
+        self.dataset_version: str | None = None
+        self.partial = False
+        self.error: str | None = None
+        # 表に無い列（あれば最後に出す）
+        self.extras: dict[str, object] | None = None
+        self._json: bytes | None = None
+
+    def __repr__(self) -> str:
+        return f"ScoreResult({self.address1!r}, ku={self.ku!r}, criteria={sorted(self.criteria)}, error={self.error!r})"
+
+    def __getstate__(self) -> tuple:
+        return tuple(getattr(self, name) for name in self._STATE)
+
+    def __setstate__(self, state: tuple) -> None:
+        for name, value in zip(self._STATE, state):
+            setattr(self, name, value)
+        self._json = None
+
+    @classmethod
+    def from_dict(cls, data: dict[str, object]) -> "ScoreResult":
+        """
+        平たい形（これまでの結果 dict / 結果 CSV の行）から作る
+        """
+        result = cls(str(data.get("address1", "") or ""))
+        result.update({key: value for key, value in data.items() if key != "address1"})
+        return result
+
+    def record(self, criterion: str) -> CriterionRecord:
+        """
+        基準の記録（無ければ空の記録を作って入れる）
+        """
+        found = self.criteria.get(criterion)
+        if found is None:
+            found = self.criteria[criterion] = CriterionRecord()
+        return found
+
+    def value(self, key: str) -> object:
+        """
+        平たい形の列の値（無いところは None）
+        """
+        found = _accessor(key)
+        if found is None:
+            return (self.extras or {}).get(key)
+        criterion, attr = found
+        if criterion is None:
+            return getattr(self, attr)
+        record = self.criteria.get(criterion)
+        return None if record is None else getattr(record, attr)
+
+    def get(self, key: str, default: object = "") -> object:
+        """
+        dict.get と同じ使い方で平たい形の値を返す（None は ""）
+        """
+        if _accessor(key) is None and key != "criteria_status" and key not in (self.extras or {}):
+            return default
+        if key == "criteria_status":
+            return self.criteria_status() or default
+        value = self.value(key)
+        return "" if value is None else value
+
+    def set(self, key: str, value: object) -> None:
+        self._json = None
+        if key == "criteria_status":
+            for criterion, status in dict(value or {}).items():  # type: ignore[call-overload]
+                self.record(criterion).status = status
+            return
+        found = _accessor(key)
+        if found is None:
+            if self.extras is None:
+                self.extras = {}
+            self.extras[key] = value
+            return
+        criterion, attr = found
+        if attr == "partial":
+            self.partial = bool(value)
+            return
+        value = missing_to_none(value)
+        if criterion is None:
+            setattr(self, attr, value)
+        else:
+            setattr(self.record(criterion), attr, value)
+
+    def update(self, fields: dict[str, object]) -> None:
+        for key, value in fields.items():
+            self.set(key, value)
+
+    def merge(self, scored: "ScoreResult") -> None:
+        """
+        座標から採点した部分（区・各基準・状態）を入れる。scored のエラーがあればそちらを使う
+        """
+        self._json = None
+        self.ku = scored.ku
+        self.ku_source = scored.ku_source
+        self.ku_status = scored.ku_status
+        self.criteria.update(scored.criteria)
+        self.anzen_score_sum = scored.anzen_score_sum
+        self.partial = self.partial or scored.partial
+        self.error = scored.error or self.error
+
+    def criteria_status(self) -> dict[str, str]:
+        return {name: record.status for name, record in sorted(self.criteria.items()) if record.status}
+
+    def items(self):
+        """
+        平たい形の (列, 値) を順に返す。並びはこれまでの結果 dict と同じ（表に無い基準・criteria_status・extras は最後）
+        """
+        for key, criterion, attr in RESULT_FIELDS:
+            if criterion is None:
+                value = getattr(self, attr)
+            else:
+                record = self.criteria.get(criterion)
+                value = None if record is None else getattr(record, attr)
+            yield key, "" if value is None else value
+        for criterion, record in self.criteria.items():
+            if criterion not in _CRITERION_FIELDS:
+                yield from criterion_items(criterion, record)
+        status = self.criteria_status()
+        if status:
+            yield "criteria_status", status
+        if self.extras:
+            yield from self.extras.items()
+
+    def to_dict(self) -> dict[str, object]:
+        return dict(self.items())
+
+    def to_json(self) -> bytes:
+        """
+        JSON（UTF-8）。一度作ったら覚えておく
+        """
+        if self._json is None:
+            self._json = json.dumps(self.to_dict(), ensure_ascii=False).encode("utf-8")
+        return self._json
+
+    def csv_row(self, fields: list[str]) -> list[object]:
+        return [self.get(key) for key in fields]
+
+    def escaped(self) -> dict[str, str]:
+        """
+        HTML に埋め込む用（全部の値を html.escape した文字列）
+        """
+        return {key: html.escape(str(value)) for key, value in self.items()}
+
+
+def result_json_default(value: object) -> object:
+    """
+    json.dumps(..., default=result_json_default) で ScoreResult を入れ子のまま出せるようにする
+    """
+    if isinstance(value, ScoreResult):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -5,6 +5,8 @@ import importlib.util
 from pathlib import Path
 from typing import Iterable
 
+import numpy as np
+
 # バックエンド用の保持変数（必要なら参照可能）
 RAW_VALUES: list[float] = []
 AXIS_VALUES: list[int] = []
@@ -27,6 +29,32 @@ def normalize_to_unit(value: float, max_value: float, min_value: float = 0.0) ->
     return (value - min_value) / (max_value - min_value)
 
 
+def normalize_array(values: object, axis_values: object, strict: bool = True) -> np.ndarray:
+    """
+    値の配列を一度に正規化する（モジュール変数は使わないのでスレッドから同時に呼んでよい）
+    values: 1次元（基準ごと）または N×C（N件 × C基準）。NaN は未計測としてそのまま NaN
+    axis_values: values と同じ形か、最後の次元に合わせて broadcast できる形
+    strict=True なら範囲外は ValueError、False なら NaN
+    """
+    data = np.asarray(values, dtype=np.float64)
+    axes = np.asarray(axis_values, dtype=np.int64)
+    if data.ndim == 1 and axes.ndim == 1 and data.shape != axes.shape:
+        raise ValueError("values and axis_values must have the same length")
+    if np.any(axes <= 0):
+        raise ValueError("axis_values must be >= 1")
+
+    denominator = np.broadcast_to(axes * DENOMINATOR_UNIT, data.shape)
+    out_of_range = (data < 0) | (data > denominator)
+    if strict and np.any(out_of_range):
+        index = np.flatnonzero(out_of_range)[0]
+        raise ValueError(
+            f"value({data.flat[index]}) is out of range: 0.0 - {denominator.flat[index]}"
+        )
+    normalized = data / denominator
+    normalized[out_of_range] = np.nan
+    return normalized
+
+
 def normalize_values(values: Iterable[float], axis_values: Iterable[int]) -> list[float]:
     """
     複数の値を正規化する
@@ -36,21 +64,9 @@ def normalize_values(values: Iterable[float], axis_values: Iterable[int]) -> lis
       -> [8/10, 5/20, 10/30]
     """
     data = [float(v) for v in values]
-    axes = [int(a) for a in axis_values]
-
     if not data:
         raise ValueError("values is empty")
-    if len(data) != len(axes):
-        raise ValueError("values and axis_values must have the same length")
-    if any(a <= 0 for a in axes):
-        raise ValueError("axis_values must be >= 1")
-
-    normalized: list[float] = []
-    for value, axis in zip(data, axes):
-        denominator = float(axis) * DENOMINATOR_UNIT
-        normalized.append(normalize_to_unit(value, denominator))
-
-    return normalized
+    return normalize_array(data, [int(a) for a in axis_values]).tolist()
 
 
 def build_score_map(normalized_values: Iterable[float]) -> dict[str, float]:
@@ -88,10 +104,9 @@ def normalize_mini_score_result(result: dict[str, object]) -> dict[str, object]:
 
     mini_number = int(float(result["mini.number"]))
     mini_score = float(result["mini.score"])
-    normalized_score = normalize_values([mini_score], [mini_number])[0]
 
     out = dict(result)
-    out["score"] = normalized_score
+    out["score"] = float(normalize_array([mini_score], [mini_number])[0])
     return out
 
 
@@ -1,18 +1,51 @@
 ﻿import csv
+import contextvars
 import html
 import importlib.util
 import json
+import math
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from functools import lru_cache
-from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
+import signal
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from pathlib import Path
-from urllib.parse import parse_qs
+from typing import Callable, Iterator
+from urllib.parse import parse_qs, urlparse
 from dotenv import load_dotenv
+import numpy as np
 
 from address1_where import geocode_address
+from address_canon import canonicalize_address
+from admission import (
+    DEBUG_LANE,
+    LIGHT_LANE,
+    RATE_LIMITER,
+    SCORE_LANE,
+    AdmissionLane,
+    BoundedThreadingHTTPServer,
+    client_id,
+)
+from dataset_store import DATASETS
+from gazetteer import resolve_ward_from_text
+from geocode_guard import FRESH_OUTCOMES, GuardedCall
+from kajuave import top_k_per_profile, weighted_score_matrix
+from kijun_table import KijunTable, get_kijun_table, install_kijun_table
 from kyori import distance_between_points
-from zahyou_ku import detect_kyoto_ku_from_values
+from memory_report import MEMORY, TRACEMALLOC_FRAMES, lru_trimmer, parse_size, tracemalloc_top
+from rescore import MeasurementStore, rederive_results, simulate_kijun
+from prefork import PreforkSupervisor
+from profiling import PROFILE_MAX_SECONDS, RequestProfile, profile_process, token_ok, worker_initializer
+from saitan_kyori import KIJUN_CATEGORIES, get_road_graph, uses_network_distance
+from score_result import CriterionRecord, ScoreResult, criterion_items, missing_to_none, result_json_default
+from singleflight import SingleFlight
+from spatial_index import FACILITY_CSV_PATHS, get_facility_index, install_index, query_nearby
+from warm_start import SNAPSHOT_PATH, dataset_signature, load_snapshot, save_snapshot
+from zahyou_ku import KYOTO_WARDS, detect_kyoto_ku_from_values
 
 load_dotenv()
 
@@ -37,6 +70,7 @@ CITYOFFICES_PATH = BASE_DIR / "score" / "mini.score" / "cityoffices.py"
 KINDERGARDEN_PATH = BASE_DIR / "score" / "mini.score" / "kindergarden.py"
 ANZEN_PATH = BASE_DIR / "score" / "anzen.py"
 STATION_PATH = BASE_DIR / "score" / "mini.score" / "station.mini.py"
+NEARBY_PATH = BASE_DIR / "score" / "mini.score" / "nearby.py"
 SEIKIKA_PATH = BASE_DIR / "seikika.py"
 
 
@@ -55,9 +89,23 @@ def load_module_from_path(name: str, path: Path):
 
 
 _MODULE_CACHE: dict[str, object] = {}
+# 読み込んだ採点モジュールが持つデータ（モジュールの変数。関数・クラスは数えない）
+MEMORY.register("module_cache", lambda: [vars(module) for module in _MODULE_CACHE.values()])
 
 KIJUN_FIELDS = ["id", "name", "min", "max", "mini.score"]
 
+# app.html の重み付け8基準 -> 正規化済み score の key
+SCORE_KEYS = {
+    "anzen": "score",
+    "station": "station_score",
+    "population": "population_score",
+    "park": "park_score",
+    "supermarket": "supermarket_score",
+    "library": "library_score",
+    "cityoffices": "cityoffices_score",
+    "kindergarden": "kindergarden_score",
+}
+
 
 def load_kijun_rows() -> list[dict[str, str]]:
     if not KIJUN_CSV_PATH.exists():
@@ -70,7 +118,11 @@ def load_kijun_rows() -> list[dict[str, str]]:
         return rows
 
 
-def save_kijun_rows(rows: list[dict[str, object]]) -> None:
+def validate_kijun_rows(rows: list[dict[str, object]]) -> list[dict[str, str]]:
+    """
+    kijun の行を検証・整形して返す（name ごとに10行、範囲の重複なし）
+    """
+
     def _parse_num(text: str) -> float | None:
         try:
             return float(text)
@@ -78,6 +130,7 @@ def save_kijun_rows(rows: list[dict[str, object]]) -> None:
             return None
 
     def _has_overlap(group_rows: list[dict[str, str]]) -> bool:
+        # 開始値で並べ、それまでの最大の終了値と比べれば O(n log n) で判定できる
         intervals: list[tuple[float, float]] = []
         for row in group_rows:
             min_text = str(row.get("min", "")).strip()
@@ -87,12 +140,12 @@ def save_kijun_rows(rows: list[dict[str, object]]) -> None:
             if start is None or end is None:
                 continue
             intervals.append((start, end))
-        for i in range(len(intervals)):
-            a_start, a_end = intervals[i]
-            for j in range(i + 1, len(intervals)):
-                b_start, b_end = intervals[j]
-                if a_start <= b_end and b_start <= a_end:
-                    return True
+        intervals.sort()
+        max_end = float("-inf")
+        for start, end in intervals:
+            if start <= max_end:
+                return True
+            max_end = max(max_end, end)
         return False
 
     normalized: list[dict[str, str]] = []
@@ -130,72 +183,88 @@ def save_kijun_rows(rows: list[dict[str, object]]) -> None:
 
     for idx, row in enumerate(normalized, start=1):
         row["id"] = str(idx)
+    return normalized
 
+
+def save_kijun_rows(rows: list[dict[str, object]]) -> None:
+    normalized = validate_kijun_rows(rows)
     with KIJUN_CSV_PATH.open("w", newline="", encoding="utf-8-sig") as f:
         writer = csv.DictWriter(f, fieldnames=KIJUN_FIELDS)
         writer.writeheader()
         writer.writerows(normalized)
 
 
-def save_result_csv(result: dict[str, object]) -> None:
-    fields = [
-        "address1",
-        "lat1",
-        "lon1",
-        "ku",
-        "hanzai_number",
-        "mini.score_hanzai",
-        "jiko_number",
-        "mini.score_jiko",
-        "population_number",
-        "mini.score_population",
-        "population_score",
-        "kindergarden_number",
-        "mini.score_kindergarden",
-        "kindergarden_score",
-        "park_name",
-        "park_address",
-        "park_distance_m",
-        "mini.score_park",
-        "park_score",
-        "supermarket_name",
-        "supermarket_address",
-        "supermarket_distance_m",
-        "mini.score_supermarket",
-        "supermarket_score",
-        "library_name",
-        "library_address",
-        "library_distance_m",
-        "mini.score_library",
-        "library_score",
-        "cityoffices_name",
-        "cityoffices_address",
-        "cityoffices_distance_m",
-        "mini.score_cityoffices",
-        "cityoffices_score",
-        "mini.number",
-        "mini.score",
-        "score",
-        "anzen_score_sum",
-        "station_name",
-        "station_address",
-        "station_distance_m",
-        "mini.score_station",
-        "lat2",
-        "lon2",
-        "kokyou_name",
-        "kokyou_address",
-        "kokyou_kyori_m",
-        "error",
-    ]
+RESULT_CSV_FIELDS = [
+    "address1",
+    "lat1",
+    "lon1",
+    "ku",
+    "hanzai_number",
+    "mini.score_hanzai",
+    "jiko_number",
+    "mini.score_jiko",
+    "population_number",
+    "mini.score_population",
+    "population_score",
+    "kindergarden_number",
+    "mini.score_kindergarden",
+    "kindergarden_score",
+    "park_name",
+    "park_address",
+    "park_distance_m",
+    "mini.score_park",
+    "park_score",
+    "supermarket_name",
+    "supermarket_address",
+    "supermarket_distance_m",
+    "mini.score_supermarket",
+    "supermarket_score",
+    "library_name",
+    "library_address",
+    "library_distance_m",
+    "mini.score_library",
+    "library_score",
+    "cityoffices_name",
+    "cityoffices_address",
+    "cityoffices_distance_m",
+    "mini.score_cityoffices",
+    "cityoffices_score",
+    "supermarket_count_number",
+    "mini.score_supermarket_count",
+    "supermarket_count_score",
+    "park_count_number",
+    "mini.score_park_count",
+    "park_count_score",
+    "station_count_number",
+    "mini.score_station_count",
+    "station_count_score",
+    "mini.number",
+    "mini.score",
+    "score",
+    "anzen_score_sum",
+    "station_name",
+    "station_address",
+    "station_distance_m",
+    "mini.score_station",
+    "station_score",
+    "lat2",
+    "lon2",
+    "kokyou_name",
+    "kokyou_address",
+    "kokyou_kyori_m",
+    "error",
+]
+
+
+def save_result_csv(result: ScoreResult) -> None:
     with RESULT_CSV_PATH.open("w", newline="", encoding="utf-8-sig") as f:
-        writer = csv.DictWriter(f, fieldnames=fields)
-        writer.writeheader()
-        writer.writerow({k: result.get(k, "") for k in fields})
+        writer = csv.writer(f)
+        writer.writerow(RESULT_CSV_FIELDS)
+        writer.writerow(result.csv_row(RESULT_CSV_FIELDS))
 
 
-def render_result_page(address: str, result: dict[str, object]) -> str:
-    safe = {k: html.escape(str(v)) for k, v in result.items()}
+def render_result_page(address: str, result: ScoreResult) -> str:
+    safe = result.escaped()
     safe_address = html.escape(address)
     error = safe.get("error", "")
     distance_text = (
@@ -340,237 +409,748 @@ def render_result_page(address: str, result: dict[str, object]) -> str:
 </html>"""
 
 
-def build_result_for_address(address: str) -> dict[str, object]:
-    # Return a copy so callers can safely mutate/write without polluting cache.
-    return dict(_build_result_for_address_cached(address.strip()))
-
-
-@lru_cache(maxsize=256)
-def _build_result_for_address_cached(address: str) -> dict[str, object]:
-    result: dict[str, object] = {
-        "address1": address,
-        "lat1": "",
-        "lon1": "",
-        "ku": "",
-        "hanzai_number": "",
-        "mini.score_hanzai": "",
-        "jiko_number": "",
-        "mini.score_jiko": "",
-        "population_number": "",
-        "mini.score_population": "",
-        "population_score": "",
-        "kindergarden_number": "",
-        "mini.score_kindergarden": "",
-        "kindergarden_score": "",
-        "park_name": "",
-        "park_address": "",
-        "park_distance_m": "",
-        "mini.score_park": "",
-        "park_score": "",
-        "supermarket_name": "",
-        "supermarket_address": "",
-        "supermarket_distance_m": "",
-        "mini.score_supermarket": "",
-        "supermarket_score": "",
-        "library_name": "",
-        "library_address": "",
-        "library_distance_m": "",
-        "mini.score_library": "",
-        "library_score": "",
-        "cityoffices_name": "",
-        "cityoffices_address": "",
-        "cityoffices_distance_m": "",
-        "mini.score_cityoffices": "",
-        "cityoffices_score": "",
-        "mini.number": "",
-        "mini.score": "",
-        "score": "",
-        "station_score": "",
-        "anzen_score_sum": "",
-        "station_name": "",
-        "station_address": "",
-        "station_distance_m": "",
-        "mini.score_station": "",
-        "lat2": "",
-        "lon2": "",
-        "kokyou_name": "",
-        "kokyou_address": "",
-        "kokyou_kyori_m": "",
-        "error": "",
+# リクエスト全体の締め切り（秒）。geocode・逆 geocode・各基準のタスクは残り時間の中で動かし、
+# 間に合わなかった基準は status: timeout にして partial な結果を返す。0 で無制限
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "10") or 0)
+CRITERION_TIMEOUT = "timeout"
+_DEADLINE_AT: "contextvars.ContextVar[float | None]" = contextvars.ContextVar("request_deadline_at", default=None)
+
+
+@contextmanager
+def request_deadline(seconds: float = REQUEST_DEADLINE):
+    """
+    with の中の deadline_at()（time.monotonic() の時刻）を決める。入れ子なら外側の締め切りのまま
+    """
+    if seconds <= 0 or _DEADLINE_AT.get() is not None:
+        yield _DEADLINE_AT.get()
+        return
+    token = _DEADLINE_AT.set(time.monotonic() + seconds)
+    try:
+        yield _DEADLINE_AT.get()
+    finally:
+        _DEADLINE_AT.reset(token)
+
+
+def deadline_at() -> float | None:
+    return _DEADLINE_AT.get()
+
+
+RESULT_CACHE_SIZE = 256
+_RESULT_CACHE: "OrderedDict[str, ScoreResult]" = OrderedDict()
+_RESULT_CACHE_LOCK = threading.Lock()
+# MEMORY_BUDGETS の "result_cache" を超えたら古い結果から捨てる（件数の上限 RESULT_CACHE_SIZE とは別）
+MEMORY.register("result_cache", lambda: _RESULT_CACHE, trim=lru_trimmer(_RESULT_CACHE, _RESULT_CACHE_LOCK))
+# 正規化でまとまった件数（/healthz で見る）: キャッシュ / 処理中のキーに、それまでと違う書き方の入力が来た回数
+CANONICALIZED_COUNT = 0
+# 正規化後のキー -> そのキーで来た入力の書き方（新しい方から RESULT_CACHE_SIZE * 2 キー、1キー RAW_INPUTS_PER_KEY 通りまで）
+_RAW_INPUTS: "OrderedDict[str, set[str]]" = OrderedDict()
+RAW_INPUTS_PER_KEY = 16
+# 採点した住所の raw 計測値（kijun 変更時はここから作り直す）
+MEASUREMENTS = MeasurementStore()
+# 同じ住所 / 同じ住所の geocode / 同じ座標の採点が同時に来たら1回だけ計算して共有する
+ADDRESS_FLIGHT = SingleFlight("address")
+GEOCODE_FLIGHT = SingleFlight("geocode")
+COORDINATE_FLIGHT = SingleFlight("coordinates")
+# 区をどこから決めたか（結果の ku_source）: "input" / "geocoder" は住所の文字列から、"coordinates" は逆 geocode
+KU_SOURCE_COORDINATES = "coordinates"
+# Google の geocode / 逆 geocode は締め切り・ヘッジ・ブレーカー付きで呼ぶ（結果に *_status として outcome を付ける）
+GEOCODE_DEADLINE = float(os.getenv("GEOCODE_DEADLINE", "5") or 5)
+GEOCODE_HEDGE = os.getenv("GEOCODE_HEDGE", "").strip().lower() in ("1", "true", "yes")
+GEOCODE_GUARD = GuardedCall(
+    "geocode",
+    lambda address, timeout: geocode_address(address, timeout=timeout, extra_keys=("formatted_address",)),
+    lambda address, error: {"address1": address, "lat1": "", "lon1": "", "error": error},
+    deadline=GEOCODE_DEADLINE,
+    hedge=GEOCODE_HEDGE,
+)
+KU_GUARD = GuardedCall(
+    "reverse_geocode",
+    lambda lat1, lon1, timeout: detect_kyoto_ku_from_values(lat1, lon1, timeout=timeout),
+    lambda lat1, lon1, error: {"lat1": lat1, "lon1": lon1, "ku": "", "error": error},
+    deadline=GEOCODE_DEADLINE,
+    hedge=GEOCODE_HEDGE,
+)
+
+
+def _canonical_key(address: str) -> str:
+    global CANONICALIZED_COUNT
+    # 表記ゆれ（全角 / 漢数字 / 番地の書き方 / 通り名の向き など）をそろえてからキャッシュと geocoder に使う
+    key = canonicalize_address(address)
+    raw = address.strip()
+    in_flight = ADDRESS_FLIGHT.running(key)
+    with _RESULT_CACHE_LOCK:
+        seen = _RAW_INPUTS.setdefault(key, set())
+        _RAW_INPUTS.move_to_end(key)
+        if raw not in seen:
+            # "京都府" を補っただけ などはまとまったとは数えない。別の書き方で同じ結果を使えたときだけ
+            if seen and (key in _RESULT_CACHE or in_flight):
+                CANONICALIZED_COUNT += 1
+            if len(seen) < RAW_INPUTS_PER_KEY:
+                seen.add(raw)
+        while len(_RAW_INPUTS) > RESULT_CACHE_SIZE * 2:
+            _RAW_INPUTS.popitem(last=False)
+    return key
+
+
+def _cached_result(key: str) -> ScoreResult | None:
+    with _RESULT_CACHE_LOCK:
+        cached = _RESULT_CACHE.get(key)
+        if cached is not None and cached.dataset_version != DATASETS.version:
+            # dataset が入れ替わる前の結果は使わない
+            del _RESULT_CACHE[key]
+            cached = None
+        if cached is None:
+            return None
+        _RESULT_CACHE.move_to_end(key)
+        # キャッシュの結果は変更しないので、コピーせずにそのまま返す（JSON も1回だけ作る）
+        return cached
+
+
+def has_cached_result(address: str) -> bool:
+    """
+    採点せずに返せる（今の dataset の結果がキャッシュにある）か。受け付ける枠を決めるのに使う
+    """
+    return bool(address) and _cached_result(canonicalize_address(address)) is not None
+
+
+def _remember_result(key: str, result: ScoreResult) -> ScoreResult:
+    fresh = result.geocode_status in FRESH_OUTCOMES and (result.ku_status or "") in FRESH_OUTCOMES | {""}
+    if not fresh or result.partial:
+        # geocoder の一時的な失敗や古い結果、締め切りで欠けた結果は、次に来たときに計算し直す
+        return result
+    with _RESULT_CACHE_LOCK:
+        _RESULT_CACHE[key] = result
+        _RESULT_CACHE.move_to_end(key)
+        while len(_RESULT_CACHE) > RESULT_CACHE_SIZE:
+            _RESULT_CACHE.popitem(last=False)
+        return result
+
+
+def build_result_for_address(address: str) -> ScoreResult:
+    key = _canonical_key(address)
+    cached = _cached_result(key)
+    if cached is not None:
+        return cached
+    return _remember_result(key, ADDRESS_FLIGHT.do(key, _build_result_for_address, key))
+
+
+def stream_result_for_address(address: str, emit: Callable[[str, object], None]) -> ScoreResult:
+    """
+    build_result_for_address と同じ結果を作りながら、途中経過を emit(event, data) で順に渡す。
+    geocode -> ward -> criterion（終わった基準から1つずつ）-> result（全体）。キャッシュにあれば result だけ。
+    同じ住所を計算中なら（ストリームでも /submit-json でも）ADDRESS_FLIGHT でその結果を待ち、result だけ流す
+    """
+    key = _canonical_key(address)
+    cached = _cached_result(key)
+    if cached is not None:
+        emit("result", cached)
+        return cached
+
+    def _build() -> ScoreResult:
+        # 途中経過を流すのは最初に来たリクエスト（leader）だけ
+        with DATASETS.pin() as dataset, request_deadline():
+            result = new_result(key)
+            result.dataset_version = dataset.version
+            return _fill_result_for_address(result, key, emit=emit)
+
+    result = _remember_result(key, ADDRESS_FLIGHT.do(key, _build))
+    emit("result", result)
+    return result
+
+
+def rederive_stored_results() -> dict[str, int]:
+    """
+    kijun 変更後に、キャッシュ済み結果と address1_result.csv の mini.score / score を
+    保存済みの計測値から作り直す（geocode・区判定・データセット走査はしない）
+    """
+    table = KijunTable.from_csv(KIJUN_CSV_PATH)
+    # kijun.csv も dataset の版に入っているので、区の表を作り直してから今の版を付け直す
+    DATASETS.refresh()
+    version = DATASETS.version
+    with _RESULT_CACHE_LOCK:
+        # キャッシュの結果は変更しない約束なので、平たい形で作り直してから入れ替える
+        flat = {key: cached.to_dict() for key, cached in _RESULT_CACHE.items()}
+        cached_count = rederive_results(list(flat.values()), table)
+        for key, data in flat.items():
+            data["dataset_version"] = version
+            _RESULT_CACHE[key] = ScoreResult.from_dict(data)
+
+    saved_count = 0
+    if RESULT_CSV_PATH.exists():
+        with RESULT_CSV_PATH.open("r", newline="", encoding="utf-8-sig") as f:
+            saved_rows: list[dict[str, object]] = list(csv.DictReader(f))
+        saved_count = rederive_results(saved_rows, table)
+        if saved_count:
+            with RESULT_CSV_PATH.open("w", newline="", encoding="utf-8-sig") as f:
+                writer = csv.DictWriter(f, fieldnames=RESULT_CSV_FIELDS, extrasaction="ignore")
+                writer.writeheader()
+                writer.writerows(saved_rows)
+
+    return {
+        "cached": cached_count,
+        "saved": saved_count,
+        "history": len(MEASUREMENTS.load_columns()["address1"]),
+    }
+
+
+RANK_DEFAULT_K = 10
+RANK_MAX_K = 1000
+
+
+def _parse_rank_weights(raw: object) -> np.ndarray:
+    """
+    重みは8個の数値（SCORE_KEYS の順）か {"anzen": 5, ...}（省略した基準は0）
+    """
+    if isinstance(raw, dict):
+        unknown = [name for name in raw if name not in SCORE_KEYS]
+        if unknown:
+            raise ValueError(f"unknown criterion: {unknown} / {list(SCORE_KEYS)}")
+        values = [float(raw.get(name, 0) or 0) for name in SCORE_KEYS]
+    elif isinstance(raw, list):
+        if len(raw) != len(SCORE_KEYS):
+            raise ValueError(f"weights must have {len(SCORE_KEYS)} values: {list(SCORE_KEYS)}")
+        values = [float(v) for v in raw]
+    else:
+        raise ValueError("weights must be a list or an object")
+    weights = np.array(values, dtype=np.float64)
+    if np.any(weights < 0) or weights.sum() <= 0:
+        raise ValueError("weights must be >= 0 and sum(weights) must be greater than 0")
+    return weights
+
+
+def _ward_mean_matrix(matrix: np.ndarray, ku: list[str], wards: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    区ごとの各基準の平均（未計測は除く）と、区ごとの件数
+    """
+    index = {ward: i for i, ward in enumerate(wards)}
+    codes = np.array([index.get(k, -1) for k in ku], dtype=np.int64)
+    in_ward = codes >= 0
+    counts = np.bincount(codes[in_ward], minlength=len(wards))
+    means = np.full((len(wards), matrix.shape[1]), np.nan)
+    for col in range(matrix.shape[1]):
+        measured = in_ward & ~np.isnan(matrix[:, col])
+        sums = np.bincount(codes[measured], weights=matrix[measured, col], minlength=len(wards))
+        n = np.bincount(codes[measured], minlength=len(wards))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means[:, col] = sums / n
+    return means, counts
+
+
+def rank_locations(payload: dict[str, object]) -> dict[str, object]:
+    """
+    保存済み計測値の正規化 score（今の kijun で作った N×8 行列）から、重み付きで上位 K 件を返す
+    - candidates: "history"（全件） / {"wards": [...]}（区の平均で区を並べる） / {"ids": [住所...]}
+    - 重みが0でない基準に空欄がある候補は除く（app.html と同じく全部揃ったものだけ加重平均する）
+    """
+    weights = _parse_rank_weights(payload.get("weights"))
+    k = int(payload.get("k", RANK_DEFAULT_K) or RANK_DEFAULT_K)
+    if not 1 <= k <= RANK_MAX_K:
+        raise ValueError(f"k must be between 1 and {RANK_MAX_K}")
+
+    columns, matrix = MEASUREMENTS.columns_and_matrix(get_kijun_table(KIJUN_CSV_PATH), list(SCORE_KEYS.values()))
+
+    candidates = payload.get("candidates", "history")
+    if candidates == "history":
+        source = "history"
+        rows = np.arange(matrix.shape[0])
+    elif isinstance(candidates, dict) and isinstance(candidates.get("ids"), list):
+        source = "ids"
+        position = {address: i for i, address in enumerate(columns["address1"])}
+        rows = np.array([position[a] for a in map(str, candidates["ids"]) if a in position], dtype=np.int64)
+    elif isinstance(candidates, dict) and isinstance(candidates.get("wards"), list):
+        source = "wards"
+        wards = sorted({str(w).strip() for w in candidates["wards"] if str(w).strip()})
+        rows = np.arange(len(wards))
+        matrix, counts = _ward_mean_matrix(matrix, columns["ku"], wards)
+    else:
+        raise ValueError('candidates must be "history", {"wards": [...]} or {"ids": [...]}')
+
+    subset = matrix[rows]
+    complete = ~np.isnan(subset[:, weights > 0]).any(axis=1)
+    rows, subset = rows[complete], np.nan_to_num(subset[complete])
+
+    response: dict[str, object] = {
+        "source": source,
+        "weights": dict(zip(SCORE_KEYS, weights.tolist())),
+        "candidates": int(complete.size),
+        "ranked": int(rows.size),
+        "items": [],
     }
+    if rows.size == 0:
+        return response
+
+    weighted = weighted_score_matrix(subset, weights[None, :])
+    top_idx, top_values = top_k_per_profile(weighted, k)
+    items: list[dict[str, object]] = []
+    for i, value in zip(top_idx[0].tolist(), top_values[0].tolist()):
+        row = int(rows[i])
+        item: dict[str, object] = {"weighted_result": round(value * 100, 4)}
+        if source == "wards":
+            item.update({"ku": wards[row], "count": int(counts[row])})
+        else:
+            item.update(
+                {
+                    "address1": columns["address1"][row],
+                    "ku": columns["ku"][row],
+                    "lat1": float(columns["lat1"][row]),
+                    "lon1": float(columns["lon1"][row]),
+                }
+            )
+        item["scores"] = {
+            name: ("" if np.isnan(v) else round(float(v), 4)) for name, v in zip(SCORE_KEYS, matrix[row].tolist())
+        }
+        items.append(item)
+    response["items"] = items
+    return response
+
+
+def new_result(address: str) -> ScoreResult:
+    # 値はすべて None（JSON / CSV に出すときに "" になる）。列名と並びは score_result.RESULT_FIELDS
+    return ScoreResult(address)
+
+
+# 区だけで決まる基準（結果は区の表にまとめて持つ）
+WARD_TASKS = {
+    "hanzai": ("hanzai_mod", HANZAI_PATH, "get_hanzai_mini_score_by_ku"),
+    "jiko": ("jiko_mod", JIKO_PATH, "get_jiko_mini_score_by_ku"),
+    "population": ("population_mod", POPULATION_PATH, "get_population_mini_score_by_ku"),
+    "kindergarden": ("kindergarden_mod", KINDERGARDEN_PATH, "get_kindergarden_mini_score_by_ku"),
+}
+WARD_INPUT_PATHS = [BASE_DIR / "dataset" / f"{key}.csv" for key in WARD_TASKS] + [KIJUN_CSV_PATH]
+def build_ward_table() -> dict[str, dict[str, dict[str, object]]]:
+    """
+    京都市11区 × 区ごとの基準（犯罪・事故・人口・幼稚園）の mini.score 結果。失敗したものは入れない（その場で計算する）
+    """
+    table: dict[str, dict[str, dict[str, object]]] = {}
+    for ku in KYOTO_WARDS:
+        row: dict[str, dict[str, object]] = {}
+        for key, (module_name, path, function_name) in WARD_TASKS.items():
+            try:
+                row[key] = getattr(load_module_from_path(module_name, path), function_name)(ku)
+            except Exception:
+                continue
+        table[ku] = row
+    return table
+
+
+# 区の表は dataset_store の部品 "ward_table"（元の CSV / kijun.csv が変わったら作り直して差し替える）
+DATASETS.register("ward_table", WARD_INPUT_PATHS, build_ward_table)
+# 部品にしていない dataset（採点モジュールがリクエストごとに読む CSV）も、変わったら版を上げる
+DATASETS.track(sorted((BASE_DIR / "dataset").glob("*.csv")) + [KIJUN_CSV_PATH])
+
+
+def get_ward_table() -> dict[str, dict[str, dict[str, object]]]:
+    return DATASETS.get("ward_table")  # type: ignore[return-value]
+
+
+def _install_ward_table(table: dict[str, dict[str, dict[str, object]]]) -> None:
+    DATASETS.install("ward_table", table)
+
+
+def _criteria_tasks(lat1: float, lon1: float, ku: str) -> dict[str, tuple[object, tuple]]:
+    station_mod = load_module_from_path("station_mod", STATION_PATH)
+    park_mod = load_module_from_path("park_mod", PARK_PATH)
+    supermarket_mod = load_module_from_path("supermarket_mod", SUPERMARKET_PATH)
+    library_mod = load_module_from_path("library_mod", LIBRARY_PATH)
+    cityoffices_mod = load_module_from_path("cityoffices_mod", CITYOFFICES_PATH)
+    kokyou_mod = load_module_from_path("dataset_kokyou_saitan", KOKYOU_SAITAN_PATH)
+    nearby_mod = load_module_from_path("nearby_mod", NEARBY_PATH)
+    tasks: dict[str, tuple[object, tuple]] = {
+        "station": (station_mod.get_station_mini_score_by_latlon, (lat1, lon1)),
+        "park": (park_mod.get_park_mini_score_by_latlon, (lat1, lon1)),
+        "supermarket": (supermarket_mod.get_supermarket_mini_score_by_latlon, (lat1, lon1)),
+        "library": (library_mod.get_library_mini_score_by_latlon, (lat1, lon1)),
+        "cityoffices": (cityoffices_mod.get_cityoffices_mini_score_by_latlon, (lat1, lon1)),
+        "kokyou": (kokyou_mod.find_nearest_kokyou, (lat1, lon1)),
+    }
+    for count_name in nearby_mod.COUNT_CRITERIA:
+        tasks[count_name] = (nearby_mod.get_count_mini_score_by_latlon, (count_name, lat1, lon1))
+    if ku:
+        ward_row = get_ward_table().get(ku, {})
+        for key, (module_name, path, function_name) in WARD_TASKS.items():
+            if key in ward_row:
+                # 区ごとの結果は区の表から（コピーを返す）
+                tasks[key] = (dict, (ward_row[key],))
+            else:
+                tasks[key] = (getattr(load_module_from_path(module_name, path), function_name), (ku,))
+    return tasks
+
+
+def run_criteria_tasks(
+    lat1: float,
+    lon1: float,
+    ku: str,
+    max_workers: int = 10,
+    on_result: Callable[[str, dict[str, object]], None] | None = None,
+) -> dict[str, dict[str, object]]:
+    """
+    各基準のタスクを実行して key -> 結果dict を返す（max_workers<=1 なら同じスレッドで順に実行）
+    on_result(key, 結果dict) は終わった順に呼び出し元のスレッドで呼ぶ
+    """
+    tasks = _criteria_tasks(lat1, lon1, ku)
+    task_results: dict[str, dict[str, object]] = {}
+    until = deadline_at()
+    if max_workers <= 1:
+        for key, (fn, args) in tasks.items():
+            if until is not None and time.monotonic() >= until:
+                task_results[key] = {"status": CRITERION_TIMEOUT}
+                continue
+            try:
+                task_results[key] = fn(*args)
+            except Exception as e:
+                task_results[key] = {"error": str(e)}
+            if on_result is not None:
+                on_result(key, task_results[key])
+        return task_results
+
+    # initializer は profile 中のリクエストだけワーカーを sampler に登録する（普段は None）
+    ex = ThreadPoolExecutor(max_workers=max_workers, initializer=worker_initializer())
+    timed_out = False
     try:
-        geo = geocode_address(address)
-        result.update(geo)
-        if result.get("error") or result.get("lat1") == "" or result.get("lon1") == "":
-            return result
-        lat1 = float(result["lat1"])
-        lon1 = float(result["lon1"])
-        seikika_mod = load_module_from_path("seikika_mod", SEIKIKA_PATH)
-        ku_result = detect_kyoto_ku_from_values(lat1, lon1)
-        result["ku"] = ku_result.get("ku", "")
-        if ku_result.get("error") and not result.get("error"):
-            result["error"] = ku_result["error"]
-        task_results: dict[str, dict[str, object]] = {}
-        futures = {}
-        with ThreadPoolExecutor(max_workers=10) as ex:
-            station_mod = load_module_from_path("station_mod", STATION_PATH)
-            park_mod = load_module_from_path("park_mod", PARK_PATH)
-            supermarket_mod = load_module_from_path("supermarket_mod", SUPERMARKET_PATH)
-            library_mod = load_module_from_path("library_mod", LIBRARY_PATH)
-            cityoffices_mod = load_module_from_path("cityoffices_mod", CITYOFFICES_PATH)
-            kokyou_mod = load_module_from_path("dataset_kokyou_saitan", KOKYOU_SAITAN_PATH)
-            futures[ex.submit(station_mod.get_station_mini_score_by_latlon, lat1, lon1)] = "station"
-            futures[ex.submit(park_mod.get_park_mini_score_by_latlon, lat1, lon1)] = "park"
-            futures[ex.submit(supermarket_mod.get_supermarket_mini_score_by_latlon, lat1, lon1)] = "supermarket"
-            futures[ex.submit(library_mod.get_library_mini_score_by_latlon, lat1, lon1)] = "library"
-            futures[ex.submit(cityoffices_mod.get_cityoffices_mini_score_by_latlon, lat1, lon1)] = "cityoffices"
-            futures[ex.submit(kokyou_mod.find_nearest_kokyou, lat1, lon1)] = "kokyou"
-            if result.get("ku"):
-                ku = str(result["ku"])
-                hanzai_mod = load_module_from_path("hanzai_mod", HANZAI_PATH)
-                jiko_mod = load_module_from_path("jiko_mod", JIKO_PATH)
-                population_mod = load_module_from_path("population_mod", POPULATION_PATH)
-                kindergarden_mod = load_module_from_path("kindergarden_mod", KINDERGARDEN_PATH)
-                futures[ex.submit(hanzai_mod.get_hanzai_mini_score_by_ku, ku)] = "hanzai"
-                futures[ex.submit(jiko_mod.get_jiko_mini_score_by_ku, ku)] = "jiko"
-                futures[ex.submit(population_mod.get_population_mini_score_by_ku, ku)] = "population"
-                futures[ex.submit(kindergarden_mod.get_kindergarden_mini_score_by_ku, ku)] = "kindergarden"
-            for future in as_completed(futures):
+        # DATASETS.pin() した版をワーカースレッドにも渡す
+        futures = {ex.submit(contextvars.copy_context().run, fn, *args): key for key, (fn, args) in tasks.items()}
+        try:
+            for future in as_completed(futures, timeout=None if until is None else max(until - time.monotonic(), 0)):
                 key = futures[future]
                 try:
                     task_results[key] = future.result()
                 except Exception as e:
                     task_results[key] = {"error": str(e)}
-        if result.get("ku"):
-            hanzai_result = task_results.get("hanzai", {})
-            result["hanzai_number"] = hanzai_result.get("number", "")
-            result["mini.score_hanzai"] = hanzai_result.get("mini.score_hanzai", "")
-            if hanzai_result.get("error") and not result.get("error"):
-                result["error"] = hanzai_result["error"]
-            jiko_result = task_results.get("jiko", {})
-            result["jiko_number"] = jiko_result.get("number", "")
-            result["mini.score_jiko"] = jiko_result.get("mini.score_jiko", "")
-            if jiko_result.get("error") and not result.get("error"):
-                result["error"] = jiko_result["error"]
-            population_result = task_results.get("population", {})
-            result["population_number"] = population_result.get("number", "")
-            result["mini.score_population"] = population_result.get("mini.score_population", "")
-            if population_result.get("error") and not result.get("error"):
-                result["error"] = population_result["error"]
-            kindergarden_result = task_results.get("kindergarden", {})
-            result["kindergarden_number"] = kindergarden_result.get("number", "")
-            result["mini.score_kindergarden"] = kindergarden_result.get("mini.score_kindergarden", "")
-            if kindergarden_result.get("error") and not result.get("error"):
-                result["error"] = kindergarden_result["error"]
-            try:
-                h_score = int(result.get("mini.score_hanzai", "") or 0)
-                j_score = int(result.get("mini.score_jiko", "") or 0)
-                anzen_sum = h_score + j_score
-                result["mini.number"] = 2
-                result["mini.score"] = anzen_sum
-                result["anzen_score_sum"] = float(anzen_sum)
-            except Exception:
-                anzen_mod = load_module_from_path("anzen_mod", ANZEN_PATH)
-                anzen_result = anzen_mod.get_anzen_score_by_ku(str(result["ku"]))
-                result["mini.number"] = anzen_result.get("mini.number", "")
-                result["mini.score"] = anzen_result.get("mini.score", "")
-                result["anzen_score_sum"] = anzen_result.get("anzen_score_sum", "")
-                if anzen_result.get("error") and not result.get("error"):
-                    result["error"] = anzen_result["error"]
-            seikika_result = seikika_mod.normalize_mini_score_result(
-                {"mini.number": result["mini.number"], "mini.score": result["mini.score"]}
-            )
-            result["score"] = seikika_result.get("score", "")
-            if result.get("mini.score_population") != "":
-                population_norm = seikika_mod.normalize_mini_score_result(
-                    {"mini.number": 1, "mini.score": result["mini.score_population"]}
-                )
-                result["population_score"] = population_norm.get("score", "")
-            if result.get("mini.score_kindergarden") != "":
-                kindergarden_norm = seikika_mod.normalize_mini_score_result(
-                    {"mini.number": 1, "mini.score": result["mini.score_kindergarden"]}
-                )
-                result["kindergarden_score"] = kindergarden_norm.get("score", "")
-        station_result = task_results.get("station", {})
-        result["station_name"] = station_result.get("station_name", "")
-        result["station_address"] = station_result.get("station_address", "")
-        result["station_distance_m"] = station_result.get("station_distance_m", "")
-        result["mini.score_station"] = station_result.get("mini.score_station", "")
-        if station_result.get("error") and not result.get("error"):
-            result["error"] = station_result["error"]
-        if result.get("mini.score_station") != "":
-            station_norm = seikika_mod.normalize_mini_score_result(
-                {"mini.number": 1, "mini.score": result["mini.score_station"]}
-            )
-            result["station_score"] = station_norm.get("score", "")
-        park_result = task_results.get("park", {})
-        result["park_name"] = park_result.get("park_name", "")
-        result["park_address"] = park_result.get("park_address", "")
-        result["park_distance_m"] = park_result.get("park_distance_m", "")
-        result["mini.score_park"] = park_result.get("mini.score_park", "")
-        if park_result.get("error") and not result.get("error"):
-            result["error"] = park_result["error"]
-        if result.get("mini.score_park") != "":
-            park_norm = seikika_mod.normalize_mini_score_result(
-                {"mini.number": 1, "mini.score": result["mini.score_park"]}
-            )
-            result["park_score"] = park_norm.get("score", "")
-        supermarket_result = task_results.get("supermarket", {})
-        result["supermarket_name"] = supermarket_result.get("supermarket_name", "")
-        result["supermarket_address"] = supermarket_result.get("supermarket_address", "")
-        result["supermarket_distance_m"] = supermarket_result.get("supermarket_distance_m", "")
-        result["mini.score_supermarket"] = supermarket_result.get("mini.score_supermarket", "")
-        if supermarket_result.get("error") and not result.get("error"):
-            result["error"] = supermarket_result["error"]
-        if result.get("mini.score_supermarket") != "":
-            supermarket_norm = seikika_mod.normalize_mini_score_result(
-                {"mini.number": 1, "mini.score": result["mini.score_supermarket"]}
-            )
-            result["supermarket_score"] = supermarket_norm.get("score", "")
-        library_result = task_results.get("library", {})
-        result["library_name"] = library_result.get("library_name", "")
-        result["library_address"] = library_result.get("library_address", "")
-        result["library_distance_m"] = library_result.get("library_distance_m", "")
-        result["mini.score_library"] = library_result.get("mini.score_library", "")
-        if library_result.get("error") and not result.get("error"):
-            result["error"] = library_result["error"]
-        if result.get("mini.score_library") != "":
-            library_norm = seikika_mod.normalize_mini_score_result(
-                {"mini.number": 1, "mini.score": result["mini.score_library"]}
-            )
-            result["library_score"] = library_norm.get("score", "")
-        cityoffices_result = task_results.get("cityoffices", {})
-        result["cityoffices_name"] = cityoffices_result.get("cityoffices_name", "")
-        result["cityoffices_address"] = cityoffices_result.get("cityoffices_address", "")
-        result["cityoffices_distance_m"] = cityoffices_result.get("cityoffices_distance_m", "")
-        result["mini.score_cityoffices"] = cityoffices_result.get("mini.score_cityoffices", "")
-        if cityoffices_result.get("error") and not result.get("error"):
-            result["error"] = cityoffices_result["error"]
-        if result.get("mini.score_cityoffices") != "":
-            cityoffices_norm = seikika_mod.normalize_mini_score_result(
-                {"mini.number": 1, "mini.score": result["mini.score_cityoffices"]}
-            )
-            result["cityoffices_score"] = cityoffices_norm.get("score", "")
-        nearest = task_results.get("kokyou", {})
-        result["lat2"] = nearest.get("lat2", "")
-        result["lon2"] = nearest.get("lon2", "")
-        result["kokyou_name"] = nearest.get("name1") or nearest.get("name2", "")
-        result["kokyou_address"] = nearest.get("address", "")
-        if nearest.get("error") and not result.get("error"):
-            result["error"] = nearest["error"]
-        if result["lat2"] != "" and result["lon2"] != "":
-            result["kokyou_kyori_m"] = distance_between_points(
+                if on_result is not None:
+                    on_result(key, task_results[key])
+        except FutureTimeoutError:
+            timed_out = True
+            for future, key in futures.items():
+                if key not in task_results:
+                    future.cancel()
+                    task_results[key] = {"status": CRITERION_TIMEOUT}
+    finally:
+        # 締め切りを過ぎたタスクは待たずに置いていく（終わっても結果は使わない）
+        ex.shutdown(wait=not timed_out, cancel_futures=True)
+    return task_results
+
+
+# 正規化する mini.score（axis=1）。anzen だけは mini.number（=2）を axis にする
+NORMALIZED_CRITERIA = ["population", "kindergarden", "station", "park", "supermarket", "library", "cityoffices"]
+
+
+def normalize_criteria_scores(criteria: dict[str, CriterionRecord], extra_criteria: list[str] | None = None) -> None:
+    """
+    各基準の mini_score を全基準まとめて seikika.normalize_array で一度に正規化し、score に入れる
+    （mini_score が無い基準はそのまま）
+    """
+    seikika_mod = load_module_from_path("seikika_mod", SEIKIKA_PATH)
+    anzen = criteria.get("anzen")
+    targets = [(anzen, anzen.number if anzen else None)] + [
+        (criteria.get(name), 1) for name in NORMALIZED_CRITERIA + (extra_criteria or [])
+    ]
+    present = [
+        (record, axis) for record, axis in targets if record is not None and record.mini_score is not None and axis is not None
+    ]
+    if not present:
+        return
+    normalized = seikika_mod.normalize_array(
+        [float(record.mini_score) for record, _axis in present],
+        [int(float(axis)) for _record, axis in present],
+    )
+    for (record, _axis), value in zip(present, normalized.tolist()):
+        record.score = value
+
+
+# 区ごとの基準 / 最寄り施設の基準（結果の列名の組み立て方が同じもの）
+WARD_CRITERIA = ["hanzai", "jiko", "population", "kindergarden"]
+NEAREST_CRITERIA = ["station", "park", "supermarket", "library", "cityoffices"]
+
+
+def criterion_record(key: str, task_result: dict[str, object], lat1: float, lon1: float) -> CriterionRecord:
+    """
+    1つの基準のタスク結果（採点モジュールの dict）を CriterionRecord にする
+    """
+    status = CRITERION_TIMEOUT if task_result.get("status") == CRITERION_TIMEOUT else None
+    error = str(task_result.get("error") or "")
+    if key in NEAREST_CRITERIA:
+        return CriterionRecord(
+            mini_score=task_result.get(f"mini.score_{key}"),
+            name=task_result.get(f"{key}_name"),
+            address=task_result.get(f"{key}_address"),
+            distance_m=task_result.get(f"{key}_distance_m"),
+            status=status,
+            error=error,
+        )
+    if key == "kokyou":
+        record = CriterionRecord(
+            name=task_result.get("name1") or task_result.get("name2"),
+            address=task_result.get("address"),
+            lat=task_result.get("lat2"),
+            lon=task_result.get("lon2"),
+            status=status,
+            error=error,
+        )
+        if record.lat is not None and record.lon is not None:
+            record.distance_m = distance_between_points(
                 lat1,
                 lon1,
-                float(result["lat2"]),
-                float(result["lon2"]),
+                float(record.lat),
+                float(record.lon),
                 unit="m",
                 digits=1,
             )
+        return record
+    # 区ごとの基準と件数の基準（nearby.COUNT_CRITERIA）
+    return CriterionRecord(
+        number=task_result.get("number"),
+        mini_score=task_result.get(f"mini.score_{key}"),
+        status=status,
+        error=error,
+    )
+
+
+def _fill_anzen(result: ScoreResult) -> None:
+    try:
+        h_score = int(result.value("mini.score_hanzai") or 0)
+        j_score = int(result.value("mini.score_jiko") or 0)
+        anzen_sum = h_score + j_score
+        result.criteria["anzen"] = CriterionRecord(number=2, mini_score=anzen_sum)
+        result.anzen_score_sum = float(anzen_sum)
+    except Exception:
+        anzen_mod = load_module_from_path("anzen_mod", ANZEN_PATH)
+        anzen_result = anzen_mod.get_anzen_score_by_ku(str(result.ku))
+        result.criteria["anzen"] = CriterionRecord(
+            number=anzen_result.get("mini.number"), mini_score=anzen_result.get("mini.score")
+        )
+        result.anzen_score_sum = missing_to_none(anzen_result.get("anzen_score_sum"))
+        if anzen_result.get("error") and not result.error:
+            result.error = str(anzen_result["error"])
+
+
+def fill_criteria_scores(
+    result: ScoreResult,
+    lat1: float,
+    lon1: float,
+    max_workers: int = 10,
+    on_criterion: Callable[[str, dict[str, object]], None] | None = None,
+) -> ScoreResult:
+    """
+    lat1/lon1 と result.ku から全基準の mini.score と正規化 score を result.criteria に入れる。
+    on_criterion(key, task_result) を渡すと、各基準が終わった順に呼ぶ（/submit-stream 用）
+    """
+    nearby_mod = load_module_from_path("nearby_mod", NEARBY_PATH)
+    ku = result.ku or ""
+    task_results = run_criteria_tasks(lat1, lon1, ku, max_workers=max_workers, on_result=on_criterion)
+    timed_out = {key for key, value in task_results.items() if value.get("status") == CRITERION_TIMEOUT}
+    if timed_out:
+        # 間に合わなかった基準は status="timeout" の記録になり、criteria_status として出る
+        result.partial = True
+
+    # エラーは従来どおり この順で最初のものを result.error に入れる
+    order = (WARD_CRITERIA if ku else []) + ["anzen"] + NEAREST_CRITERIA + list(nearby_mod.COUNT_CRITERIA) + ["kokyou"]
+    for key in order:
+        if key == "anzen":
+            # 犯罪・事故のどちらかが間に合わなかったときは anzen を片方だけで出さない
+            if ku and not timed_out & {"hanzai", "jiko"}:
+                _fill_anzen(result)
+            continue
+        if key == "kokyou":
+            normalize_criteria_scores(result.criteria, list(nearby_mod.COUNT_CRITERIA))
+        task_result = task_results.get(key, {})
+        result.criteria[key] = criterion_record(key, task_result, lat1, lon1)
+        if task_result.get("error") and not result.error:
+            result.error = str(task_result["error"])
+    return result
+
+
+def criterion_event(key: str, task_result: dict[str, object], lat1: float, lon1: float) -> dict[str, object]:
+    """
+    /submit-stream の criterion イベント: その基準の列（正規化できる基準なら *_score も）
+    """
+    record = criterion_record(key, task_result, lat1, lon1)
+    error = record.error or ""
+    extra = [] if key in WARD_CRITERIA + NEAREST_CRITERIA + ["kokyou"] else [key]
+    try:
+        normalize_criteria_scores({key: record}, extra)
+    except ValueError as e:
+        error = error or str(e)
+    return {"criterion": key, **dict(criterion_items(key, record)), "error": error}
+
+
+def _score_coordinates(
+    lat1: float,
+    lon1: float,
+    ku: str = "",
+    ku_source: str = "",
+    emit: Callable[[str, object], None] | None = None,
+) -> ScoreResult:
+    """
+    座標 -> 区 -> 全基準（同じ座標の同時実行は COORDINATE_FLIGHT でまとめる）。結果は ScoreResult.merge で入れる
+    ku が分かっている（住所の文字列から取れた）ときは逆 geocode しない。emit を渡すと ward / criterion を流す
+    """
+    scored = ScoreResult()
+    if ku:
+        scored.ku, scored.ku_source = ku, ku_source
+    else:
+        ku_result, scored.ku_status = KU_GUARD.call((lat1, lon1), lat1, lon1, deadline_at=deadline_at())
+        scored.ku = missing_to_none(ku_result.get("ku"))
+        scored.ku_source = KU_SOURCE_COORDINATES
+        if ku_result.get("error"):
+            scored.error = str(ku_result["error"])
+    if emit is None:
+        fill_criteria_scores(scored, lat1, lon1)
+        return scored
+    emit("ward", {key: scored.get(key, "") for key in ("ku", "ku_source", "ku_status", "error")})
+    fill_criteria_scores(scored, lat1, lon1, on_criterion=lambda key, r: emit("criterion", criterion_event(key, r, lat1, lon1)))
+    return scored
+
+
+def _build_result_for_address(address: str) -> ScoreResult:
+    with DATASETS.pin() as dataset, request_deadline():
+        result = new_result(address)
+        result.dataset_version = dataset.version
+        return _fill_result_for_address(result, address)
+
+
+def _fill_result_for_address(
+    result: ScoreResult, address: str, emit: Callable[[str, object], None] | None = None
+) -> ScoreResult:
+    try:
+        geo, result.geocode_status = GEOCODE_FLIGHT.do(
+            address, lambda: GEOCODE_GUARD.call(address, address, deadline_at=deadline_at())
+        )
+        geo = dict(geo)
+        formatted_address = str(geo.pop("formatted_address", "") or "")
+        result.update(geo)
+        if emit is not None:
+            emit("geocode", {key: result.get(key, "") for key in ("address1", "lat1", "lon1", "error", "geocode_status")})
+        if result.error or result.lat1 is None or result.lon1 is None:
+            return result
+        lat1 = float(result.lat1)
+        lon1 = float(result.lon1)
+        # 区は住所の文字列から取れればそれを使い、取れない / 食い違うときだけ座標から逆 geocode する
+        ku, ku_source = resolve_ward_from_text(address, formatted_address)
+        # 同じ座標を計算中ならその結果を待つ（そのときは ward / criterion は流れず、最後の result だけになる）
+        result.merge(COORDINATE_FLIGHT.do((lat1, lon1, ku), _score_coordinates, lat1, lon1, ku, ku_source, emit))
     except Exception as e:
-        result["error"] = str(e)
+        result.error = str(e)
+    return result
+
+
+# 京都市の範囲（南端 伏見区 〜 北端 右京区京北 / 西端 右京区京北 〜 東端 山科区）。外の座標は採点しない
+KYOTO_EXTENT = {"lat_min": 34.86, "lat_max": 35.33, "lon_min": 135.55, "lon_max": 135.89}
+COORDS_BATCH_MAX = 500
+
+
+def parse_coordinates(item: object) -> tuple[float, float]:
+    """
+    {"lat": .., "lon": ..}（lat1/lon1, lng も可）を検査して (lat, lon) を返す。京都市の範囲外は ValueError
+    """
+    if not isinstance(item, dict):
+        raise ValueError("point must be an object with lat/lon")
+    lat_value = next((item[k] for k in ("lat", "lat1") if item.get(k) not in (None, "")), None)
+    lon_value = next((item[k] for k in ("lon", "lon1", "lng") if item.get(k) not in (None, "")), None)
+    if lat_value is None or lon_value is None:
+        raise ValueError("lat and lon are required")
+    lat1, lon1 = float(lat_value), float(lon_value)
+    if not (
+        KYOTO_EXTENT["lat_min"] <= lat1 <= KYOTO_EXTENT["lat_max"]
+        and KYOTO_EXTENT["lon_min"] <= lon1 <= KYOTO_EXTENT["lon_max"]
+    ):
+        raise ValueError(f"point is outside Kyoto city: {lat1}, {lon1}")
+    return lat1, lon1
+
+
+def build_result_for_coordinates(lat1: float, lon1: float) -> ScoreResult:
+    """
+    地図で選んだ座標などから直接採点する（geocode しない）。address1 は "lat,lon"
+    """
+    result = new_result(f"{lat1},{lon1}")
+    result.lat1 = lat1
+    result.lon1 = lon1
+    with DATASETS.pin() as dataset, request_deadline():
+        result.dataset_version = dataset.version
+        try:
+            result.merge(COORDINATE_FLIGHT.do((lat1, lon1, ""), _score_coordinates, lat1, lon1))
+        except Exception as e:
+            result.error = str(e)
     return result
 
+
+def coalesced_counts() -> dict[str, int]:
+    return {flight.name: flight.coalesced for flight in (ADDRESS_FLIGHT, GEOCODE_FLIGHT, COORDINATE_FLIGHT)}
+
+
+# 起動時に読み込んでおく採点モジュール
+SCORER_MODULES = [
+    ("station_mod", STATION_PATH),
+    ("park_mod", PARK_PATH),
+    ("supermarket_mod", SUPERMARKET_PATH),
+    ("library_mod", LIBRARY_PATH),
+    ("cityoffices_mod", CITYOFFICES_PATH),
+    ("dataset_kokyou_saitan", KOKYOU_SAITAN_PATH),
+    ("nearby_mod", NEARBY_PATH),
+    ("anzen_mod", ANZEN_PATH),
+    ("seikika_mod", SEIKIKA_PATH),
+] + [(module_name, path) for module_name, path, _function_name in WARD_TASKS.values()]
+# スナップショットに入れる結果キャッシュの件数（新しい方から）
+SNAPSHOT_HOT_RESULTS = 128
+WARM_STATE: dict[str, object] = {"ready": False, "source": "", "seconds": "", "error": ""}
+
+
+def warm_up(snapshot_path: str | Path | None = SNAPSHOT_PATH) -> dict[str, object]:
+    """
+    採点モジュール・施設索引・kijun 表・区の表を先に用意する。
+    snapshot_path のスナップショットが今のデータと一致すればそこから読み、無ければ作る。
+    """
+    started = time.perf_counter()
+    try:
+        for module_name, path in SCORER_MODULES:
+            load_module_from_path(module_name, path)
+        state = load_snapshot(snapshot_path, dataset_signature()) if snapshot_path else None
+        if state is not None:
+            for category, index in state["facility_indexes"].items():
+                install_index(category, index)
+            install_kijun_table(state["kijun_table"], KIJUN_CSV_PATH)
+            _install_ward_table(state["ward_table"])
+            with _RESULT_CACHE_LOCK:
+                for address, result in state["hot_results"]:
+                    # 以前のスナップショットは結果を dict で持っている
+                    _RESULT_CACHE.setdefault(
+                        address, ScoreResult.from_dict(result) if isinstance(result, dict) else result
+                    )
+            source = "snapshot"
+        else:
+            for category, path in FACILITY_CSV_PATHS.items():
+                if path.exists():
+                    get_facility_index(category)
+            get_kijun_table(KIJUN_CSV_PATH)
+            get_ward_table()
+            source = "build"
+        if any(uses_network_distance(name) for name in KIJUN_CATEGORIES):
+            get_road_graph()
+        MEASUREMENTS.load_columns()
+    except Exception as e:
+        WARM_STATE.update({"ready": False, "error": str(e), "seconds": round(time.perf_counter() - started, 3)})
+        return dict(WARM_STATE)
+    WARM_STATE.update({"ready": True, "source": source, "seconds": round(time.perf_counter() - started, 3), "error": ""})
+    return dict(WARM_STATE)
+
+
+def save_warm_snapshot(path: str | Path = SNAPSHOT_PATH) -> Path:
+    """
+    今の索引・kijun 表・区の表と、新しい方から SNAPSHOT_HOT_RESULTS 件の結果をスナップショットに保存する
+    """
+    signature = dataset_signature()
+    with _RESULT_CACHE_LOCK:
+        hot_results = list(_RESULT_CACHE.items())[-SNAPSHOT_HOT_RESULTS:]
+    state = {
+        "facility_indexes": {
+            category: get_facility_index(category) for category, p in FACILITY_CSV_PATHS.items() if p.exists()
+        },
+        "kijun_table": get_kijun_table(KIJUN_CSV_PATH),
+        "ward_table": get_ward_table(),
+        "hot_results": hot_results,
+    }
+    return save_snapshot(state, path, signature)
+
+
 class Handler(BaseHTTPRequestHandler):
     def _send_bytes(self, data: bytes, content_type: str, status: int = 200) -> None:
         try:
@@ -602,11 +1182,18 @@ class Handler(BaseHTTPRequestHandler):
         except (BrokenPipeError, ConnectionAbortedError, ConnectionResetError):
             pass
 
-    def _send_json(self, payload: dict[str, object], status: int = 200) -> None:
-        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    def _send_json(
+        self, payload: dict[str, object] | ScoreResult, status: int = 200, headers: dict[str, str] | None = None
+    ) -> None:
+        if isinstance(payload, ScoreResult):
+            data = payload.to_json()
+        else:
+            data = json.dumps(payload, ensure_ascii=False, default=result_json_default).encode("utf-8")
         try:
             self.send_response(status)
             self._send_cors_headers()
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
             self.send_header("Content-Type", "application/json; charset=utf-8")
             self.send_header("Content-Length", str(len(data)))
             self.end_headers()
@@ -614,6 +1201,82 @@ class Handler(BaseHTTPRequestHandler):
         except (BrokenPipeError, ConnectionAbortedError, ConnectionResetError):
             pass
 
+    @contextmanager
+    def _admitted(self, lane: AdmissionLane, cost: float = 0) -> Iterator[bool]:
+        """
+        with self._admitted(lane, cost) as admitted: で lane の枠を取ってから処理する。
+        cost は geocode する回数で、クライアントごとの回数制限から引く。
+        取れなければ 429（回数制限）/ 503（混雑）を Retry-After 付きで返して False
+        """
+        client = client_id(self.client_address, self.headers.get("X-Forwarded-For"))
+        wait_seconds = RATE_LIMITER.take(client, cost)
+        if wait_seconds > 0:
+            self._send_json(
+                {"error": "rate limit exceeded"}, status=429, headers={"Retry-After": str(math.ceil(wait_seconds))}
+            )
+            yield False
+            return
+        if not lane.acquire():
+            RATE_LIMITER.refund(client, cost)
+            self._send_json(
+                {"error": f"server busy ({lane.name})"}, status=503, headers={"Retry-After": str(lane.retry_after())}
+            )
+            yield False
+            return
+        started = time.perf_counter()
+        try:
+            yield True
+        finally:
+            lane.release(time.perf_counter() - started)
+
+    @staticmethod
+    def _lane_for_address(address: str) -> tuple[AdmissionLane, float]:
+        # キャッシュにある結果は geocode も採点もしないので軽い枠で返す
+        return (LIGHT_LANE, 0) if has_cached_result(address) else (SCORE_LANE, 1)
+
+    def _handle_submit_stream(self, address: str) -> None:
+        """
+        Server-Sent Events で途中経過を流す（event: geocode / ward / criterion / result）。
+        HTTP/1.0 なので最後のイベントを書いたら接続を閉じて終わり
+        """
+        if not address:
+            self._send_json({"error": "address is required"}, status=400)
+            return
+        with self._admitted(*self._lane_for_address(address)) as admitted:
+            if admitted:
+                self._stream_result(address)
+
+    def _stream_result(self, address: str) -> None:
+        try:
+            self.send_response(200)
+            self._send_cors_headers()
+            self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("X-Accel-Buffering", "no")
+            self.end_headers()
+        except (BrokenPipeError, ConnectionAbortedError, ConnectionResetError):
+            return
+        closed = False
+
+        def emit(event: str, data: dict[str, object] | ScoreResult) -> None:
+            nonlocal closed
+            if closed:
+                return
+            if isinstance(data, ScoreResult):
+                payload = data.to_json().decode("utf-8")
+            else:
+                payload = json.dumps(data, ensure_ascii=False)
+            try:
+                self.wfile.write(f"event: {event}\ndata: {payload}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionAbortedError, ConnectionResetError):
+                # 途中で閉じられても計算は最後までしてキャッシュに入れる
+                closed = True
+
+        result = stream_result_for_address(address, emit)
+        save_result_csv(result)
+        MEASUREMENTS.append(result)
+
     def do_OPTIONS(self) -> None:
         try:
             self.send_response(204)
@@ -624,6 +1287,16 @@ class Handler(BaseHTTPRequestHandler):
             pass
 
     def do_GET(self) -> None:
+        route = urlparse(self.path).path
+        if route in ("/submit-stream", "/healthz"):
+            # /submit-stream は住所を見てから枠を決める。/healthz は混んでいても必ず答える
+            self._route_get()
+            return
+        with self._admitted(DEBUG_LANE if route.startswith("/debug/") else LIGHT_LANE) as admitted:
+            if admitted:
+                self._route_get()
+
+    def _route_get(self) -> None:
         static_map = {
             "/": (INDEX_HTML_PATH, "text/html; charset=utf-8"),
             "/index.html": (INDEX_HTML_PATH, "text/html; charset=utf-8"),
@@ -634,12 +1307,15 @@ class Handler(BaseHTTPRequestHandler):
             "/style.css": (STYLE_CSS_PATH, "text/css; charset=utf-8"),
             "/script.js": (SCRIPT_JS_PATH, "application/javascript; charset=utf-8"),
         }
+        # "/healthz?x=1" なども "/healthz" として扱う（do_GET の枠の判定と同じくクエリを外して比べる）
+        parsed = urlparse(self.path)
+        route = parsed.path
 
-        if self.path == "/favicon.ico":
+        if route == "/favicon.ico":
             self._send_bytes(b"", "image/x-icon", status=204)
             return
 
-        if self.path == "/config":
+        if route == "/config":
             self._send_json(
                 {
                     "google_maps_js_api_key": os.getenv("GOOGLE_MAPS_JS_API_KEY", "").strip(),
@@ -647,11 +1323,48 @@ class Handler(BaseHTTPRequestHandler):
             )
             return
 
-        if self.path == "/api/kijun":
+        if route == "/api/kijun":
             self._send_json({"rows": load_kijun_rows()})
             return
 
-        info = static_map.get(self.path)
+        if route == "/healthz":
+            self._send_json(
+                {
+                    **WARM_STATE,
+                    "coalesced": coalesced_counts(),
+                    "canonicalized": CANONICALIZED_COUNT,
+                    "dataset": DATASETS.stats(),
+                    "geocoder": {"geocode": GEOCODE_GUARD.stats(), "reverse_geocode": KU_GUARD.stats()},
+                    "admission": {
+                        "score": SCORE_LANE.stats(),
+                        "light": LIGHT_LANE.stats(),
+                        "debug": DEBUG_LANE.stats(),
+                        "rate_limit": RATE_LIMITER.stats(),
+                        "server": self.server.stats() if isinstance(self.server, BoundedThreadingHTTPServer) else {},
+                    },
+                },
+                status=200 if WARM_STATE["ready"] else 503,
+            )
+            return
+
+        if route == "/api/nearby":
+            self._handle_nearby(parse_qs(parsed.query))
+            return
+
+        if route == "/submit-stream":
+            # EventSource は GET しかできないので ?address= でも受ける
+            self._handle_submit_stream((parse_qs(parsed.query).get("address", [""])[0] or "").strip())
+            return
+
+        if route == "/debug/profile":
+            self._handle_debug_profile(parse_qs(parsed.query))
+            return
+
+        if route == "/debug/memory":
+            self._handle_debug_memory(parse_qs(parsed.query))
+            return
+
+        info = static_map.get(route)
         if info is None:
             self._send_html("<h1>404 Not Found</h1>", status=404)
             return
@@ -662,8 +1375,215 @@ class Handler(BaseHTTPRequestHandler):
             return
         self._send_bytes(file_path.read_bytes(), content_type)
 
+    def _profile_token(self) -> str:
+        # クエリ文字列で受けるとアクセスログ（リクエスト行）にトークンが残るので、ヘッダだけ見る
+        return self.headers.get("X-Profile-Token") or ""
+
+    def _handle_debug_profile(self, query: dict[str, list[str]]) -> None:
+        """
+        ?seconds=N の間プロセス全体をサンプリングして collapsed stacks（text/plain）を返す
+        """
+        if not token_ok(self._profile_token()):
+            self._send_json({"error": "profiling is disabled or token is wrong"}, status=403)
+            return
+        try:
+            seconds = float(query.get("seconds", ["10"])[0] or 10)
+        except ValueError:
+            self._send_json({"error": "seconds must be a number"}, status=400)
+            return
+        if not 0 < seconds <= PROFILE_MAX_SECONDS:
+            self._send_json({"error": f"seconds must be in (0, {PROFILE_MAX_SECONDS:g}]"}, status=400)
+            return
+        sampler = profile_process(seconds)
+        self._send_bytes(sampler.collapsed().encode("utf-8"), "text/plain; charset=utf-8")
+
+    def _handle_debug_memory(self, query: dict[str, list[str]]) -> None:
+        """
+        構造ごとのメモリの概算。?top=N で tracemalloc の上位 N 件（trace 中でなければここから始めるので、次に呼んだときから見える）、
+        ?trace=start|stop で tracemalloc を始める / 止める。トークンは /debug/profile と同じ
+        """
+        if not token_ok(self._profile_token()):
+            self._send_json({"error": "debug endpoints are disabled or token is wrong"}, status=403)
+            return
+        trace = (query.get("trace", [""])[0] or "").strip()
+        try:
+            top = int(query.get("top", ["0"])[0] or 0)
+        except ValueError:
+            self._send_json({"error": "top must be an integer"}, status=400)
+            return
+        if trace not in ("", "start", "stop"):
+            self._send_json({"error": "trace must be start or stop"}, status=400)
+            return
+        if trace == "stop":
+            tracemalloc.stop()
+        elif (trace == "start" or top > 0) and not tracemalloc.is_tracing():
+            tracemalloc.start(max(TRACEMALLOC_FRAMES, 1))
+        payload = MEMORY.report()
+        if top > 0:
+            payload["top"] = tracemalloc_top(top)
+        self._send_json(payload)
+
+    def _handle_debug_memory_budgets(self) -> None:
+        """
+        POST /debug/memory {"budgets": {"result_cache": "32MB", ...}} で上限を変え（0 で外す）、すぐに1回見る
+        """
+        if not token_ok(self._profile_token()):
+            self._send_json({"error": "debug endpoints are disabled or token is wrong"}, status=403)
+            return
+        length = int(self.headers.get("Content-Length", "0"))
+        try:
+            payload = json.loads(self.rfile.read(length).decode("utf-8"))
+            budgets = payload.get("budgets") if isinstance(payload, dict) else None
+            if not isinstance(budgets, dict):
+                raise ValueError("budgets must be an object of name -> size")
+            parsed = {str(name): parse_size(str(size)) for name, size in budgets.items()}
+        except (ValueError, TypeError) as e:
+            self._send_json({"error": str(e)}, status=400)
+            return
+        MEMORY.set_budgets(parsed)
+        evicted = MEMORY.enforce()
+        MEMORY.start_enforcer()
+        self._send_json({"budgets": dict(MEMORY.budgets), "evicted": evicted})
+
+    def _handle_nearby(self, query: dict[str, list[str]]) -> None:
+        def _first(key: str) -> str:
+            return (query.get(key, [""])[0] or "").strip()
+
+        try:
+            lat = float(_first("lat"))
+            lon = float(_first("lon"))
+            category = _first("category")
+            radius = float(_first("radius")) if _first("radius") else None
+            k = int(_first("k")) if _first("k") else None
+            payload = query_nearby(category, lat, lon, radius_m=radius, k=k)
+        except ValueError as e:
+            self._send_json({"error": str(e)}, status=400)
+            return
+        except Exception as e:
+            self._send_json({"error": str(e)}, status=500)
+            return
+        self._send_json(payload)
+
+    def _handle_submit_coords(self) -> None:
+        """
+        {"lat": .., "lon": ..} -> 1件の結果 / {"points": [{"lat": .., "lon": ..}, ...]} -> {"results": [...]}
+        範囲外の点は採点せずに 400（points のときはその点だけ error）。
+        points は全体で1つの締め切りで、過ぎたら残りの点は error: timeout
+        """
+        length = int(self.headers.get("Content-Length", "0"))
+        raw_bytes = self.rfile.read(length)
+        try:
+            payload = json.loads(raw_bytes.decode("utf-8"))
+            if not isinstance(payload, dict):
+                raise ValueError("request body must be an object")
+            points = payload.get("points")
+            if points is None:
+                lat1, lon1 = parse_coordinates(payload)
+            elif not isinstance(points, list) or not points:
+                raise ValueError("points must be a non-empty list")
+            elif len(points) > COORDS_BATCH_MAX:
+                raise ValueError(f"too many points: {len(points)} > {COORDS_BATCH_MAX}")
+        except (ValueError, TypeError) as e:
+            self._send_json({"error": str(e)}, status=400)
+            return
+
+        # 範囲外などの点は採点しないので、回数制限から引くのは通った点の数だけ
+        checked: list[tuple[float, float] | str] = []
+        for point in points or []:
+            try:
+                checked.append(parse_coordinates(point))
+            except (ValueError, TypeError) as e:
+                checked.append(str(e))
+        cost = 1 if points is None else sum(1 for item in checked if isinstance(item, tuple))
+
+        # 点ごとに逆 geocode するので、点の数だけ回数制限から引く
+        with self._admitted(SCORE_LANE, cost) as admitted:
+            if not admitted:
+                return
+            if points is None:
+                result = build_result_for_coordinates(lat1, lon1)
+                save_result_csv(result)
+                MEASUREMENTS.append(result)
+                self._send_json(result)
+                return
+
+            results: list[dict[str, object] | ScoreResult] = []
+            skipped = 0
+            # batch 全体で1つの締め切り（点ごとの build_result_for_coordinates は入れ子なのでこれに従う）
+            with request_deadline() as deadline:
+                for item in checked:
+                    if isinstance(item, str):
+                        results.append({"error": item})
+                        continue
+                    if deadline is not None and time.monotonic() >= deadline:
+                        # 締め切りを過ぎた点は採点しない（引いた分は戻す）
+                        results.append({"error": CRITERION_TIMEOUT})
+                        skipped += 1
+                        continue
+                    result = build_result_for_coordinates(*item)
+                    save_result_csv(result)
+                    MEASUREMENTS.append(result)
+                    results.append(result)
+            RATE_LIMITER.refund(client_id(self.client_address, self.headers.get("X-Forwarded-For")), skipped)
+            self._send_json({"results": results})
+
     def do_POST(self) -> None:
-        if self.path == "/api/kijun":
+        route = urlparse(self.path).path
+        if route in ("/submit", "/submit-json", "/submit-stream", "/submit-coords"):
+            # 住所（キャッシュにあるか）/ 座標の数 を読んでから枠を決める
+            self._route_post()
+            return
+        # 採点し直し・kijun の再計算は重い枠で受ける
+        if route in ("/api/rank", "/api/kijun", "/api/kijun/simulate"):
+            lane = SCORE_LANE
+        else:
+            lane = DEBUG_LANE if route.startswith("/debug/") else LIGHT_LANE
+        with self._admitted(lane) as admitted:
+            if admitted:
+                self._route_post()
+
+    def _route_post(self) -> None:
+        route = urlparse(self.path).path
+        if route == "/api/rank":
+            length = int(self.headers.get("Content-Length", "0"))
+            raw_bytes = self.rfile.read(length)
+            try:
+                payload = json.loads(raw_bytes.decode("utf-8"))
+                if not isinstance(payload, dict):
+                    raise ValueError("request body must be an object")
+                ranking = rank_locations(payload)
+            except (ValueError, TypeError) as e:
+                self._send_json({"ok": False, "error": str(e)}, status=400)
+                return
+            self._send_json({"ok": True, **ranking})
+            return
+
+        if route == "/api/kijun/simulate":
+            length = int(self.headers.get("Content-Length", "0"))
+            raw_bytes = self.rfile.read(length)
+            try:
+                payload = json.loads(raw_bytes.decode("utf-8"))
+                rows = payload.get("rows", [])
+                if not isinstance(rows, list):
+                    raise ValueError("rows must be a list")
+                candidate_rows = validate_kijun_rows(rows)
+                # 送られてこなかった name は今の表のまま比べる
+                given_names = {row["name"] for row in candidate_rows}
+                candidate_rows += [row for row in load_kijun_rows() if row["name"] not in given_names]
+                candidate = KijunTable(candidate_rows)
+            except Exception as e:
+                self._send_json({"ok": False, "error": str(e)}, status=400)
+                return
+            try:
+                simulation = simulate_kijun(MEASUREMENTS.load_columns(), KijunTable.from_csv(KIJUN_CSV_PATH), candidate)
+            except Exception as e:
+                # 履歴 / 今の kijun 表が読めないなど、送られた表のせいではない失敗
+                self._send_json({"ok": False, "error": str(e)}, status=500)
+                return
+            self._send_json({"ok": True, "source": "history", **simulation})
+            return
+
+        if route == "/api/kijun":
             length = int(self.headers.get("Content-Length", "0"))
             raw_bytes = self.rfile.read(length)
             try:
@@ -675,10 +1595,17 @@ class Handler(BaseHTTPRequestHandler):
             except Exception as e:
                 self._send_json({"ok": False, "error": str(e)}, status=400)
                 return
-            self._send_json({"ok": True, "rows": load_kijun_rows()})
+            self._send_json({"ok": True, "rows": load_kijun_rows(), "rederived": rederive_stored_results()})
+            return
+
+        if route == "/submit-coords":
+            self._handle_submit_coords()
             return
 
-        if self.path not in ("/submit", "/submit-json"):
+        if route == "/debug/memory":
+            self._handle_debug_memory_budgets()
+            return
+        if route not in ("/submit", "/submit-json", "/submit-stream"):
             self._send_html("<h1>404 Not Found</h1>", status=404)
             return
 
@@ -698,20 +1625,35 @@ class Handler(BaseHTTPRequestHandler):
             form = parse_qs(raw)
             address = (form.get("address", [""])[0] or "").strip()
 
+        if route == "/submit-stream":
+            self._handle_submit_stream(address)
+            return
+
         if not address:
-            if self.path == "/submit-json":
+            if route == "/submit-json":
                 self._send_json({"error": "address is required"}, status=400)
             else:
                 self._send_html("<h1>address is required</h1><p><a href='/'>戻る</a></p>", status=400)
             return
 
-        result = build_result_for_address(address)
+        with self._admitted(*self._lane_for_address(address)) as admitted:
+            if not admitted:
+                return
+            # X-Profile-Token ヘッダが PROFILE_TOKEN と一致したときだけ、このリクエストをサンプリングする
+            profile = None
+            profile_token = self._profile_token() if route == "/submit-json" else ""
+            if profile_token and token_ok(profile_token):
+                with RequestProfile(address) as profile:
+                    result = build_result_for_address(address)
+            else:
+                result = build_result_for_address(address)
 
-        save_result_csv(result)
-        if self.path == "/submit-json":
-            self._send_json(result)
-        else:
-            self._send_html(render_result_page(address, result))
+            save_result_csv(result)
+            MEASUREMENTS.append(result)
+            if route == "/submit-json":
+                self._send_json({**result.to_dict(), "profile": profile.summary()} if profile else result)
+            else:
+                self._send_html(render_result_page(address, result))
 
 
 def main() -> None:
@@ -723,10 +1665,33 @@ def main() -> None:
     else:
         host = os.getenv("ADDRESS_SERVER_HOST", "127.0.0.1")
         port = int(os.getenv("ADDRESS_SERVER_PORT", "8000"))
-    httpd = ThreadingHTTPServer((host, port), Handler)
+    # 接続数の上限を超えた分はスレッドを作らずに 503 で閉じる（ADMISSION_MAX_CONNECTIONS）
+    httpd = BoundedThreadingHTTPServer((host, port), Handler)
+    workers = int(os.getenv("SERVER_WORKERS", "1") or 1)
+    if workers > 1 and hasattr(os, "fork"):
+        # マルチプロセス: 親が温めてから fork し、全員で同じソケットを accept する
+        print(f"Server started: http://{host}:{port}")
+        reload_interval = float(os.getenv("SERVER_RELOAD_INTERVAL", "5") or 5)
+        PreforkSupervisor(httpd, workers, warm_up, dataset_signature, reload_interval).run()
+        return
+    # 先に listen してから温める（温まるまで /healthz は 503）
+    threading.Thread(target=warm_up, daemon=True).start()
+    # dataset の変更は裏で作り直して差し替える（pre-fork のときは親がプロセスごと入れ替える）
+    DATASETS.start_watcher()
+    # MEMORY_BUDGETS があれば、超えたキャッシュを古い方から捨てる
+    MEMORY.start_enforcer()
+    # SIGTERM（デプロイの入れ替え）でも下のスナップショット保存まで進める
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=httpd.shutdown, daemon=True).start())
     print(f"Server started: http://{host}:{port}")
     print("Open app.html or address.html via this URL to test.")
-    httpd.serve_forever()
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        if SNAPSHOT_PATH and WARM_STATE["ready"]:
+            print(f"saved warm snapshot: {save_warm_snapshot(SNAPSHOT_PATH)}")
 
 
 if __name__ == "__main__":
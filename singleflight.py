@@ -0,0 +1,62 @@
+import threading
+from typing import Callable, Hashable, TypeVar
+
+
+T = TypeVar("T")
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: object = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """
+    同じ key の計算が実行中なら、後から来た呼び出しは新しく計算せずに最初の結果（例外も）を待って共有する。
+    結果は保持しない（終わったら次の呼び出しはまた計算する）ので、キャッシュとは別に使う。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[..., T], *args) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result  # type: ignore[return-value]
+
+        try:
+            call.result = fn(*args)
+            return call.result  # type: ignore[return-value]
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    def running(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._calls
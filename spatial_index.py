@@ -0,0 +1,238 @@
+import argparse
+import csv
+import math
+from pathlib import Path
+
+from dataset_store import DATASETS
+from kyori import haversine_m
+
+
+BASE_DIR = Path(__file__).resolve().parent
+DATASET_DIR = BASE_DIR / "dataset"
+
+# category -> dataset csv（supermarket は既存ファイル名 "supermaeket.csv" のまま）
+FACILITY_CSV_PATHS: dict[str, Path] = {
+    "station": DATASET_DIR / "station.csv",
+    "park": DATASET_DIR / "park.csv",
+    "supermarket": DATASET_DIR / "supermaeket.csv",
+    "library": DATASET_DIR / "library.csv",
+    "cityoffices": DATASET_DIR / "cityoffices.csv",
+    "kokyou": DATASET_DIR / "kokyou.csv",
+    "hospital": DATASET_DIR / "hospital.csv",
+    "daycare": DATASET_DIR / "daycare.csv",
+}
+
+CSV_ENCODINGS = ["utf-8-sig", "utf-8", "cp932", "shift_jis"]
+
+# 京都市中心付近を原点にした正距円筒図法（市内スケールなら誤差は 0.5% 未満）
+ORIGIN_LAT = 35.0
+ORIGIN_LON = 135.75
+METERS_PER_DEG_LAT = 110574.0
+METERS_PER_DEG_LON = 111320.0 * math.cos(math.radians(ORIGIN_LAT))
+DEFAULT_CELL_M = 250.0
+# 投影距離と haversine の差を吸収するための余裕
+PROJECTION_SLACK = 0.99
+
+
+def _parse_float(value: object) -> float:
+    return float(str(value).strip().replace(",", ""))
+
+
+def _load_csv_rows(path: Path, encodings: list[str]) -> list[dict[str, str]]:
+    last_error = None
+    for enc in encodings:
+        try:
+            with path.open("r", newline="", encoding=enc) as f:
+                return list(csv.DictReader(f))
+        except Exception as e:
+            last_error = e
+    raise RuntimeError(f"failed to read csv: {path}") from last_error
+
+
+def project(lat: float, lon: float) -> tuple[float, float]:
+    return (lon - ORIGIN_LON) * METERS_PER_DEG_LON, (lat - ORIGIN_LAT) * METERS_PER_DEG_LAT
+
+
+def facility_from_row(row: dict[str, str]) -> dict[str, object] | None:
+    """
+    dataset の1行を {id, name, address, lat, lon} にそろえる（座標が無い行は None）
+    """
+    try:
+        lat = _parse_float(row.get("lat", ""))
+        lon = _parse_float(row.get("lng", ""))
+    except Exception:
+        return None
+    return {
+        "id": row.get("id", ""),
+        "name": row.get("name1") or row.get("name2", "") or row.get("name", "") or row.get("addres", ""),
+        "address": row.get("address", "") or row.get("addres", ""),
+        "lat": lat,
+        "lon": lon,
+    }
+
+
+class GridIndex:
+    """
+    一様グリッドの空間インデックス。
+    半径内の件数・k 近傍・最近傍を、周囲のセルだけ見て返す。
+    """
+
+    def __init__(self, facilities: list[dict[str, object]], cell_m: float = DEFAULT_CELL_M):
+        if cell_m <= 0:
+            raise ValueError("cell_m must be greater than 0")
+        self.cell_m = float(cell_m)
+        self.facilities = list(facilities)
+        self.cells: dict[tuple[int, int], list[int]] = {}
+        for i, item in enumerate(self.facilities):
+            self.cells.setdefault(self._cell_of(float(item["lat"]), float(item["lon"])), []).append(i)
+
+    def __len__(self) -> int:
+        return len(self.facilities)
+
+    def _cell_of(self, lat: float, lon: float) -> tuple[int, int]:
+        x, y = project(lat, lon)
+        return int(math.floor(x / self.cell_m)), int(math.floor(y / self.cell_m))
+
+    def _ring(self, cx: int, cy: int, r: int):
+        if r == 0:
+            yield cx, cy
+            return
+        for dx in range(-r, r + 1):
+            yield cx + dx, cy - r
+            yield cx + dx, cy + r
+        for dy in range(-r + 1, r):
+            yield cx - r, cy + dy
+            yield cx + r, cy + dy
+
+    def _distance(self, lat: float, lon: float, i: int) -> float:
+        item = self.facilities[i]
+        return haversine_m(lat, lon, float(item["lat"]), float(item["lon"]))
+
+    def within(self, lat: float, lon: float, radius_m: float) -> list[tuple[float, dict[str, object]]]:
+        """
+        半径 radius_m 以内の施設を (距離m, 施設) の近い順で返す
+        """
+        if radius_m < 0:
+            raise ValueError("radius_m must be >= 0")
+        cx, cy = self._cell_of(lat, lon)
+        reach = int(math.ceil(radius_m / PROJECTION_SLACK / self.cell_m))
+        hits: list[tuple[float, dict[str, object]]] = []
+        for gx in range(cx - reach, cx + reach + 1):
+            for gy in range(cy - reach, cy + reach + 1):
+                for i in self.cells.get((gx, gy), ()):
+                    dist_m = self._distance(lat, lon, i)
+                    if dist_m <= radius_m:
+                        hits.append((dist_m, self.facilities[i]))
+        hits.sort(key=lambda pair: pair[0])
+        return hits
+
+    def count_within(self, lat: float, lon: float, radius_m: float) -> int:
+        return len(self.within(lat, lon, radius_m))
+
+    def k_nearest(self, lat: float, lon: float, k: int) -> list[tuple[float, dict[str, object]]]:
+        """
+        近い順に k 件を (距離m, 施設) で返す
+        """
+        if k <= 0:
+            raise ValueError("k must be >= 1")
+        if not self.facilities:
+            return []
+        k = min(k, len(self.facilities))
+        cx, cy = self._cell_of(lat, lon)
+        found: list[tuple[float, int]] = []
+        seen = 0
+        r = 0
+        while True:
+            for cell in self._ring(cx, cy, r):
+                for i in self.cells.get(cell, ()):
+                    found.append((self._distance(lat, lon, i), i))
+                    seen += 1
+            # リング r まで見れば、投影距離 r*cell_m 以内の点は全部見たことになる
+            if len(found) >= k:
+                found.sort()
+                if found[k - 1][0] <= r * self.cell_m * PROJECTION_SLACK or seen == len(self.facilities):
+                    return [(dist_m, self.facilities[i]) for dist_m, i in found[:k]]
+            elif seen == len(self.facilities):
+                found.sort()
+                return [(dist_m, self.facilities[i]) for dist_m, i in found[:k]]
+            r += 1
+
+    def nearest(self, lat: float, lon: float) -> tuple[float, dict[str, object]] | None:
+        hits = self.k_nearest(lat, lon, 1)
+        return hits[0] if hits else None
+
+
+def build_index_from_csv(path: str | Path, cell_m: float = DEFAULT_CELL_M) -> GridIndex:
+    rows = _load_csv_rows(Path(path), CSV_ENCODINGS)
+    facilities = [item for item in (facility_from_row(row) for row in rows) if item is not None]
+    return GridIndex(facilities, cell_m=cell_m)
+
+
+# 施設の GridIndex は dataset_store の部品 "facility:<category>"（CSV が変わったら watcher が作り直して差し替える）
+for _category, _path in FACILITY_CSV_PATHS.items():
+    DATASETS.register(f"facility:{_category}", [_path], lambda path=_path: build_index_from_csv(path))
+
+
+def get_facility_index(category: str) -> GridIndex:
+    """
+    category の GridIndex を返す（リクエスト中は DATASETS.pin() した版のもの）
+    """
+    path = FACILITY_CSV_PATHS.get(category)
+    if path is None:
+        raise ValueError(f"unknown category: {category} / {sorted(FACILITY_CSV_PATHS)}")
+    if not path.exists():
+        raise FileNotFoundError(f"dataset not found: {path}")
+    return DATASETS.get(f"facility:{category}")  # type: ignore[return-value]
+
+
+def install_index(category: str, index: GridIndex) -> None:
+    """
+    スナップショットから読んだ GridIndex を登録する（中身が同じことは呼び出し側で確認済み）
+    """
+    DATASETS.install(f"facility:{category}", index)
+
+
+def _item_with_distance(dist_m: float, item: dict[str, object]) -> dict[str, object]:
+    out = dict(item)
+    out["distance_m"] = round(dist_m, 1)
+    return out
+
+
+def query_nearby(
+    category: str,
+    lat: float,
+    lon: float,
+    radius_m: float | None = None,
+    k: int | None = None,
+) -> dict[str, object]:
+    """
+    /api/nearby 用: radius_m 指定なら半径内の件数と一覧、k 指定なら近い順 k 件を返す
+    """
+    if (radius_m is None) == (k is None):
+        raise ValueError("specify exactly one of radius or k")
+    index = get_facility_index(category)
+    result: dict[str, object] = {"category": category, "lat": lat, "lon": lon}
+    if radius_m is not None:
+        hits = index.within(lat, lon, radius_m)
+        result["radius_m"] = radius_m
+    else:
+        hits = index.k_nearest(lat, lon, int(k))
+        result["k"] = int(k)
+    result["count"] = len(hits)
+    result["items"] = [_item_with_distance(dist_m, item) for dist_m, item in hits]
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="lat/lon の周辺施設（半径内件数 / k 近傍）を返す")
+    parser.add_argument("--category", required=True, choices=sorted(FACILITY_CSV_PATHS))
+    parser.add_argument("--lat", type=float, required=True)
+    parser.add_argument("--lon", type=float, required=True)
+    parser.add_argument("--radius", type=float, help="半径(m)")
+    parser.add_argument("-k", type=int, help="近い順に返す件数")
+    args = parser.parse_args()
+    print(query_nearby(args.category, args.lat, args.lon, radius_m=args.radius, k=args.k))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import hashlib
+import os
+import pickle
+import time
+from pathlib import Path
+
+
+BASE_DIR = Path(__file__).resolve().parent
+DATASET_DIR = BASE_DIR / "dataset"
+KIJUN_CSV_PATH = BASE_DIR / "score" / "kijun.csv"
+# 空文字にするとスナップショットを使わない
+SNAPSHOT_PATH = os.getenv("WARM_SNAPSHOT_PATH", str(DATASET_DIR / "warm_snapshot.pkl")).strip()
+# 中身の形を変えたら上げる（古いスナップショットは読まずに作り直す）
+SNAPSHOT_VERSION = 1
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def dataset_signature() -> dict[str, str]:
+    """
+    dataset/*.csv と score/kijun.csv の sha256。スナップショットはこれが一致するときだけ使う。
+    """
+    paths = sorted(DATASET_DIR.glob("*.csv")) + [KIJUN_CSV_PATH]
+    return {str(p.relative_to(BASE_DIR)): _sha256(p) for p in paths if p.exists()}
+
+
+def save_snapshot(state: dict[str, object], path: str | Path, signature: dict[str, str] | None = None) -> Path:
+    """
+    state（索引・kijun 表・区の表・よく使う結果）を version と signature 付きで保存する
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = {
+        "version": SNAPSHOT_VERSION,
+        "signature": signature if signature is not None else dataset_signature(),
+        "created_at": time.time(),
+        "state": state,
+    }
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with tmp.open("wb") as f:
+        pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+    return path
+
+
+def load_snapshot(path: str | Path, signature: dict[str, str] | None = None) -> dict[str, object] | None:
+    """
+    スナップショットの state を返す。無い・壊れている・version か signature が違うときは None
+    """
+    path = Path(path)
+    if not path.exists():
+        return None
+    try:
+        with path.open("rb") as f:
+            payload = pickle.load(f)
+    except Exception:
+        return None
+    if not isinstance(payload, dict) or payload.get("version") != SNAPSHOT_VERSION:
+        return None
+    if payload.get("signature") != (signature if signature is not None else dataset_signature()):
+        return None
+    return payload.get("state")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="索引・kijun 表・区の表を作ってウォームスタート用スナップショットに保存する")
+    parser.add_argument("--snapshot", default=SNAPSHOT_PATH or str(DATASET_DIR / "warm_snapshot.pkl"), help="保存先")
+    args = parser.parse_args()
+
+    import server
+
+    started = time.perf_counter()
+    state = server.warm_up(snapshot_path=None)
+    path = server.save_warm_snapshot(args.snapshot)
+    print(f"saved: {path}")
+    print(f"built in {time.perf_counter() - started:.2f}s: {state}")
+
+
+if __name__ == "__main__":
+    main()
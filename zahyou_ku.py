@@ -1,16 +1,7 @@
 import argparse
 import csv
-import os
 from pathlib import Path
 
-import requests
-from dotenv import load_dotenv
-
-
-load_dotenv()
-
-API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
-REVERSE_GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
 
 KYOTO_WARDS = [
     "北区",
@@ -36,52 +27,18 @@ def _extract_ward_from_text(text: str) -> str | None:
     return None
 
 
-def detect_kyoto_ku(lat1: float, lon1: float, language: str = "ja") -> dict[str, object]:
-    if not API_KEY:
-        raise RuntimeError("GOOGLE_MAPS_API_KEY is not set in .env")
-
-    params = {
-        "latlng": f"{lat1},{lon1}",
-        "key": API_KEY,
-        "language": language,
-        "region": "jp",
-    }
-
-    resp = requests.get(REVERSE_GEOCODE_URL, params=params, timeout=15)
-    resp.raise_for_status()
-    data = resp.json()
-
-    status = data.get("status")
-    if status != "OK":
-        return {
-            "lat1": lat1,
-            "lon1": lon1,
-            "ku": "",
-            "error": status or "UNKNOWN_ERROR",
-        }
-
-    for result in data.get("results", []):
-        # Prefer explicit address components first.
-        for comp in result.get("address_components", []):
-            ward = _extract_ward_from_text(comp.get("long_name", ""))
-            if ward:
-                return {"lat1": lat1, "lon1": lon1, "ku": ward, "error": ""}
-
-        # Fallback to formatted address text.
-        ward = _extract_ward_from_text(result.get("formatted_address", ""))
-        if ward:
-            return {"lat1": lat1, "lon1": lon1, "ku": ward, "error": ""}
-
-    return {
-        "lat1": lat1,
-        "lon1": lon1,
-        "ku": "",
-        "error": "KYOTO_WARD_NOT_FOUND",
-    }
-
-
-def detect_kyoto_ku_from_values(lat1: object, lon1: object) -> dict[str, object]:
-    return detect_kyoto_ku(float(lat1), float(lon1))
+def detect_kyoto_ku(lat1: float, lon1: float, language: str = "ja", timeout: float = 15) -> dict[str, object]:
+    """
+    lat1/lon1 -> {lat1, lon1, ku, error}（GEOCODER_BACKEND の backend で逆 geocode する）
+    """
+    # geocoder / gazetteer がここの KYOTO_WARDS を使うので、import は呼ばれたときにする
+    from geocoder import get_geocoder
+
+    return get_geocoder().reverse(lat1, lon1, language=language, timeout=timeout)
+
+
+def detect_kyoto_ku_from_values(lat1: object, lon1: object, timeout: float = 15) -> dict[str, object]:
+    return detect_kyoto_ku(float(lat1), float(lon1), timeout=timeout)
 
 
 def convert_csv(input_csv: str, output_csv: str, lat_col: str = "lat1", lon_col: str = "lon1") -> None: